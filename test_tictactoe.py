@@ -0,0 +1,361 @@
+import asyncio
+import hashlib
+import itertools
+import os
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+import pytest
+import tictactoe
+from tictactoe import (
+    AIInput, BoardShape, BoardStyleLarge, GameEngine, GameServer, MCTSInput, MNKRules, Rules, Symmetry, Tablebase,
+    TicTacToeGame, Win,
+)
+
+def _winner(game_state):
+    for a, b, c in Rules.LINES:
+        if game_state[a] != "-" and game_state[a] == game_state[b] == game_state[c]:
+            return game_state[a]
+    return None
+
+def _children(game_state):
+    mark, _ = GameEngine.marks_to_play(game_state)
+    for i, c in enumerate(game_state):
+        if c == "-":
+            yield i, game_state[:i] + mark + game_state[i + 1:]
+
+@lru_cache(maxsize=None)
+def _minimax(game_state):
+    """Returns (score, best moves) by plain minimax, scoring wins by the empty cells left as AIInput does."""
+    scores = {}
+    for i, child in _children(game_state):
+        if _winner(child):
+            scores[i] = child.count("-") + 1
+        elif "-" not in child:
+            scores[i] = 0
+        else:
+            scores[i] = -_minimax(child)[0]
+    best = max(scores.values())
+    return best, {i for i, score in scores.items() if score == best}
+
+def _playable_states():
+    states = set()
+    pending = ["-" * 9]
+    while pending:
+        game_state = pending.pop()
+        if game_state in states or _winner(game_state) or "-" not in game_state:
+            continue
+        states.add(game_state)
+        pending.extend(child for _, child in _children(game_state))
+    return states
+
+def test_ai_plays_a_best_move_from_every_position(monkeypatch):
+    # Searched rather than read from a tablebase someone may have built.
+    monkeypatch.setattr(tictactoe.Tablebase, "_shared", None)
+    states = _playable_states()
+    assert len(states) == 4520
+    for game_state in states:
+        assert AIInput.choose_move(game_state) in _minimax(game_state)[1], game_state
+
+def test_players_pass_the_board_to_their_input(monkeypatch):
+    monkeypatch.setattr(tictactoe.Tablebase, "_shared", None)
+    monkeypatch.setattr("builtins.input", lambda prompt="": "AI")
+    player = TicTacToeGame._get_player_type("X")
+    assert isinstance(player.input_source, AIInput)
+    assert player.get_turn("X's turn: ", "XX-OO----") == "3"
+    assert player.get_turn("X's turn: ", "XO-XO----") == "7"
+    seen = []
+    class Recorder:
+        def get_turn_input(self, prompt, game_state):
+            seen.append((prompt, game_state))
+            return "1"
+    assert tictactoe.Player("O", Recorder()).get_turn("O's turn: ", "X--------") == "1"
+    assert seen == [("O's turn: ", "X--------")]
+
+def test_board_evaluation_matches_the_line_strings(monkeypatch):
+    states = ["".join(cells) for cells in itertools.product("-XO", repeat=9)]
+    expected = [Rules._discover_wins(Rules._decompose_board(game_state)) for game_state in states]
+    monkeypatch.setattr(Rules, "_outcomes", None)
+    assert [Rules.evaluate_board(game_state) for game_state in states] == expected
+    Rules.build_outcome_table()
+    assert [Rules.evaluate_board(game_state) for game_state in states] == expected
+    assert [Rules.encode(game_state) for game_state in states] == list(range(3 ** 9))
+
+def test_lines_with_the_same_contents_are_all_kept():
+    # Row 1 and Column 1 are both "XXX", and Row 2 and Row 3 are both "X--".
+    line_states = Rules._decompose_board("XXXX--X--")
+    assert len(line_states) == len(Rules.LINES)
+    assert line_states["Row 1"] == line_states["Column 1"] == "XXX"
+    assert Rules._discover_wins(line_states) == Win("Row 1", "X")
+    assert Rules.evaluate_board("XXXX--X--") == Win("Row 1", "X")
+
+def test_engine_rejects_illegal_moves():
+    game = GameEngine()
+    game.play(4)
+    for index in (4, -1, 9):
+        with pytest.raises(ValueError):
+            game.play(index)
+    assert game.game_state == "----X----" and game.turns == 1
+    for index in (0, 3, 1):
+        game.play(index)
+    assert game.play(5) == Win("Row 2", "X")
+    with pytest.raises(ValueError):
+        game.play(8)
+    assert game.game_state == "OO-XXX---" and game.turns == 5
+
+def test_seeded_simulation_is_repeatable():
+    runs = [tictactoe.simulate("random", "rules", 200, processes=1, seed=7) for _ in range(2)]
+    assert runs[0].games == 200
+    assert (runs[0].wins, runs[0].draws, runs[0].lengths) == (runs[1].wins, runs[1].draws, runs[1].lengths)
+
+def test_minimax_always_draws_itself():
+    stats = tictactoe.simulate("minimax", "minimax", 20, processes=1, seed=1)
+    assert stats.draws == 20 and stats.wins == {}
+
+def test_importing_has_no_side_effects(tmp_path):
+    # Run from an empty directory with no stdin, so a game started on import would fail or print.
+    env = {"PATH": os.environ.get("PATH", ""), "PYTHONPATH": os.path.dirname(os.path.abspath(tictactoe.__file__))}
+    result = subprocess.run(
+        [sys.executable, "-c", "import tictactoe"],
+        capture_output=True, text=True, cwd=tmp_path, env=env, stdin=subprocess.DEVNULL,
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout == "" and result.stderr == ""
+    assert list(tmp_path.iterdir()) == []
+
+def _mnk_board(shape, cells, mark="X"):
+    game_state = ["-"] * shape.cells
+    for row, col in cells:
+        game_state[row * shape.columns + col] = mark
+    return "".join(game_state)
+
+@pytest.mark.parametrize("cells, name", [
+    # Along the bottom edge, into the last column.
+    ([(3, 3), (3, 4), (3, 5), (3, 6)], "Row 4"),
+    # Down the first column, from corner to corner.
+    ([(0, 0), (1, 0), (2, 0), (3, 0)], "Column 1"),
+    ([(0, 3), (1, 4), (2, 5), (3, 6)], "Diagonal 1"),
+    ([(0, 6), (1, 5), (2, 4), (3, 3)], "Diagonal 2"),
+])
+def test_mnk_wins_reach_the_edges_and_corners(cells, name):
+    shape = BoardShape(4, 7, 4)
+    rules = MNKRules(shape)
+    game_state = _mnk_board(shape, cells)
+    indices = tuple(sorted(row * shape.columns + col for row, col in cells))
+    for index in indices:
+        assert rules.evaluate_move(game_state, index) == Win(name, "X", cells=indices)
+    assert rules.evaluate_board(game_state) == Win(name, "X", cells=indices)
+    # One short of a win, including along the cells that carry on from the end of one row to the next.
+    assert rules.evaluate_board(_mnk_board(shape, cells[:-1])) is None
+    assert rules.evaluate_board(_mnk_board(shape, [(0, 5), (0, 6), (1, 0), (1, 1)])) is None
+
+def test_turns_parse_as_cells_or_rows_and_columns():
+    shape = BoardShape(4, 7, 4)
+    game = TicTacToeGame(players=(None, None), shape=shape, output=lambda text: None)
+    game.game_state = _mnk_board(shape, [(0, 0)])
+    assert game._parse_turn("2,3") == 9
+    assert game._parse_turn(" 4 , 7 ") == 27
+    assert game._parse_turn("10") == 9
+    assert game._parse_turn("1,1") is None and game._parse_turn("1") is None
+    for turn in ("5,1", "1,8", "0,1", "29", "0", "a,b", "1,2,3", ""):
+        assert game._parse_turn(turn) is None, turn
+
+def test_board_shapes_must_be_winnable():
+    assert BoardShape(4, 7, 7).cells == 28
+    for rows, columns, win_length in ((3, 3, 4), (4, 7, 8), (3, 3, 0), (0, 3, 1), (3, -1, 1)):
+        with pytest.raises(ValueError):
+            BoardShape(rows, columns, win_length)
+
+# Rendered by the board style from before its frames were built from glyph layers.
+GOLDEN_FRAMES = {
+    ("---------", None): (
+        "   ┃   ┃   ",
+        " 1 ┃ 2 ┃ 3 ",
+        "   ┃   ┃   ",
+        "━━━╋━━━╋━━━",
+        "   ┃   ┃   ",
+        " 4 ┃ 5 ┃ 6 ",
+        "   ┃   ┃   ",
+        "━━━╋━━━╋━━━",
+        "   ┃   ┃   ",
+        " 7 ┃ 8 ┃ 9 ",
+        "   ┃   ┃   ",
+    ),
+    ("XO-OX---X", Win("Diagonal 1", "X")): (
+        "╲ ╱┃╭─╮┃   ",
+        " ╲ ┃│ │┃ 3 ",
+        "╱ ╲┃╰─╯┃   ",
+        "━━━╲━━━╋━━━",
+        "╭─╮┃╲ ╱┃   ",
+        "│ │┃ ╲ ┃ 6 ",
+        "╰─╯┃╱ ╲┃   ",
+        "━━━╋━━━╲━━━",
+        "   ┃   ┃╲ ╱",
+        " 7 ┃ 8 ┃ ╲ ",
+        "   ┃   ┃╱ ╲",
+    ),
+}
+# The sha256 of every board the old style rendered, in product("-XO") order, each with no win and then with
+# its win if it has one.
+GOLDEN_DIGEST = "c1da568c36c6d0018f310ce9bae1be51a2ffa2f319f78fecc2f314a23495c54c"
+
+def test_large_board_frames_match_the_golden_frames(monkeypatch):
+    monkeypatch.setattr(BoardStyleLarge, "_frames", {})
+    for (game_state, win), lines in GOLDEN_FRAMES.items():
+        assert BoardStyleLarge.get_board_string(game_state, win) == "\n".join(lines) + "\n"
+    # Twice over, once building the frames and once from the memoized ones.
+    for _ in range(2):
+        digest = hashlib.sha256()
+        for cells in itertools.product("-XO", repeat=9):
+            game_state = "".join(cells)
+            win = Rules.evaluate_board(game_state)
+            for frame_win in ([None, win] if win else [None]):
+                digest.update(BoardStyleLarge.get_board_string(game_state, frame_win).encode())
+        assert digest.hexdigest() == GOLDEN_DIGEST
+
+def test_symmetric_boards_share_a_position(monkeypatch):
+    for name in ("_ids", "_symmetries", "_canonical_states"):
+        monkeypatch.setattr(Symmetry, name, None)
+    reachable = Symmetry._reachable_states()
+    positions = {}
+    for game_state in reachable:
+        position, symmetry = Symmetry.canonicalize(game_state)
+        canonical = Symmetry.canonical_state(position)
+        assert Symmetry.transform(game_state, symmetry) == canonical
+        assert Rules.encode(canonical) == min(Rules.encode(Symmetry.transform(game_state, s)) for s in range(8))
+        positions.setdefault(position, canonical)
+        for index in range(9):
+            canonical_index = Symmetry.to_canonical_move(index, symmetry)
+            assert canonical[canonical_index] == game_state[index]
+            assert Symmetry.from_canonical_move(canonical_index, symmetry) == index
+    assert Symmetry.count() == len(positions) == 765
+    assert sorted(positions) == list(range(765))
+    reachable = set(reachable)
+    for cells in itertools.product("-XO", repeat=9):
+        game_state = "".join(cells)
+        if game_state not in reachable:
+            with pytest.raises(ValueError):
+                Symmetry.canonicalize(game_state)
+
+def test_tablebase_round_trips_through_its_file(tmp_path):
+    path = str(tmp_path / "tablebase.bin")
+    assert Tablebase.build(path) == len(Symmetry._reachable_states())
+    tablebase = Tablebase(path)
+    try:
+        for game_state in _playable_states():
+            score, best = _minimax(game_state)
+            assert tablebase.value(game_state) == score
+            assert set(tablebase.best_moves(game_state)) == best
+        assert tablebase.best_moves("XXXOO----") == []
+        with pytest.raises(ValueError):
+            tablebase.value("XXX------")
+    finally:
+        tablebase.close()
+
+@pytest.mark.parametrize("contents", [
+    b"",
+    b"TTTBASE0" + bytes(Tablebase._HEADER.size - 8 + Tablebase._RECORD.size * 3 ** 9),
+    b"TTTBASE1",
+])
+def test_bad_tablebase_files_are_ignored(tmp_path, monkeypatch, contents):
+    path = tmp_path / "tablebase.bin"
+    path.write_bytes(contents)
+    with pytest.raises(ValueError):
+        Tablebase(str(path))
+    monkeypatch.setattr(tictactoe, "TABLEBASE_PATH", str(path))
+    monkeypatch.setattr(Tablebase, "_shared", False)
+    with pytest.warns(UserWarning, match="Ignoring the tablebase"):
+        assert Tablebase.shared() is None
+    assert AIInput.choose_move("XX-OO----") == 2
+
+def test_mcts_plays_forced_moves_without_searching():
+    shape = BoardShape(4, 4, 3)
+    player = MCTSInput(shape, time_budget=None, playouts=100, processes=1)
+    # X can win at cell 2, which comes before blocking O at cell 14.
+    assert player.choose_move("XX--" "----" "----" "OO--") == 2
+    assert player.last_playouts == 0
+    assert player.choose_move("---X" "----" "X---" "OO--") == 14
+    assert player.last_playouts == 0
+
+def test_mcts_spends_its_playout_budget(monkeypatch):
+    monkeypatch.setattr(MCTSInput, "_trees", OrderedDict())
+    shape = BoardShape(4, 4, 3)
+    player = MCTSInput(shape, time_budget=None, playouts=300, processes=1)
+    game = GameEngine(shape=shape)
+    move = player.choose_move(game.game_state)
+    assert move in game.legal_moves()
+    assert player.last_playouts == 300
+    assert MCTSInput._trees[player._key].visits == 300
+    player.close()
+    assert player._key not in MCTSInput._trees
+
+def test_mcts_keeps_to_its_time_budget():
+    shape = BoardShape(7, 7, 4)
+    player = MCTSInput(shape, time_budget=0.2, processes=1)
+    start = time.perf_counter()
+    move = player.choose_move(GameEngine(shape=shape).game_state)
+    elapsed = time.perf_counter() - start
+    player.close()
+    assert 0 <= move < shape.cells
+    assert player.last_playouts > 0
+    assert 0.2 <= elapsed < 0.5
+
+def test_mcts_moves_with_no_time_to_search():
+    shape = BoardShape(7, 7, 4)
+    for processes in (1, 2):
+        player = MCTSInput(shape, time_budget=0, processes=processes)
+        try:
+            for game_state in ("-" * shape.cells, "X" + "-" * (shape.cells - 1)):
+                move = player.choose_move(game_state)
+                assert game_state[move] == "-"
+                assert player.last_playouts == processes
+        finally:
+            player.close()
+
+def test_mcts_trees_are_bounded_per_process(monkeypatch):
+    monkeypatch.setattr(MCTSInput, "_trees", OrderedDict())
+    monkeypatch.setattr(tictactoe, "MCTS_MAX_TREES", 2)
+    shape = BoardShape(4, 4, 3)
+    players = [MCTSInput(shape, time_budget=None, playouts=10, processes=1) for _ in range(3)]
+    for player in players:
+        player.choose_move(GameEngine(shape=shape).game_state)
+    assert list(MCTSInput._trees) == [players[1]._key, players[2]._key]
+
+def test_server_plays_a_game_over_tcp(monkeypatch):
+    monkeypatch.setattr(Tablebase, "_shared", False)
+
+    async def play():
+        server = GameServer(port=0)
+        await server.start()
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+            # Cells in order, an occupied one just being asked for again.
+            turns = iter(range(1, 10))
+            transcript = []
+            while True:
+                line = (await reader.readline()).decode()
+                if not line:
+                    break
+                transcript.append(line.rstrip("\n"))
+                if transcript[-1] == "Play as X or O?: ":
+                    writer.write(b"X\n")
+                elif transcript[-1].endswith(": "):
+                    writer.write(f"{next(turns)}\n".encode())
+            writer.close()
+            await writer.wait_closed()
+            # The session's bookkeeping finishes after the connection closes.
+            while server.active_sessions:
+                await asyncio.sleep(0.01)
+            return server.games_played, transcript
+        finally:
+            await server.close()
+
+    games_played, transcript = asyncio.run(asyncio.wait_for(play(), 30))
+    assert games_played == 1
+    results = [line for line in transcript if " wins on turn " in line or line == "The game ends in a draw."]
+    assert len(results) == 1 and results[0] == transcript[-1]
+    # The AI plays perfectly, so it can't lose.
+    assert not results[0].startswith("Player X")
@@ -1,5 +1,29 @@
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
 import weather
+import weather_bench
+import weather_archive
+import weather_cache
+import weather_daemon
+import weather_geocode
+import weather_http
+import weather_metrics
+import weather_model
+import weather_render
+import weather_replay
+import weather_time
 
 def test_get_weather():
     nyc_lat = 40.827232375361085
@@ -49,4 +73,750 @@ def test_make_ordinal():
     assert weather._make_ordinal(14) == "14th"
     assert weather._make_ordinal(10) == "10th"
     assert weather._make_ordinal(112) == "112th"
-    assert weather._make_ordinal(-5) == "-5th"
\ No newline at end of file
+    assert weather._make_ordinal(-5) == "-5th"
+
+def test_timestamps_are_formatted_in_the_locations_time_zone():
+    import datetime
+    for offset in (-14400, 0, 19800, 45900):
+        formatter = weather_time.TimestampFormatter(offset)
+        zone = datetime.timezone(datetime.timedelta(seconds=offset))
+        for timestamp in range(1634565600, 1634565600 + 86400 * 3, 3301):
+            local = datetime.datetime.fromtimestamp(timestamp, zone)
+            assert formatter.time(timestamp) == f"{local.hour % 12 or 12}:{local.minute:02d}"
+            assert formatter.long_date(timestamp) == local.strftime(f"%A, %B {weather._make_ordinal(local.day)}")
+            assert formatter.short_date(timestamp) == f"{local.month}/{local.day}/{local:%y}"
+    report = weather.WeatherReport.from_data(40.8, -73.9, _fake_onecall(), {"name": "New York"})
+    assert report.get_hourly_weather().splitlines()[1].startswith("  10:00 |")
+    assert report.get_weekly_weather().split(" : ")[0].strip() == "Monday, October 18th"
+
+def test_snap_coord():
+    assert weather_cache.snap_coord(40.8272, -73.9466) == (40.83, -73.95)
+    assert weather_cache.snap_coord(40.8272, -73.9466, grid=0.1) == (40.8, -73.9)
+    assert weather_cache.snap_coord(40.826, -73.946) == weather_cache.snap_coord(40.834, -73.954)
+
+def test_coord_cache_hits_skip_fetch(tmp_path):
+    calls = []
+    def fetch(lat, long):
+        calls.append((lat, long))
+        return {"current": len(calls)}
+    cache = weather_cache.CoordCache("test", ttl=60, path=str(tmp_path / "cache.sqlite3"))
+    assert cache.get_or_fetch(40.8272, -73.9466, fetch) == {"current": 1}
+    assert cache.get_or_fetch(40.8268, -73.9471, fetch) == {"current": 1}
+    assert len(calls) == 1
+    assert cache.stats.misses == 1
+    assert cache.stats.memory_hits == 1
+
+def test_coord_cache_persists_to_disk(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    weather_cache.CoordCache("test", ttl=60, path=path).put(1, 2, {"name": "Somewhere"})
+    cache = weather_cache.CoordCache("test", ttl=60, path=path)
+    assert cache.get(1, 2) == {"name": "Somewhere"}
+    assert cache.stats.disk_hits == 1
+    assert weather_cache.CoordCache("other", ttl=60, path=path).get(1, 2) is None
+
+def test_coord_cache_expiry_and_eviction(tmp_path):
+    now = [1000.0]
+    cache = weather_cache.CoordCache(
+        "test", ttl=60, max_memory_entries=2, max_disk_entries=2,
+        path=str(tmp_path / "cache.sqlite3"), clock=lambda: now[0],
+    )
+    cache.put(1, 1, {"n": 1})
+    now[0] += 61
+    assert cache.get(1, 1) is None
+    for n in range(2, 5):
+        now[0] += 1
+        cache.put(n, n, {"n": n})
+    assert cache.get(2, 2) is None
+    assert cache.get(4, 4) == {"n": 4}
+
+def test_coord_cache_skips_invalid_results():
+    cache = weather_cache.CoordCache("test", ttl=60, path=None)
+    assert cache.get_or_fetch(1, 2, lambda lat, long: {"cod": 401}, lambda d: "current" in d) == {"cod": 401}
+    assert cache.get(1, 2) is None
+
+def _fake_onecall(n_hourly=48, n_daily=8):
+    conditions = [{"description": "overcast clouds"}]
+    hourly = [
+        {"dt": 1634565600 + 3600 * i, "temp": 290.0 + i % 3, "feels_like": 290.0, "humidity": 56,
+         "wind_speed": 2.0, "wind_deg": 200, "pop": 0.1, "weather": conditions}
+        for i in range(n_hourly)
+    ]
+    daily = [
+        {"dt": 1634565600 + 86400 * i, "temp": {"day": 290.0}, "feels_like": {"day": 295.0}, "humidity": 50,
+         "wind_speed": 5.0, "wind_deg": 100, "pop": 0.2, "weather": conditions}
+        for i in range(n_daily)
+    ]
+    return {"timezone_offset": -14400, "current": dict(hourly[0]), "hourly": hourly, "daily": daily}
+
+def test_report_lookups_run_concurrently(monkeypatch):
+    def slow_weather(lat, long, **kwargs):
+        time.sleep(0.2)
+        return _fake_onecall()
+    def slow_lookup(lat, long):
+        time.sleep(0.2)
+        return {"name": "New York"}
+    monkeypatch.setattr(weather, "_get_weather_info_by_coord", slow_weather)
+    monkeypatch.setattr(weather, "_osm_reverse_lookup", slow_lookup)
+    start = time.perf_counter()
+    report = weather.WeatherReport(40.8, -73.9, use_cache=False)
+    assert time.perf_counter() - start < 0.35
+    assert report.loc_name == "New York"
+    assert report.get_current_weather().startswith("Currently in New York: Overcast clouds")
+
+def test_generate_reports_yields_every_location(monkeypatch):
+    monkeypatch.setattr(weather, "_get_weather_info_by_coord", lambda lat, long, **kwargs: _fake_onecall())
+    monkeypatch.setattr(weather, "_osm_reverse_lookup", lambda lat, long: {"name": f"Site {lat}"})
+    coords = [(float(n), -73.9) for n in range(20)]
+    reports = list(weather.generate_reports(coords, use_cache=False, max_workers=4))
+    assert len(reports) == 20
+    assert sorted(r.loc_name for r in reports) == sorted(f"Site {lat}" for lat, _ in coords)
+    assert all(r.loc_name == f"Site {r.lat}" for r in reports)
+
+def test_generate_reports_skips_failed_locations(monkeypatch):
+    def fetch_weather(lat, long, **kwargs):
+        if lat == 3.0:
+            raise weather_http.UpstreamError("owm kept failing")
+        if lat == 4.0:
+            return {"cod": 401, "message": "Invalid API key"}
+        return _fake_onecall()
+    def lookup(lat, long):
+        return {"error": "Unable to geocode"} if lat == 1.0 else {"name": f"Site {lat}"}
+    monkeypatch.setattr(weather, "_get_weather_info_by_coord", fetch_weather)
+    monkeypatch.setattr(weather, "_osm_reverse_lookup", lookup)
+    coords = [(float(n), -73.9) for n in range(5)]
+    errors = {}
+    reports = list(weather.generate_reports(coords, use_cache=False, max_workers=4, errors=errors))
+    assert sorted(r.loc_name for r in reports) == ["Site 0.0", "Site 2.0"]
+    assert sorted(errors) == [1, 3, 4]
+    assert isinstance(errors[1], KeyError) and isinstance(errors[3], weather_http.UpstreamError)
+    assert isinstance(errors[4], weather_http.UpstreamError) and "Invalid API key" in str(errors[4])
+
+def test_closing_generate_reports_cancels_queued_lookups(monkeypatch):
+    calls = []
+    def slow_weather(lat, long, **kwargs):
+        calls.append(lat)
+        time.sleep(0.01)
+        return _fake_onecall()
+    def slow_lookup(lat, long):
+        calls.append(lat)
+        time.sleep(0.01)
+        return {"name": f"Site {lat}"}
+    monkeypatch.setattr(weather, "_get_weather_info_by_coord", slow_weather)
+    monkeypatch.setattr(weather, "_osm_reverse_lookup", slow_lookup)
+    coords = [(float(n), -73.9) for n in range(50)]
+    batch = weather.generate_reports(coords, use_cache=False, max_workers=2)
+    assert next(batch).loc_name == "Site 0.0"
+    batch.close()
+    assert len(calls) < 10
+
+def _write_cities_csv(path, cities):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("lat,lon,name,admin1,admin2,cc\n")
+        for lat, long, name in cities:
+            f.write(f"{lat},{long},{name},State,County,US\n")
+
+def test_offline_geocoder_finds_nearest_city(tmp_path):
+    csv_path = tmp_path / "cities.csv"
+    _write_cities_csv(csv_path, [
+        (40.71427, -74.00597, "New York City"),
+        (42.25287, -73.79096, "Hudson"),
+        (40.89760, -74.01597, "Teaneck"),
+        (41.84, -94.65, "Carroll"),
+        (51.50853, -0.12574, "London"),
+        (-33.86785, 151.20732, "Sydney"),
+    ])
+    index_path = weather_geocode.build_index(str(csv_path), str(tmp_path / "geocode.idx"))
+    geocoder = weather_geocode.OfflineGeocoder(index_path)
+    assert geocoder.nearest(40.88573, -74.01985)["name"] == "Teaneck"
+    assert geocoder.nearest(42.25195, -73.79160) == {"name": "Hudson", "admin1": "State", "admin2": "County", "cc": "US"}
+    assert [d["name"] for d in geocoder.search([(51.0, 0.5), (-30.0, 150.0), (51.0, 0.5)])] == ["London", "Sydney", "London"]
+
+def test_concurrent_first_lookups_build_the_index_once(tmp_path, monkeypatch):
+    csv_path = tmp_path / "cities.csv"
+    _write_cities_csv(csv_path, [(40.71427, -74.00597, "New York City"), (42.25287, -73.79096, "Hudson")])
+    builds = []
+    build_index = weather_geocode.build_index
+    def slow_build(*args, **kwargs):
+        builds.append(threading.get_ident())
+        time.sleep(0.05)
+        return build_index(str(csv_path), *args[1:], **kwargs)
+    monkeypatch.setattr(weather_geocode, "build_index", slow_build)
+    monkeypatch.setattr(weather_geocode, "DEFAULT_INDEX_PATH", str(tmp_path / "geocode.idx"))
+    monkeypatch.setattr(weather_geocode, "_default_geocoder", None)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        geocoders = list(pool.map(lambda _: weather_geocode.get_default_geocoder(), range(8)))
+    assert len(builds) == 1
+    assert all(geocoder is geocoders[0] for geocoder in geocoders)
+    assert geocoders[0].nearest(42.25, -73.79)["name"] == "Hudson"
+    assert sorted(os.listdir(tmp_path)) == ["cities.csv", "geocode.idx"]
+
+def test_offline_geocoder_matches_brute_force(tmp_path):
+    rng = random.Random(4)
+    cities = [(rng.uniform(-80, 80), rng.uniform(-180, 180), f"City {n}") for n in range(500)]
+    csv_path = tmp_path / "cities.csv"
+    _write_cities_csv(csv_path, cities)
+    geocoder = weather_geocode.OfflineGeocoder(weather_geocode.build_index(str(csv_path), str(tmp_path / "geocode.idx")))
+    queries = [(rng.uniform(-80, 80), rng.uniform(-180, 180)) for _ in range(200)]
+    def brute_force(lat, long):
+        target = weather_geocode._to_xyz(lat, long)
+        return min(cities, key=lambda c: sum((a - b) ** 2 for a, b in zip(weather_geocode._to_xyz(c[0], c[1]), target)))[2]
+    assert [d["name"] for d in geocoder.search(queries)] == [brute_force(*q) for q in queries]
+
+def test_beaufort():
+    assert weather._parse_beaufort_wind_speed(0) == "Calm"
+    assert weather._parse_beaufort_wind_speed(0.99) == "Calm"
+    assert weather._parse_beaufort_wind_speed(1) == "Light air"
+    assert weather._parse_beaufort_wind_speed(12.9) == "Gentle breeze"
+    assert weather._parse_beaufort_wind_speed(13) == "Moderate breeze"
+    assert weather._parse_beaufort_wind_speed(75) == "Hurricane force"
+    assert weather._parse_beaufort_wind_speed(200) == "Hurricane force"
+
+def test_forecast_columns():
+    columns = weather_model.ForecastColumns.from_entries(_fake_onecall(n_hourly=48)["hourly"])
+    assert len(columns) == 48
+    assert len(columns.head(24)) == 24
+    assert columns.descriptions == ["Overcast clouds"]
+    assert columns.description_list()[:2] == ["Overcast clouds", "Overcast clouds"]
+    assert list(weather_model.k_to_f(columns.temp[:3])) == [weather._k_to_f(t) for t in (290.0, 291.0, 292.0)]
+    assert weather_model.compass_points(columns.wind_deg[:1]) == ["SSW"]
+    daily = weather_model.ForecastColumns.from_entries(_fake_onecall(n_daily=8)["daily"], part="day")
+    assert list(daily.feels_like) == [295.0] * 8
+
+def test_column_conversions_match_scalar_helpers():
+    speeds = array("d", [0, 0.4, 1, 3.6, 5.9, 10, 17.3, 33.4, 40])
+    headings = array("d", range(0, 360, 7))
+    assert list(weather_model.mps_to_mph(speeds)) == [weather._mps_to_mph(s) for s in speeds]
+    assert weather_model.beaufort_descriptions(speeds) == [weather._parse_beaufort_wind_speed(s) for s in speeds]
+    assert weather_model.compass_points(headings) == [weather._parse_compass_heading(h) for h in headings]
+
+def test_render_table_repeat_and_continuity_markers():
+    layout = weather_render.TableLayout(columns=(("a", " | "), ("b", "")), repeat_columns=frozenset({"b"}))
+    rows = [("1", "x"), ("2", "x"), ("3", "x"), ("4", "yy"), ("5", "x"), ("6", "x")]
+    assert weather_render.render_table(layout, rows, "Header\n") == (
+        "Header\n"
+        "1 | x \n"
+        "2 | ╎ \n"
+        "3 | ↓ \n"
+        "4 | yy\n"
+        "5 | x \n"
+        "6 | ↓ \n"
+    )
+
+def test_streamed_table_matches_buffered_table():
+    report = weather.WeatherReport.from_data(40.8, -73.9, _fake_onecall(), {"name": "New York"})
+    buffered = io.StringIO()
+    widths = report.write_hourly_weather(buffered)
+    lines = buffered.getvalue().splitlines()
+    assert len(lines) == 48
+    streamed = io.StringIO()
+    report.write_hourly_weather(streamed, widths=widths)
+    assert streamed.getvalue() == buffered.getvalue()
+    assert report.get_hourly_weather().splitlines()[1:24] == lines[:23]
+
+def _emulate_terminal(output, lines=60):
+    """Plays back the cursor moves, line clears and scrolls the watch view writes, and returns the screen."""
+    import re
+    screen = [""] * lines
+    row, col, region = 0, 0, (0, lines - 1)
+    for token in re.findall(r"\x1b\[[0-9;?]*[A-Za-z]|[^\x1b]+", output):
+        if not token.startswith("\x1b"):
+            line = screen[row].ljust(col)
+            screen[row] = line[:col] + token + line[col + len(token):]
+            col += len(token)
+            continue
+        args, command = token[2:-1], token[-1]
+        numbers = [int(n) for n in args.split(";") if n.isdigit()]
+        if command == "H":
+            row, col = (numbers[0] - 1, numbers[1] - 1) if numbers else (0, 0)
+        elif command == "J":
+            screen = [""] * lines
+        elif command == "K":
+            screen[row] = ""
+        elif command == "r":
+            region = (numbers[0] - 1, numbers[1] - 1) if numbers else (0, lines - 1)
+            row, col = 0, 0
+        elif command == "S":
+            top, bottom = region
+            for _ in range(numbers[0]):
+                screen[top:bottom + 1] = screen[top + 1:bottom + 1] + [""]
+    return [line.rstrip() for line in screen]
+
+def _watch_screen(report):
+    expected = (report.get_current_weather() + "\n" + report.get_hourly_weather()).splitlines()
+    return [line.rstrip() for line in expected]
+
+def test_watch_rewrites_only_what_changed():
+    import weather_watch
+    sink = io.StringIO()
+    view = weather_watch.HourlyWatch(sink)
+    payload = _fake_onecall()
+    report = weather.WeatherReport.from_data(40.8, -73.9, payload, {"name": "New York"})
+    assert view.show(report) == 24 * 6
+    assert _emulate_terminal(sink.getvalue())[:26] == _watch_screen(report)
+
+    # One hour's temperature and another's conditions change.
+    payload["hourly"][5] = dict(payload["hourly"][5], temp=300.0)
+    payload["hourly"][9] = dict(payload["hourly"][9], weather=[{"description": "light rain"}])
+    report = weather.WeatherReport.from_data(40.8, -73.9, payload, {"name": "New York"})
+    written = sink.tell()
+    assert view.show(report) <= 6
+    assert len(sink.getvalue()) - written < 200
+    assert _emulate_terminal(sink.getvalue())[:26] == _watch_screen(report)
+
+    # An hour later the forecast has moved on by one hour, and the table scrolls rather than redrawing.
+    payload = dict(payload, hourly=payload["hourly"][1:], current=payload["hourly"][1])
+    report = weather.WeatherReport.from_data(40.8, -73.9, payload, {"name": "New York"})
+    assert view.show(report) < 24
+    assert _emulate_terminal(sink.getvalue())[:26] == _watch_screen(report)
+
+    # Nothing changed, nothing written but the cursor park.
+    assert view.show(report) == 0
+
+def test_watch_keeps_the_last_screen_when_a_poll_has_no_forecast(monkeypatch):
+    import weather_watch
+    good = _fake_onecall()
+    later = dict(good, current=dict(good["current"], humidity=80))
+    payloads = [good, {"cod": 401, "message": "Invalid API key"}, later]
+    screens = []
+    sink = io.StringIO()
+    def fetch_weather(lat, long, use_cache=True, reports=weather.ALL_REPORTS):
+        screens.append(_emulate_terminal(sink.getvalue())[:26])
+        return payloads[len(screens) - 1]
+    monkeypatch.setattr(weather, "get_weather_info", fetch_weather)
+    monkeypatch.setattr(weather, "get_location_info", lambda lat, long, *args: {"name": "New York"})
+    weather_watch.watch(40.8, -73.9, interval=0, sink=sink, polls=3)
+    first = weather.WeatherReport.from_data(40.8, -73.9, good, {"name": "New York"})
+    # The failed second poll left the first forecast on screen for the third.
+    assert screens[1] == screens[2] == _watch_screen(first)
+    report = weather.WeatherReport.from_data(40.8, -73.9, later, {"name": "New York"})
+    assert _emulate_terminal(sink.getvalue())[:26] == _watch_screen(report)
+
+    # A report built without current conditions is turned away before anything is drawn.
+    written = sink.tell()
+    failed = weather.WeatherReport.from_data(40.8, -73.9, dict(good, current=None), {"name": "New York"})
+    with pytest.raises(ValueError):
+        weather_watch.HourlyWatch(sink).show(failed)
+    assert sink.tell() == written
+
+def test_error_payloads_fail_with_the_providers_message():
+    with pytest.raises(weather_http.UpstreamError, match="Invalid API key"):
+        weather.WeatherReport.from_data(40.8, -73.9, {"cod": 401, "message": "Invalid API key"}, {"name": "New York"})
+    with weather_replay.ReplayServer(error_rate=1.0, error_status=401) as server, weather_bench.pointed_at(server.url):
+        with pytest.raises(weather_http.UpstreamError, match="Injected error"):
+            weather.WeatherReport(40.8272, -73.9466, use_cache=False)
+
+def test_forecast_archive_range_queries(tmp_path):
+    archive = weather_archive.ForecastArchive(str(tmp_path))
+    for i in range(5):
+        payload = _fake_onecall(n_hourly=48, n_daily=8)
+        assert archive.append(40.8272, -73.9466, payload, fetched_at=1000 + 600 * i) == 1 + 48 + 8
+    with pytest.raises(ValueError):
+        archive.append(40.8272, -73.9466, _fake_onecall(), fetched_at=999)
+    archive.append(42.25, -73.79, _fake_onecall(n_hourly=3), fetched_at=1000)
+
+    # A fresh instance reads everything back from disk.
+    archive = weather_archive.ForecastArchive(str(tmp_path))
+    assert archive.locations() == [(40.83, -73.95), (42.25, -73.79)]
+    hourly = list(archive.query(40.83, -73.95, "hourly", start=1600, end=2800))
+    assert len(hourly) == 2 * 48
+    assert {r.fetched_at for r in hourly} == {1600, 2200}
+    assert hourly[1].dt == 1634565600 + 3600 and hourly[1].temp == pytest.approx(291.0)
+    assert archive.descriptions()[hourly[0].description] == "Overcast clouds"
+    assert len(archive.column(40.83, -73.95, "temp", "daily")) == 5 * 8
+    assert list(archive.column(40.83, -73.95, "fetched_at", "current", start=2000)) == [2200, 2800, 3400]
+    assert list(archive.query(10.0, 10.0)) == []
+
+def test_archive_writers_share_description_codes(tmp_path):
+    def payload(description):
+        payload = _fake_onecall(n_hourly=2, n_daily=1)
+        for entry in payload["hourly"] + payload["daily"] + [payload["current"]]:
+            entry["weather"] = [{"description": description}]
+        return payload
+
+    # Two writers on one archive, as with a cron job and the daemon, each adding descriptions the other hasn't seen.
+    first = weather_archive.ForecastArchive(str(tmp_path))
+    second = weather_archive.ForecastArchive(str(tmp_path))
+    first.append(40.8272, -73.9466, payload("overcast clouds"), fetched_at=1000)
+    second.append(40.8272, -73.9466, payload("light rain"), fetched_at=1600)
+    first.append(42.25, -73.79, payload("clear sky"), fetched_at=1600)
+    with pytest.raises(ValueError):
+        first.append(40.8272, -73.9466, payload("clear sky"), fetched_at=1200)
+
+    for archive in (first, second, weather_archive.ForecastArchive(str(tmp_path))):
+        descriptions = archive.descriptions()
+        hourly = list(archive.query(40.83, -73.95, "hourly"))
+        assert [descriptions[r.description] for r in hourly] == ["Overcast clouds"] * 2 + ["Light rain"] * 2
+        assert [descriptions[r.description] for r in archive.query(42.25, -73.79)] == ["Clear sky"] * 2
+
+def test_fetched_forecasts_are_archived(tmp_path, monkeypatch):
+    monkeypatch.setattr(weather, "ARCHIVE_DIR", str(tmp_path))
+    with weather_replay.ReplayServer() as server, weather_bench.pointed_at(server.url):
+        weather.get_weather_info(40.8272, -73.9466, use_cache=False)
+    temps = weather_archive.ForecastArchive(str(tmp_path)).column(40.8272, -73.9466, "temp")
+    assert len(temps) == 48
+
+def test_archive_stamps_appends_in_order_when_the_clock_steps_back(tmp_path, monkeypatch):
+    archive = weather_archive.ForecastArchive(str(tmp_path))
+    clock = iter([2000.0, 1000.0])
+    monkeypatch.setattr(weather_archive.time, "time", lambda: next(clock))
+    archive.append(40.8272, -73.9466, _fake_onecall(n_hourly=2, n_daily=0))
+    archive.append(40.8272, -73.9466, _fake_onecall(n_hourly=2, n_daily=0))
+    assert [r.fetched_at for r in archive.query(40.8272, -73.9466, "hourly")] == [2000] * 4
+
+def test_archive_failures_dont_fail_the_fetch(tmp_path, monkeypatch, caplog):
+    class BrokenArchive:
+        def append(self, lat, long, weather_dict):
+            raise OSError("No space left on device")
+    monkeypatch.setattr(weather, "ARCHIVE_DIR", str(tmp_path))
+    monkeypatch.setattr(weather, "_get_archive", BrokenArchive)
+    monkeypatch.setattr(weather, "_get_weather_info_by_coord", lambda lat, long, **kwargs: _fake_onecall())
+    assert weather.get_weather_info(40.8272, -73.9466, use_cache=False) == _fake_onecall()
+    assert any("No space left on device" in record.exc_text for record in caplog.records if record.exc_text)
+
+# Cold import budget for weather.py, so cron driven runs start in tens of milliseconds.
+IMPORT_BUDGET_MS = 50
+
+def test_cold_import_is_fast_and_lazy(tmp_path):
+    script = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        "import weather\n"
+        "elapsed = (time.perf_counter() - start) * 1000\n"
+        "loaded = [m for m in ('requests', 'sqlite3', 'weather_secrets', 'weather_geocode') if m in sys.modules]\n"
+        "print(elapsed, ','.join(loaded))\n"
+    )
+    # Run from an empty directory, with only the repo importable, so no secrets file can be found.
+    env = {"PATH": os.environ.get("PATH", ""), "PYTHONPATH": os.path.dirname(os.path.abspath(weather.__file__))}
+    timings = []
+    for _ in range(3):
+        result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, cwd=tmp_path, env=env)
+        assert result.returncode == 0, result.stderr
+        elapsed, _, loaded = result.stdout.strip().partition(" ")
+        assert loaded == ""
+        timings.append(float(elapsed))
+    assert min(timings) < IMPORT_BUDGET_MS
+
+def test_api_key_from_environment(monkeypatch):
+    monkeypatch.setenv("OWM_API_KEY", "from-env")
+    assert weather._get_owm_api_key() == "from-env"
+
+def test_report_from_replay_server():
+    with weather_replay.ReplayServer() as server, weather_bench.pointed_at(server.url):
+        report = weather.WeatherReport(40.8272, -73.9466, use_cache=False)
+    assert report.loc_name == "New York"
+    assert len(report.hourly) == 48
+    assert report.get_hourly_weather().startswith("Next 24 hours in New York:\n")
+    assert server.request_counts == {"/data/2.5/onecall": 1, "/reverse": 1}
+
+def test_replay_server_injects_errors():
+    with weather_replay.ReplayServer(error_rate=1.0, error_status=401) as server, weather_bench.pointed_at(server.url):
+        assert weather.get_weather_info(40.8272, -73.9466, use_cache=False) == {"cod": 401, "message": "Injected error"}
+    assert server.error_count == 1
+
+def test_failed_requests_are_retried_with_backoff(monkeypatch):
+    monkeypatch.setattr(weather_http, "BACKOFF_BASE", 0.001)
+    with weather_replay.ReplayServer(error_rate=1.0, error_status=503) as server, weather_bench.pointed_at(server.url):
+        with pytest.raises(weather_http.UpstreamError):
+            weather.get_weather_info(40.8272, -73.9466, use_cache=False)
+    assert server.error_count == weather_http.MAX_RETRIES + 1
+    with weather_replay.ReplayServer(error_rate=0.5, error_status=429, seed=4) as server, weather_bench.pointed_at(server.url):
+        assert "hourly" in weather.get_weather_info(40.8272, -73.9466, use_cache=False)
+    assert server.error_count == 3
+    assert server.request_counts["/data/2.5/onecall"] == 4
+
+def test_retries_stop_at_the_deadline(monkeypatch):
+    monkeypatch.setattr(weather_http, "BACKOFF_BASE", 1.0)
+    monkeypatch.setattr(weather_http, "BACKOFF_CAP", 1.0)
+    monkeypatch.setattr(weather_http.random, "uniform", lambda low, high: high)
+    with weather_replay.ReplayServer(error_rate=1.0, error_status=500) as server, weather_bench.pointed_at(server.url):
+        start = time.perf_counter()
+        with pytest.raises(weather_http.DeadlineExceeded):
+            weather_http.get_json(server.url + "/reverse", deadline=0.5)
+    # The one second backoff would overrun the deadline, so it gives up without sleeping.
+    assert time.perf_counter() - start < 1.0
+    assert server.error_count == 1
+
+def test_token_bucket_paces_requests():
+    bucket = weather_http.TokenBucket(rate=50, capacity=2)
+    start = time.perf_counter()
+    for _ in range(7):
+        assert bucket.acquire()
+    # Two tokens are there from the start, the other five arrive one every 20ms.
+    assert time.perf_counter() - start >= 0.09
+    assert not bucket.acquire(deadline=time.monotonic())
+
+def test_token_bucket_serves_interactive_requests_first():
+    bucket = weather_http.TokenBucket(rate=20, capacity=1)
+    bucket.acquire()
+    order = []
+
+    def take(name, priority):
+        bucket.acquire(priority)
+        order.append(name)
+
+    threads = [threading.Thread(target=take, args=(f"background-{i}", weather_http.PRIORITY_BACKGROUND)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.01)
+    threads.append(threading.Thread(target=take, args=("interactive", weather_http.PRIORITY_INTERACTIVE)))
+    threads[-1].start()
+    for thread in threads:
+        thread.join()
+    assert order == ["interactive", "background-0", "background-1"]
+
+def test_token_bucket_caps_holders_in_priority_order():
+    bucket = weather_http.TokenBucket(rate=None, concurrency=1)
+    assert bucket.acquire()
+    assert not bucket.acquire(deadline=time.monotonic() + 0.05)
+    order = []
+
+    def take(name, priority):
+        bucket.acquire(priority)
+        order.append(name)
+        bucket.release()
+
+    threads = [threading.Thread(target=take, args=("background", weather_http.PRIORITY_BACKGROUND))]
+    threads[0].start()
+    time.sleep(0.01)
+    threads.append(threading.Thread(target=take, args=("interactive", weather_http.PRIORITY_INTERACTIVE)))
+    threads[-1].start()
+    time.sleep(0.01)
+    bucket.release()
+    for thread in threads:
+        thread.join()
+    assert order == ["interactive", "background"]
+
+def test_waiting_for_a_slot_counts_against_the_deadline():
+    with weather_replay.ReplayServer() as server, weather_bench.pointed_at(server.url):
+        # Another request holds Nominatim's only slot.
+        weather_http._buckets["nominatim"].acquire()
+        start = time.perf_counter()
+        with pytest.raises(weather_http.DeadlineExceeded):
+            weather_http.get_json(server.url + "/reverse", provider="nominatim", deadline=0.2)
+        assert time.perf_counter() - start < 0.5
+        weather_http._buckets["nominatim"].release()
+        assert weather_http.get_json(server.url + "/reverse", provider="nominatim", deadline=0.5)
+    assert server.request_counts["/reverse"] == 1
+
+def test_bench_results_are_comparable():
+    results = {"results": weather_bench.bench_render([24], iterations=2)}
+    assert [r["name"] for r in results["results"]] == ["render_current", "render_hourly", "render_weekly"]
+    assert all(r["p50_s"] > 0 for r in results["results"])
+    lines = weather_bench.compare(results, json.loads(json.dumps(results)))
+    assert lines[1] == f"render_hourly(hours=24): {results['results'][1]['p50_s'] * 1000:.3f}ms -> {results['results'][1]['p50_s'] * 1000:.3f}ms (+0.0%)"
+
+def test_metrics_are_off_by_default():
+    assert not weather_metrics.enabled()
+    assert weather_metrics.timer("anything") is weather_metrics._NULL_TIMER
+
+def test_metrics_record_each_phase(tmp_path, caplog):
+    sink = weather_metrics.PrometheusSink()
+    weather_metrics.add_sink(sink)
+    weather_metrics.add_sink(weather_metrics.LogSink())
+    try:
+        with weather_replay.ReplayServer() as server, weather_bench.pointed_at(server.url), caplog.at_level("INFO"):
+            report = weather.WeatherReport(40.8272, -73.9466, use_cache=False)
+            report.get_current_weather()
+            report.get_hourly_weather()
+            report.get_weekly_weather()
+            weather_cache.CoordCache("test", ttl=60, path=None).get(1, 2)
+    finally:
+        weather_metrics.clear_sinks()
+    for phase, labels in [
+        ("report_init", {}), ("parse", {}), ("request", {"provider": "owm"}), ("request", {"provider": "nominatim"}),
+        ("decode", {"provider": "owm"}), ("render", {"report": "current"}), ("render", {"report": "hourly"}),
+        ("render", {"report": "weekly"}),
+    ]:
+        assert sink.summary(phase, **labels)["count"] == 1
+    assert 0 < sink.total("response", kind="bytes", provider="owm") < os.path.getsize(os.path.join(weather_replay.FIXTURES_DIR, "onecall.json"))
+    assert sink.total("cache", outcome="miss", namespace="test") == 1
+    text = sink.render()
+    assert "# TYPE weather_request_seconds histogram" in text
+    assert 'weather_request_seconds_count{provider="owm"} 1' in text
+    assert 'weather_cache_total{namespace="test",outcome="miss"} 1' in text
+    assert any(json.loads(r.getMessage())["name"] == "report_init" for r in caplog.records)
+
+def test_daemon_serves_stale_reports_while_refreshing():
+    now = [0.0]
+    release = threading.Event()
+    calls = []
+    def fetch_weather(lat, long):
+        calls.append(now[0])
+        if len(calls) > 1:
+            release.wait(5)
+        payload = _fake_onecall()
+        payload["current"]["humidity"] = len(calls)
+        return payload
+    store = weather_daemon.ReportStore(
+        {"nyc": (40.8, -73.9)}, refresh_after=60, max_stale=300,
+        fetch_weather=fetch_weather, fetch_location=lambda lat, long: {"name": "New York"}, clock=lambda: now[0],
+    )
+    store.refresh("nyc")
+    text, age, stale = store.get("nyc", "current")
+    assert "1% humid" in text and age == 0 and not stale
+    now[0] = 90.0
+    assert "1% humid" in store.get("nyc", "current")[0]
+    assert store.entries["nyc"].refreshing
+    assert "1% humid" in store.get("nyc", "current")[0]
+    release.set()
+    for _ in range(100):
+        if not store.entries["nyc"].refreshing:
+            break
+        time.sleep(0.01)
+    assert len(calls) == 2
+    assert "2% humid" in store.get("nyc", "current")[0]
+
+def test_daemon_retries_failed_location_lookups_with_back_off():
+    now = [0.0]
+    lookups = []
+    def fetch_location(lat, long):
+        lookups.append(now[0])
+        return {"error": "Unable to geocode"} if len(lookups) == 1 else {"name": "New York"}
+    store = weather_daemon.ReportStore(
+        {"nyc": (40.8, -73.9)}, fetch_weather=lambda lat, long: _fake_onecall(),
+        fetch_location=fetch_location, clock=lambda: now[0],
+    )
+    entry = store.entries["nyc"]
+    def wait_for_refresh():
+        for _ in range(100):
+            if not entry.refreshing:
+                return
+            time.sleep(0.01)
+    with pytest.raises(KeyError):
+        store.get("nyc", "current")
+    wait_for_refresh()
+    assert entry.loc_dict is None
+    assert "Unable to geocode" in entry.last_error
+    now[0] = weather_daemon.RETRY_DELAY - 1
+    for _ in range(5):
+        with pytest.raises(KeyError):
+            store.get("nyc", "current")
+    assert not entry.refreshing and lookups == [0.0]
+    now[0] = weather_daemon.RETRY_DELAY
+    with pytest.raises(KeyError):
+        store.get("nyc", "current")
+    wait_for_refresh()
+    assert lookups == [0.0, weather_daemon.RETRY_DELAY]
+    assert entry.loc_dict == {"name": "New York"} and entry.last_error is None
+    assert "New York" in store.get("nyc", "current")[0]
+
+def test_daemon_refreshes_faster_than_the_retry_delay():
+    now = [0.0]
+    calls = []
+    def fetch_weather(lat, long):
+        calls.append(now[0])
+        return _fake_onecall()
+    store = weather_daemon.ReportStore(
+        {"nyc": (40.8, -73.9)}, refresh_after=10, fetch_weather=fetch_weather,
+        fetch_location=lambda lat, long: {"name": "New York"}, clock=lambda: now[0],
+    )
+    entry = store.entries["nyc"]
+    for t in (0.0, 10.0, 20.0):
+        now[0] = t
+        try:
+            store.get("nyc", "current")
+        except KeyError:
+            pass
+        for _ in range(100):
+            if not entry.refreshing:
+                break
+            time.sleep(0.01)
+    assert calls == [0.0, 10.0, 20.0]
+
+def test_daemon_http_routes():
+    store = weather_daemon.ReportStore(
+        {"nyc": (40.8, -73.9)}, fetch_weather=lambda lat, long, **kwargs: _fake_onecall(),
+        fetch_location=lambda lat, long: {"name": "New York"},
+    )
+    store.refresh("nyc")
+    server = weather_daemon.make_server(store, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        with urllib.request.urlopen(f"{base}/nyc/weekly") as response:
+            assert response.read().decode() == store.get("nyc", "weekly")[0]
+        with urllib.request.urlopen(f"{base}/status") as response:
+            assert json.loads(response.read())["nyc"]["error"] is None
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"{base}/nowhere/weekly")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_single_flight_shares_one_call():
+    flights = weather_cache.SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    def slow_fetch(n):
+        started.set()
+        release.wait(5)
+        return {"n": n}
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        leader = pool.submit(flights.do, "nyc", slow_fetch, 1)
+        started.wait(5)
+        followers = [pool.submit(flights.do, "nyc", slow_fetch, 2) for _ in range(7)]
+        while flights.coalesced < 7:
+            time.sleep(0.001)
+        release.set()
+        results = [leader.result()] + [f.result() for f in followers]
+    assert results == [{"n": 1}] * 8
+    assert flights.calls == 1
+    assert flights.coalesced == 7
+    assert flights.do("nyc", lambda: "fresh") == "fresh"
+
+def test_single_flight_propagates_errors():
+    flights = weather_cache.SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    def failing_fetch():
+        started.set()
+        release.wait(5)
+        raise ConnectionError("upstream down")
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        futures = [pool.submit(flights.do, "nyc", failing_fetch)]
+        started.wait(5)
+        futures += [pool.submit(flights.do, "nyc", failing_fetch) for _ in range(3)]
+        while flights.coalesced < 3:
+            time.sleep(0.001)
+        release.set()
+        for future in futures:
+            with pytest.raises(ConnectionError):
+                future.result()
+    assert flights.calls == 1
+
+def test_concurrent_cache_misses_coalesce():
+    calls = []
+    def fetch(lat, long):
+        calls.append((lat, long))
+        time.sleep(0.1)
+        return {"current": 1}
+    cache = weather_cache.CoordCache("test", ttl=60, path=None)
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        results = list(pool.map(lambda c: cache.get_or_fetch(*c, fetch), [(40.8271, -73.9466), (40.8269, -73.9468)] * 3))
+    assert results == [{"current": 1}] * 6
+    assert len(calls) == 1
+
+def test_reports_request_only_the_sections_they_need():
+    with weather_replay.ReplayServer() as server, weather_bench.pointed_at(server.url):
+        current_only = weather.WeatherReport(40.8272, -73.9466, use_cache=False, reports=("current",))
+        everything = weather.WeatherReport(40.8272, -73.9466, use_cache=False)
+    assert server.excludes_seen == ["minutely,hourly,daily", "minutely"]
+    assert current_only.get_current_weather() == everything.get_current_weather()
+    assert len(current_only.hourly) == 0
+    assert len(everything.hourly) == 48
+    for render in (current_only.get_hourly_weather, current_only.get_weekly_weather):
+        with pytest.raises(ValueError):
+            render()
+    with pytest.raises(ValueError):
+        current_only.write_weekly_weather(io.StringIO())
+    assert everything.get_weekly_weather() and everything.get_hourly_weather()
+
+def test_project_payload_keeps_only_rendered_fields():
+    payload = weather_bench.load_fixture()
+    projected = weather_model.project_payload(payload, ("current", "hourly"))
+    assert set(projected) == {"lat", "lon", "timezone", "timezone_offset", "current", "hourly"}
+    assert set(projected["hourly"][0]) == set(weather_model.FORECAST_FIELDS) | {"weather"}
+    assert projected["hourly"][0]["weather"] == [{"description": payload["hourly"][0]["weather"][0]["description"]}]
+    assert len(json.dumps(projected)) < len(json.dumps(payload)) / 2
+    assert weather_model.project_payload({"cod": 401, "message": "Invalid API key"}, ("current",)) == {"cod": 401, "message": "Invalid API key"}
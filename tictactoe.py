@@ -1,6 +1,17 @@
-from dataclasses import dataclass
+import asyncio
+import math
+import mmap
+import os
+import random
+import struct
+import time
+import warnings
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import partial
 from itertools import cycle
-from typing import Optional, Union
+from typing import Callable, Optional, Sequence, Union
 
 
 @dataclass(frozen=True)
@@ -15,13 +26,48 @@ class CharSub:
             raise ValueError("Arguments with different lengths given.")
 
 
-@dataclass
+@dataclass(frozen=True)
 class Win:
     """An data class for containing information describing a win."""
 
     line_name: str
     player_name: Optional[str]
     turn: Optional[int] = None
+    # The indices of the winning cells, where the board's shape doesn't fix them by line name alone.
+    cells: Optional[tuple] = None
+
+
+@dataclass(frozen=True)
+class BoardShape:
+    """The size of an m,n,k board: its rows, its columns, and how many marks in a line win on it."""
+
+    rows: int = 3
+    columns: int = 3
+    win_length: int = 3
+
+    def __post_init__(self):
+        if self.rows < 1 or self.columns < 1 or not 1 <= self.win_length <= max(self.rows, self.columns):
+            raise ValueError(f"A {self.rows}x{self.columns} board can't be won with {self.win_length} in a row.")
+
+    @property
+    def cells(self) -> int:
+        return self.rows * self.columns
+
+
+STANDARD_SHAPE = BoardShape()
+TABLEBASE_PATH = os.environ.get(
+    "TICTACTOE_TABLEBASE",
+    os.path.join(os.path.expanduser("~"), ".cache", "tictactoe", "tablebase.bin"),
+)
+SERVER_PORT = 8766
+# Connections waiting to be accepted, as a burst of clients past asyncio's default of 100 would have their
+# connections dropped and retried seconds later.
+SERVER_BACKLOG = 4096
+# Seconds a server's client gets to answer each prompt, and the AI to move on boards it can't look moves up for.
+CLIENT_TIMEOUT = 300.0
+SERVER_MOVE_BUDGET = 0.5
+# Search trees each process keeps between moves, dropping the least recently searched past this.
+MCTS_MAX_TREES = 64
 
 
 def substitute_chars(base_string: str, sub: "CharSub") -> str:
@@ -68,26 +114,35 @@ class TicTacToeGame:
         "bad turn": "Please enter a valid turn: ",
     }
 
-    def __init__(self) -> None:
-        self.game_state = self.NULL_CHAR * 9
-        self.rule_set = Rules
-        self.style = BoardStyleLarge
+    def __init__(
+        self,
+        players: Optional[tuple] = None,
+        shape: BoardShape = STANDARD_SHAPE,
+        output: Callable[[str], None] = print,
+    ) -> None:
+        self.shape = shape
+        self.output = output
+        self.game_state = self.NULL_CHAR * shape.cells
+        self.rule_set = Rules.for_shape(shape)
+        self.style = BoardStyleLarge if shape == STANDARD_SHAPE else BoardStyleCompact(shape)
         self.turns = 0
         self.win = None
         self._greet()
-        self.player_sequence = cycle(self._setup_players())
+        # Players are asked for on the console unless they are supplied.
+        self.player_sequence = cycle(players or self._setup_players())
 
     def _setup_players(self) -> tuple:
         players = []
         for mark in self.PLAYER_MARKS:
-            players.append(self._get_player_type(mark))
+            players.append(self._get_player_type(mark, self.shape))
         return tuple(players)
 
     @staticmethod
-    def _get_player_type(player_mark) -> "Player":
+    def _get_player_type(player_mark, shape: BoardShape = STANDARD_SHAPE) -> "Player":
         player_types = {
             "human": ConsoleInput,
-            "ai": AIInput,
+            # A perfect player can only search the 3x3 board; on larger ones the AI searches by sampling.
+            "ai": AIInput if shape == STANDARD_SHAPE else lambda: MCTSInput(shape),
         }
 
         input_type = input(f"Is player {player_mark} human or AI?: ")
@@ -95,61 +150,152 @@ class TicTacToeGame:
             input_type = input(
                 f"Please enter 'human' or 'AI' for player {player_mark}: "
             )
-        return Player(player_mark, player_types[input_type.casefold()])
+        return Player(player_mark, player_types[input_type.casefold()]())
 
     def _greet(self):
-        print(self.STANDARD_MESSAGES["greeting"])
+        self.output(self.STANDARD_MESSAGES["greeting"])
         # print(self.style.get_board_string(self.game_state, self.win))
 
-    @classmethod
-    def _position_is_playable(cls, board_state: str, turn: str) -> bool:
-        """Returns True if the supplied position can be played from the supplied board state, and False otherwise."""
+    def _parse_turn(self, turn: str) -> Optional[int]:
+        """Returns the cell index of a turn entered as a cell number or as "row,column", if that cell can be played."""
         try:
-            index = int(turn) - 1
-            assert 0 <= index <= 8
-            char = board_state[index]
+            if "," in turn:
+                row, col = (int(n) - 1 for n in turn.split(","))
+                assert 0 <= row < self.shape.rows and 0 <= col < self.shape.columns
+                index = row * self.shape.columns + col
+            else:
+                index = int(turn) - 1
+                assert 0 <= index < self.shape.cells
         except (ValueError, AssertionError):
-            return False
-        if char == cls.NULL_CHAR:
-            return True
-        return False
+            return None
+        if self.game_state[index] == self.NULL_CHAR:
+            return index
+        return None
 
     def _get_valid_turn(self, player: "Player") -> "CharSub":
         turn_str = player.get_turn(
-            f"Player {player.mark}, where would you like to play?: "
+            f"Player {player.mark}, where would you like to play?: ", self.game_state
+        )
+        index = self._parse_turn(turn_str)
+        while index is None:
+            turn_str = player.get_turn(self.STANDARD_MESSAGES["bad turn"], self.game_state)
+            index = self._parse_turn(turn_str)
+        return CharSub([index], player.mark)
+
+    async def _get_valid_turn_async(self, player: "Player") -> "CharSub":
+        turn_str = await player.get_turn_async(
+            f"Player {player.mark}, where would you like to play?: ", self.game_state
         )
-        while not self._position_is_playable(self.game_state, turn_str):
-            turn_str = player.get_turn(self.STANDARD_MESSAGES["bad turn"])
-        return CharSub([int(turn_str) - 1], player.mark)
+        index = self._parse_turn(turn_str)
+        while index is None:
+            turn_str = await player.get_turn_async(self.STANDARD_MESSAGES["bad turn"], self.game_state)
+            index = self._parse_turn(turn_str)
+        return CharSub([index], player.mark)
 
     def _get_next_player(self) -> "Player":
         return next(self.player_sequence)
 
     def _end_game(self, win: Optional["Win"]) -> None:
         if win:
-            print(
+            self.output(
                 f"Player {win.player_name} wins on turn {self.turns} along {win.line_name.casefold()}!"
             )
         else:
-            print(self.STANDARD_MESSAGES["draw"])
+            self.output(self.STANDARD_MESSAGES["draw"])
+
+    def _apply_turn(self, turn: "CharSub") -> None:
+        self.game_state = substitute_chars(self.game_state, turn)
+        self.win = self.rule_set.evaluate_move(self.game_state, turn.indicies[0])
+        self.output(self.style.get_board_string(self.game_state, self.win))
+        if self.win or self.NULL_CHAR not in self.game_state:
+            self._end_game(self.win)
 
     def turn(self) -> None:
         """Carrys out the steps of a turn. If a win condition is found, ends the game."""
         self.turns += 1
         next_player = self._get_next_player()
-        turn = self._get_valid_turn(next_player)
-        self.game_state = substitute_chars(self.game_state, turn)
-        self.win = self.rule_set.evaluate_board(self.game_state)
-        print(self.style.get_board_string(self.game_state, self.win))
-        if self.win or self.NULL_CHAR not in self.game_state:
-            self._end_game(self.win)
+        self._apply_turn(self._get_valid_turn(next_player))
+
+    async def turn_async(self) -> None:
+        """Carrys out a turn like turn(), awaiting the player's input instead of blocking on it."""
+        self.turns += 1
+        next_player = self._get_next_player()
+        self._apply_turn(await self._get_valid_turn_async(next_player))
 
     def play(self) -> None:
-        print("\n\n")
-        print(self.style.get_board_string(self.game_state, self.win))
+        self.output("\n\n")
+        self.output(self.style.get_board_string(self.game_state, self.win))
         while self.NULL_CHAR in self.game_state and self.win is None:
             self.turn()
 
+    async def play_async(self) -> None:
+        """Plays the game out with players whose input sources are async, e.g. in a GameServer session."""
+        self.output("\n\n")
+        self.output(self.style.get_board_string(self.game_state, self.win))
+        while self.NULL_CHAR in self.game_state and self.win is None:
+            await self.turn_async()
+
+
+class GameEngine:
+    """A game of tic tac toe with no console I/O, for driving games from code."""
+
+    _lines_through: tuple = ()
+
+    def __init__(self, game_state: Optional[str] = None, shape: BoardShape = STANDARD_SHAPE) -> None:
+        self.shape = shape
+        self.rules = Rules.for_shape(shape)
+        self.game_state = game_state or TicTacToeGame.NULL_CHAR * shape.cells
+        if len(self.game_state) != shape.cells:
+            raise ValueError(f"A {shape.rows}x{shape.columns} board needs {shape.cells} cells.")
+        self.turns = shape.cells - self.game_state.count(TicTacToeGame.NULL_CHAR)
+        self.win = self.rules.evaluate_board(self.game_state)
+
+    @staticmethod
+    def marks_to_play(game_state: str) -> tuple:
+        """Returns the (mark to play, opponent's mark) for a board state, as X always moves first."""
+        first, second = TicTacToeGame.PLAYER_MARKS
+        if game_state.count(first) == game_state.count(second):
+            return first, second
+        return second, first
+
+    @classmethod
+    def completes_line(cls, game_state: str, index: int, mark: str) -> bool:
+        """Returns True if the mark at index is part of a full line of that mark."""
+        if not cls._lines_through:
+            cls._lines_through = tuple(
+                tuple(line for line in Rules.LINES if i in line) for i in range(9)
+            )
+        for a, b, c in cls._lines_through[index]:
+            if game_state[a] == game_state[b] == game_state[c] == mark:
+                return True
+        return False
+
+    def legal_moves(self) -> list:
+        return [i for i, c in enumerate(self.game_state) if c == TicTacToeGame.NULL_CHAR]
+
+    def is_over(self) -> bool:
+        return self.win is not None or TicTacToeGame.NULL_CHAR not in self.game_state
+
+    def play(self, index: int) -> Optional["Win"]:
+        """Marks the supplied cell for whoever is to play, and returns the Win if that ends the game in one."""
+        if self.is_over():
+            raise ValueError("The game is already over.")
+        if not 0 <= index < self.shape.cells or self.game_state[index] != TicTacToeGame.NULL_CHAR:
+            raise ValueError(f"Cell {index + 1} can't be played.")
+        mark = TicTacToeGame.PLAYER_MARKS[self.turns % 2]
+        self.game_state = self.game_state[:index] + mark + self.game_state[index + 1:]
+        self.turns += 1
+        self.win = self.rules.evaluate_move(self.game_state, index)
+        return self.win
+
+    @classmethod
+    def play_game(cls, players: Sequence, shape: BoardShape = STANDARD_SHAPE) -> "GameEngine":
+        """Plays a game out between two strategies with a choose_move(game_state) method, X first."""
+        game = cls(shape=shape)
+        while not game.is_over():
+            game.play(players[game.turns % 2].choose_move(game.game_state))
+        return game
+
 
 class Player:
     def __init__(
@@ -158,8 +304,11 @@ class Player:
         self.mark = mark
         self.input_source = input_source
 
-    def get_turn(self, prompt: str) -> str:
-        return self.input_source.get_turn_input(prompt)
+    def get_turn(self, prompt: str, game_state: str) -> str:
+        return self.input_source.get_turn_input(prompt, game_state)
+
+    async def get_turn_async(self, prompt: str, game_state: str) -> str:
+        return await self.input_source.get_turn_input_async(prompt, game_state)
 
 
 class ConsoleInput:
@@ -167,21 +316,397 @@ class ConsoleInput:
         pass
 
     @staticmethod
-    def get_turn_input(prompt=None) -> str:
+    def get_turn_input(prompt=None, game_state=None) -> str:
         prompt = prompt or "Input?: "
         return input(prompt)
 
 
+class StreamInput:
+    """An async input source that asks for turns over a connection, a line at a time."""
+
+    def __init__(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, timeout: float = CLIENT_TIMEOUT
+    ) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+
+    async def get_turn_input_async(self, prompt: str, game_state: Optional[str] = None) -> str:
+        self.writer.write(prompt.encode() + b"\n")
+        await self.writer.drain()
+        try:
+            line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+        except ValueError:
+            # readline's error for a line past the reader's limit, which no answer to a prompt needs.
+            raise ConnectionAbortedError("The client sent a line past the reader's limit.") from None
+        if not line:
+            raise ConnectionResetError("The client disconnected.")
+        return line.decode(errors="replace").strip()
+
+
+class ExecutorInput:
+    """An async input source that runs a strategy's choose_move in an executor, so working out a move never holds
+    up the event loop. With no executor, choose_move is called directly, for strategies that only look their moves
+    up. Moves are reported through `output`, as AIInput prints them."""
+
+    def __init__(self, strategy, executor=None, output: Callable[[str], None] = print) -> None:
+        self.strategy = strategy
+        self.executor = executor
+        self.output = output
+
+    async def get_turn_input_async(self, prompt: str, game_state: str) -> str:
+        if self.executor is None:
+            turn = str(self.strategy.choose_move(game_state) + 1)
+        else:
+            loop = asyncio.get_running_loop()
+            turn = str(await loop.run_in_executor(self.executor, self.strategy.choose_move, game_state) + 1)
+        self.output(f"{prompt}{turn}")
+        return turn
+
+
 class AIInput:
+    """A player that picks perfect moves by negamax search with alpha-beta pruning.
+
+    Searched positions are kept in a transposition table shared by every AI player, along with the best move
+    found from them, so a position is only ever searched once and replaying it is a table lookup. The table is
+    indexed by Symmetry position ID, so a rotation or reflection of a searched board is a hit too. Once a
+    Tablebase has been built, moves are read from it instead and nothing is searched.
+    """
+
+    # Center first, then corners, then edges: the strongest moves are tried first, so more branches are pruned.
+    MOVE_ORDER = (4, 0, 2, 6, 8, 1, 3, 5, 7)
+    _UNSEARCHED, _EXACT, _LOWER_BOUND, _UPPER_BOUND = -1, 0, 1, 2
+    # By position: the score, bound type and best move on the canonical board, from the point of view of the
+    # player to move.
+    _scores: Optional["PositionTable"] = None
+    _bounds: Optional["PositionTable"] = None
+    _moves: Optional["PositionTable"] = None
+
     def __init__(self) -> None:
         pass
 
-    def get_turn_input(self, _):
+    def get_turn_input(self, prompt: str, game_state: str) -> str:
+        turn = str(self.choose_move(game_state) + 1)
+        print(f"{prompt}{turn}")
+        return turn
+
+    @classmethod
+    def _build_tables(cls) -> None:
+        if cls._bounds is None:
+            cls._scores = PositionTable("b")
+            cls._moves = PositionTable("b")
+            cls._bounds = PositionTable("b", cls._UNSEARCHED)
+
+    @classmethod
+    def choose_move(cls, game_state: str) -> int:
+        """Returns the index of the best move for whoever is to play on the supplied board."""
+        if TicTacToeGame.NULL_CHAR not in game_state:
+            raise ValueError("There are no moves left to play.")
+        tablebase = Tablebase.shared()
+        if tablebase is not None:
+            moves = tablebase.best_moves(game_state)
+            if moves:
+                return min(moves, key=cls.MOVE_ORDER.index)
+        cls._build_tables()
+        position, symmetry = Symmetry.canonicalize(game_state)
+        if cls._bounds[position] != cls._EXACT:
+            # A full window search always leaves an exact entry for the position it starts from.
+            cls._negamax(game_state, *GameEngine.marks_to_play(game_state), -10, 10)
+        return Symmetry.from_canonical_move(cls._moves[position], symmetry)
+
+    @classmethod
+    def _negamax(cls, game_state: str, mark: str, other: str, alpha: int, beta: int) -> int:
+        """Returns the score of a position for the player to move: positive if they can force a win, sooner being
+        higher, negative if they will lose, and 0 for a draw."""
+        original_alpha = alpha
+        position, symmetry = Symmetry.canonicalize(game_state)
+        bound = cls._bounds[position]
+        if bound != cls._UNSEARCHED:
+            score = cls._scores[position]
+            # Bounds only end the search early. Narrowing the window with them instead could store an inexact
+            # score as exact.
+            if (
+                bound == cls._EXACT
+                or (bound == cls._LOWER_BOUND and score >= beta)
+                or (bound == cls._UPPER_BOUND and score <= alpha)
+            ):
+                return score
+
+        null = TicTacToeGame.NULL_CHAR
+        empties = game_state.count(null)
+        best_score = -10
+        best_move = None
+        for i in cls.MOVE_ORDER:
+            if game_state[i] != null:
+                continue
+            child = game_state[:i] + mark + game_state[i + 1:]
+            if GameEngine.completes_line(child, i, mark):
+                score = empties
+            elif empties == 1:
+                score = 0
+            else:
+                score = -cls._negamax(child, other, mark, -beta, -alpha)
+            if score > best_score:
+                best_score = score
+                best_move = i
+            alpha = max(alpha, score)
+            if alpha >= beta:
+                break
+
+        if best_score <= original_alpha:
+            bound = cls._UPPER_BOUND
+        elif best_score >= beta:
+            bound = cls._LOWER_BOUND
+        else:
+            bound = cls._EXACT
+        cls._scores[position] = best_score
+        cls._bounds[position] = bound
+        cls._moves[position] = Symmetry.to_canonical_move(best_move, symmetry)
+        return best_score
+
+
+class RandomInput:
+    """A player that plays any free cell at random."""
+
+    def __init__(self) -> None:
         pass
 
+    def get_turn_input(self, prompt: str, game_state: str) -> str:
+        turn = str(self.choose_move(game_state) + 1)
+        print(f"{prompt}{turn}")
+        return turn
+
+    def choose_move(self, game_state: str) -> int:
+        return random.choice([i for i, c in enumerate(game_state) if c == TicTacToeGame.NULL_CHAR])
+
+
+class RuleBasedInput(RandomInput):
+    """A player that wins if it can, blocks if it must, and otherwise prefers the center, then a corner."""
+
+    def __init__(self, shape: BoardShape = STANDARD_SHAPE) -> None:
+        self.rules = Rules.for_shape(shape)
+        rows, cols = shape.rows, shape.columns
+        self.center = rows // 2 * cols + cols // 2
+        self.corners = (0, cols - 1, (rows - 1) * cols, rows * cols - 1)
+
+    def forced_move(self, game_state: str) -> Optional[int]:
+        """Returns a move that wins on the spot, or failing that one that stops the opponent doing so, if any."""
+        moves = [i for i, c in enumerate(game_state) if c == TicTacToeGame.NULL_CHAR]
+        for mark in GameEngine.marks_to_play(game_state):
+            for i in moves:
+                if self.rules.evaluate_move(game_state[:i] + mark + game_state[i + 1:], i):
+                    return i
+        return None
+
+    def choose_move(self, game_state: str) -> int:
+        move = self.forced_move(game_state)
+        if move is not None:
+            return move
+        moves = [i for i, c in enumerate(game_state) if c == TicTacToeGame.NULL_CHAR]
+        if game_state[self.center] == TicTacToeGame.NULL_CHAR:
+            return self.center
+        corners = [i for i in self.corners if game_state[i] == TicTacToeGame.NULL_CHAR]
+        return random.choice(corners or moves)
+
+
+class MCTSInput(RuleBasedInput):
+    """A player that searches by Monte Carlo tree search, for boards too large to solve outright.
+
+    Each move gets a budget in seconds, in playouts, or both, whichever runs out first. One independent tree is
+    searched per process and their root statistics are merged, so more cores means more playouts in the same
+    time. Each of the player's processes keeps its tree between moves, and the subtree for the position actually
+    reached is searched on from where it left off. Reuse is best-effort: a process keeps at most MCTS_MAX_TREES
+    trees, and a player searching in a shared pool only finds its tree if its moves land on the same process.
+    """
+
+    # Search trees by player, in whichever process searches them, least recently searched first.
+    _trees: OrderedDict = OrderedDict()
+
+    def __init__(
+        self,
+        shape: BoardShape = STANDARD_SHAPE,
+        time_budget: Optional[float] = 1.0,
+        playouts: Optional[int] = None,
+        processes: Optional[int] = None,
+    ) -> None:
+        if time_budget is None and playouts is None:
+            raise ValueError("A search needs a time budget, a playout budget or both.")
+        super().__init__(shape)
+        self.shape = shape
+        self.time_budget = time_budget
+        self.playouts = playouts
+        self.processes = processes or os.cpu_count() or 1
+        self.last_playouts = 0
+        self._key = os.urandom(8).hex()
+        # One single process executor per tree, so each tree is searched on by the process that holds it.
+        self._executors = []
+
+    def choose_move(self, game_state: str) -> int:
+        if TicTacToeGame.NULL_CHAR not in game_state:
+            raise ValueError("There are no moves left to play.")
+        self.last_playouts = 0
+        move = self.forced_move(game_state)
+        if move is not None:
+            return move
+        # A wall clock deadline, as it's shared by every process searching.
+        deadline = None if self.time_budget is None else time.time() + self.time_budget
+        trees = self.processes
+        playouts = None if self.playouts is None else -(-self.playouts // trees)
+        args = [[self._key] * trees, [game_state] * trees, [self.shape] * trees, [deadline] * trees,
+                [playouts] * trees, [random.getrandbits(32) for _ in range(trees)]]
+        if trees == 1:
+            results = [_mcts_search(*(arg[0] for arg in args))]
+        else:
+            if not self._executors:
+                from concurrent.futures import ProcessPoolExecutor
+
+                self._executors = [ProcessPoolExecutor(max_workers=1) for _ in range(trees)]
+            futures = [executor.submit(_mcts_search, *call) for executor, *call in zip(self._executors, *args)]
+            results = [future.result() for future in futures]
+        totals = {}
+        for stats, count in results:
+            self.last_playouts += count
+            for move, (visits, wins) in stats.items():
+                total_visits, total_wins = totals.get(move, (0, 0.0))
+                totals[move] = (total_visits + visits, total_wins + wins)
+        # The most visited move, which is the one the search trusts most.
+        return max(totals, key=totals.get)
+
+    def close(self) -> None:
+        """Drops the player's tree from this process, and shuts down its search processes, if it started any."""
+        MCTSInput._trees.pop(self._key, None)
+        for executor in self._executors:
+            executor.shutdown()
+        self._executors = []
+
+
+class MCTSNode:
+    """A position in a Monte Carlo search tree, with the results of every playout that has passed through it.
+
+    `wins` are counted for `mover`, the player whose move led here, with a draw counting as half a win.
+    """
+
+    EXPLORATION = 1.4
+
+    __slots__ = ("game_state", "parent", "move", "mover", "winner", "terminal", "untried", "children", "visits", "wins")
+
+    def __init__(
+        self,
+        game_state: str,
+        rng: random.Random,
+        parent: Optional["MCTSNode"] = None,
+        move: Optional[int] = None,
+        win: Optional["Win"] = None,
+    ) -> None:
+        self.game_state = game_state
+        self.parent = parent
+        self.move = move
+        self.mover = GameEngine.marks_to_play(game_state)[1]
+        self.winner = None if win is None else win.player_name
+        self.terminal = win is not None or TicTacToeGame.NULL_CHAR not in game_state
+        self.untried = [] if self.terminal else [i for i, c in enumerate(game_state) if c == TicTacToeGame.NULL_CHAR]
+        rng.shuffle(self.untried)
+        self.children = {}
+        self.visits = 0
+        self.wins = 0.0
+
+    def find(self, game_state: str, depth: int = 2) -> Optional["MCTSNode"]:
+        """Returns the node for a board state among this node and its descendants up to depth moves on."""
+        if self.game_state == game_state:
+            return self
+        if depth:
+            for move, child in self.children.items():
+                if game_state[move] == child.game_state[move]:
+                    found = child.find(game_state, depth - 1)
+                    if found is not None:
+                        return found
+        return None
+
+    def select_child(self) -> "MCTSNode":
+        """Returns the child with the best upper confidence bound, trading its win rate off against how little
+        it has been tried."""
+        log_visits = math.log(self.visits)
+        return max(
+            self.children.values(),
+            key=lambda c: c.wins / c.visits + self.EXPLORATION * math.sqrt(log_visits / c.visits),
+        )
+
+    def expand(self, rules: "MNKRules", rng: random.Random) -> "MCTSNode":
+        move = self.untried.pop()
+        mark = GameEngine.marks_to_play(self.game_state)[0]
+        game_state = self.game_state[:move] + mark + self.game_state[move + 1:]
+        child = MCTSNode(game_state, rng, self, move, rules.evaluate_move(game_state, move))
+        self.children[move] = child
+        return child
+
+    def playout(self, rules: "MNKRules", rng: random.Random) -> Optional[str]:
+        """Plays random moves from here to the end of the game, and returns the winning mark, or None for a draw."""
+        if self.terminal:
+            return self.winner
+        board = list(self.game_state)
+        mark, other = GameEngine.marks_to_play(self.game_state)
+        moves = self.untried[:]
+        rng.shuffle(moves)
+        for i in moves:
+            board[i] = mark
+            if rules.evaluate_move(board, i) is not None:
+                return mark
+            mark, other = other, mark
+        return None
+
+
+def _mcts_search(
+    key: str,
+    game_state: str,
+    shape: BoardShape,
+    deadline: Optional[float],
+    playouts: Optional[int],
+    seed: int,
+) -> tuple:
+    """Searches on from a board state with the tree this process keeps for a player, until the wall clock
+    deadline or the playout budget is reached. Returns the (visits, wins) of each move from the root, and the
+    number of playouts run."""
+    rng = random.Random(seed)
+    rules = MNKRules(shape)
+    previous = MCTSInput._trees.get(key)
+    root = None if previous is None else previous.find(game_state)
+    if root is None:
+        root = MCTSNode(game_state, rng)
+    # Cut loose from the rest of the old tree, so it can be freed.
+    root.parent = None
+    trees = MCTSInput._trees
+    trees[key] = root
+    trees.move_to_end(key)
+    while len(trees) > MCTS_MAX_TREES:
+        trees.popitem(last=False)
+    count = 0
+    # At least one playout, so the root has a move to report even if the deadline passed before the search began,
+    # as it can while a worker process is still starting up.
+    while count == 0 or (playouts is None or count < playouts) and (deadline is None or time.time() < deadline):
+        node = root
+        while not node.untried and not node.terminal:
+            node = node.select_child()
+        if node.untried:
+            node = node.expand(rules, rng)
+        winner = node.playout(rules, rng)
+        while node is not None:
+            node.visits += 1
+            if winner is None:
+                node.wins += 0.5
+            elif winner == node.mover:
+                node.wins += 1
+            node = node.parent
+        count += 1
+    return {move: (child.visits, child.wins) for move, child in root.children.items()}, count
+
 
 class Rules:
-    """A class for evaluating the condition of a tic tac toe board."""
+    """A class for evaluating the condition of a tic tac toe board.
+
+    Boards are checked as a pair of 9 bit masks, one per player, with bit i set where that player has marked
+    cell i. build_outcome_table() goes further and precomputes the result for all 3^9 boards, after which
+    evaluating a board is a single table lookup.
+    """
 
     LINES = {
         (0, 1, 2): "Row 1",
@@ -193,15 +718,76 @@ class Rules:
         (0, 4, 8): "Diagonal 1",
         (2, 4, 6): "Diagonal 2",
     }
+    WIN_MASKS = {sum(1 << i for i in line): name for line, name in LINES.items()}
+
+    # str.translate tables that turn a board state into binary digits for each player's mask, or into the
+    # ternary digits of its position in the outcome table.
+    _BITS = {
+        mark: str.maketrans({c: "1" if c == mark else "0" for c in TicTacToeGame.NULL_CHAR + TicTacToeGame.PLAYER_MARKS})
+        for mark in TicTacToeGame.PLAYER_MARKS
+    }
+    _TRITS = str.maketrans({c: str(i) for i, c in enumerate(TicTacToeGame.NULL_CHAR + TicTacToeGame.PLAYER_MARKS)})
+    _outcomes: Optional[list] = None
 
     def __init__(self) -> None:
         pass
 
+    @staticmethod
+    def for_shape(shape: BoardShape):
+        """Returns the rules for a board shape: these for the standard board, and MNKRules for any other."""
+        if shape == STANDARD_SHAPE:
+            return Rules
+        return MNKRules(shape)
+
+    @classmethod
+    def evaluate_move(cls, game_state: str, index: int) -> Optional["Win"]:
+        """Returns a Win object if the mark just placed at index has won the game."""
+        # Only a line through the new mark can have been completed, so the full evaluation is only needed then.
+        if GameEngine.completes_line(game_state, index, game_state[index]):
+            return cls.evaluate_board(game_state)
+        return None
+
     @classmethod
     def evaluate_board(cls, game_state: str) -> Optional["Win"]:
         """Returns a Win object if a win is found in the supplied game state."""
-        line_states = cls._decompose_board(game_state)
-        return cls._discover_wins(line_states)
+        if cls._outcomes is not None:
+            return cls._outcomes[cls.encode(game_state)]
+        return cls.evaluate_masks(cls.to_masks(game_state))
+
+    @classmethod
+    def to_masks(cls, game_state: str) -> tuple:
+        """Returns a bit mask of the cells each player has marked, in PLAYER_MARKS order."""
+        # Reversed, so the first cell ends up as the lowest bit.
+        return tuple(int(game_state.translate(cls._BITS[mark])[::-1], 2) for mark in TicTacToeGame.PLAYER_MARKS)
+
+    @classmethod
+    def evaluate_masks(cls, masks: tuple) -> Optional["Win"]:
+        """Returns a Win object if either player's mask covers a whole line."""
+        for line_mask, name in cls.WIN_MASKS.items():
+            for mark, mask in zip(TicTacToeGame.PLAYER_MARKS, masks):
+                if mask & line_mask == line_mask:
+                    return Win(name, mark)
+        return None
+
+    @classmethod
+    def encode(cls, game_state: str) -> int:
+        """Returns a board state's position in the outcome table, reading it as a base 3 number."""
+        return int(game_state.translate(cls._TRITS), 3)
+
+    @classmethod
+    def build_outcome_table(cls) -> None:
+        """Precomputes the result of every possible board, so evaluate_board becomes a lookup."""
+        if cls._outcomes is not None:
+            return
+        chars = TicTacToeGame.NULL_CHAR + TicTacToeGame.PLAYER_MARKS
+        outcomes = []
+        for code in range(3 ** 9):
+            digits = []
+            for _ in range(9):
+                code, digit = divmod(code, 3)
+                digits.append(chars[digit])
+            outcomes.append(cls.evaluate_masks(cls.to_masks("".join(reversed(digits)))))
+        cls._outcomes = outcomes
 
     @staticmethod
     def _extract_line(game_state: str, line_indecies: tuple) -> str:
@@ -213,22 +799,360 @@ class Rules:
 
     @classmethod
     def _decompose_board(cls, game_state: str) -> dict:
-        """Converts a supplied game state string to a dict of linestates and their matching names."""
+        """Converts a supplied game state string to a dict of line names and their contents."""
+        # Keyed by name, as lines with the same contents would otherwise overwrite each other.
         line_states = {}
         for indecies, name in cls.LINES.items():
-            line_state = cls._extract_line(game_state, indecies)
-            line_states[line_state] = name
+            line_states[name] = cls._extract_line(game_state, indecies)
         return line_states
 
     @classmethod
     def _discover_wins(cls, line_states: dict) -> Optional["Win"]:
         """Checks all of the supplied lines, and returns a Win object describing the win state if a win is found. Returns None otherwise."""
-        for line, name in line_states.items():
+        for name, line in line_states.items():
             if TicTacToeGame.NULL_CHAR not in line and len(set(line)) == 1:
                 return Win(name, line[0])
         return None
 
 
+class MNKRules:
+    """Rules for a board of any shape, where `win_length` marks in a row, column or diagonal win.
+
+    Only the lines through the last move are checked, walking out from it, so a move costs O(win_length)
+    however large the board is.
+    """
+
+    # (row step, column step) for each line direction, and how its lines are named.
+    DIRECTIONS = (
+        ((0, 1), "Row"),
+        ((1, 0), "Column"),
+        ((1, 1), "Diagonal 1"),
+        ((1, -1), "Diagonal 2"),
+    )
+
+    def __init__(self, shape: BoardShape) -> None:
+        self.shape = shape
+
+    def _run(self, game_state: str, row: int, col: int, step: tuple, mark: str) -> list:
+        """Returns the cells past (row, col) in the direction of step that hold the supplied mark, nearest first."""
+        rows, cols = self.shape.rows, self.shape.columns
+        cells = []
+        row, col = row + step[0], col + step[1]
+        while 0 <= row < rows and 0 <= col < cols and game_state[row * cols + col] == mark:
+            cells.append(row * cols + col)
+            row, col = row + step[0], col + step[1]
+        return cells
+
+    def evaluate_move(self, game_state: str, index: int) -> Optional["Win"]:
+        """Returns a Win object if the mark just placed at index has won the game."""
+        mark = game_state[index]
+        if mark == TicTacToeGame.NULL_CHAR:
+            return None
+        row, col = divmod(index, self.shape.columns)
+        for (dr, dc), name in self.DIRECTIONS:
+            forward = self._run(game_state, row, col, (dr, dc), mark)
+            backward = self._run(game_state, row, col, (-dr, -dc), mark)
+            if 1 + len(forward) + len(backward) >= self.shape.win_length:
+                cells = tuple(sorted(backward + [index] + forward))
+                if name == "Row":
+                    name = f"Row {row + 1}"
+                elif name == "Column":
+                    name = f"Column {col + 1}"
+                return Win(name, mark, cells=cells)
+        return None
+
+    def evaluate_board(self, game_state: str) -> Optional["Win"]:
+        """Returns a Win object if a win is found anywhere in the supplied game state."""
+        for index, c in enumerate(game_state):
+            if c != TicTacToeGame.NULL_CHAR:
+                win = self.evaluate_move(game_state, index)
+                if win is not None:
+                    return win
+        return None
+
+
+class Symmetry:
+    """Maps 3x3 board states to compact position IDs, shared by all 8 rotations and reflections of a board.
+
+    Each reachable board is represented by its canonical form, whichever of its 8 variants has the lowest
+    outcome table code, so a search or per-position table needs one entry where it would otherwise need up to 8.
+    IDs run from 0 to count() - 1, in the order positions are first seen. A board is canonicalized the first time
+    it's asked for, from the permutation tables below, and the result is kept, so later lookups are array reads.
+    """
+
+    # PERMUTATIONS[s][i] is the cell of a board that ends up at cell i under symmetry s.
+    PERMUTATIONS = (
+        (0, 1, 2, 3, 4, 5, 6, 7, 8),  # As is
+        (6, 3, 0, 7, 4, 1, 8, 5, 2),  # Rotated a quarter turn clockwise
+        (8, 7, 6, 5, 4, 3, 2, 1, 0),  # Rotated a half turn
+        (2, 5, 8, 1, 4, 7, 0, 3, 6),  # Rotated a quarter turn anticlockwise
+        (2, 1, 0, 5, 4, 3, 8, 7, 6),  # Mirrored left to right
+        (6, 7, 8, 3, 4, 5, 0, 1, 2),  # Mirrored top to bottom
+        (0, 3, 6, 1, 4, 7, 2, 5, 8),  # Mirrored along diagonal 1
+        (8, 5, 2, 7, 4, 1, 6, 3, 0),  # Mirrored along diagonal 2
+    )
+    # INVERSES[s][i] is the cell that cell i ends up at under symmetry s.
+    INVERSES = tuple(tuple(p.index(i) for i in range(9)) for p in PERMUTATIONS)
+
+    # The number of distinct positions that can come up in a game, counting symmetric boards as one.
+    _POSITIONS = 765
+    # By outcome table code: the position ID of every board canonicalized so far, or -1, and the symmetry that
+    # takes it to its canonical form.
+    _ids: Optional[array] = None
+    _symmetries: Optional[array] = None
+    _canonical_states: Optional[list] = None
+
+    def __init__(self) -> None:
+        pass
+
+    @classmethod
+    def transform(cls, game_state: str, symmetry: int) -> str:
+        """Returns the supplied board state rotated or reflected by one of the 8 symmetries."""
+        return "".join([game_state[i] for i in cls.PERMUTATIONS[symmetry]])
+
+    @staticmethod
+    def _reachable_states() -> list:
+        """Returns every board state that can come up in a game, playing from the empty board until a win or a draw."""
+        null = TicTacToeGame.NULL_CHAR
+        found = {null * 9}
+        frontier = [null * 9]
+        while frontier:
+            next_frontier = []
+            for game_state in frontier:
+                mark = GameEngine.marks_to_play(game_state)[0]
+                for i, c in enumerate(game_state):
+                    if c != null:
+                        continue
+                    child = game_state[:i] + mark + game_state[i + 1:]
+                    if child in found:
+                        continue
+                    found.add(child)
+                    if null in child and not GameEngine.completes_line(child, i, mark):
+                        next_frontier.append(child)
+            frontier = next_frontier
+        return list(found)
+
+    @staticmethod
+    def _is_reachable(game_state: str) -> bool:
+        """Returns True if a board state can come up in a game."""
+        first, second = (game_state.count(mark) for mark in TicTacToeGame.PLAYER_MARKS)
+        if first - second not in (0, 1):
+            return False
+        if Rules.evaluate_masks(Rules.to_masks(game_state)) is None:
+            return True
+        # A won board is reachable if the last mover has a mark that was the winning move, which is one without
+        # which there is no win.
+        last = TicTacToeGame.PLAYER_MARKS[first - second - 1]
+        null = TicTacToeGame.NULL_CHAR
+        return any(
+            Rules.evaluate_masks(Rules.to_masks(game_state[:i] + null + game_state[i + 1:])) is None
+            for i, c in enumerate(game_state)
+            if c == last
+        )
+
+    @classmethod
+    def count(cls) -> int:
+        """Returns the number of distinct positions, counting symmetric boards as one."""
+        return cls._POSITIONS
+
+    @classmethod
+    def canonicalize(cls, game_state: str) -> tuple:
+        """Returns the (position ID, symmetry) of a board state, where the symmetry takes it to its canonical form."""
+        if cls._ids is None:
+            cls._ids = array("h", [-1]) * 3 ** 9
+            cls._symmetries = array("B", [0]) * 3 ** 9
+            cls._canonical_states = []
+        ids = cls._ids
+        code = Rules.encode(game_state)
+        position = ids[code]
+        if position >= 0:
+            return position, cls._symmetries[code]
+        if not cls._is_reachable(game_state):
+            raise ValueError(f"{game_state} can't come up in a game.")
+        variants = [cls.transform(game_state, s) for s in range(len(cls.PERMUTATIONS))]
+        codes = [Rules.encode(variant) for variant in variants]
+        symmetry = codes.index(min(codes))
+        canonical_code = codes[symmetry]
+        position = ids[canonical_code]
+        if position < 0:
+            # A new position, numbered next. Its canonical form is taken to itself by symmetry 0.
+            position = len(cls._canonical_states)
+            cls._canonical_states.append(variants[symmetry])
+            ids[canonical_code] = position
+        ids[code] = position
+        cls._symmetries[code] = symmetry
+        return position, symmetry
+
+    @classmethod
+    def position_id(cls, game_state: str) -> int:
+        return cls.canonicalize(game_state)[0]
+
+    @classmethod
+    def canonical_state(cls, position: int) -> str:
+        """Returns the canonical board state of a position ID, which must have been handed out by canonicalize."""
+        return cls._canonical_states[position]
+
+    @classmethod
+    def to_canonical_move(cls, index: int, symmetry: int) -> int:
+        """Returns where a cell of a board ends up on its canonical form."""
+        return cls.INVERSES[symmetry][index]
+
+    @classmethod
+    def from_canonical_move(cls, index: int, symmetry: int) -> int:
+        """Returns the cell of a board that a cell of its canonical form came from."""
+        return cls.PERMUTATIONS[symmetry][index]
+
+
+class PositionTable:
+    """One value per distinct position, e.g. a score, best move or visit count, held in a typed array indexed by
+    Symmetry position ID.
+
+    Moves stored in one should be on the canonical board: see Symmetry.to_canonical_move.
+    """
+
+    def __init__(self, typecode: str = "i", fill: Union[int, float] = 0) -> None:
+        self.values = array(typecode, [fill]) * Symmetry.count()
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __getitem__(self, position: int) -> Union[int, float]:
+        return self.values[position]
+
+    def __setitem__(self, position: int, value: Union[int, float]) -> None:
+        self.values[position] = value
+
+    def get(self, game_state: str) -> Union[int, float]:
+        """Returns the value stored for a board state's position."""
+        return self.values[Symmetry.position_id(game_state)]
+
+
+class Tablebase:
+    """The solved game: the value and every optimal move of each 3x3 board state, read from a memory mapped file.
+
+    Records are indexed by outcome table code, so looking a board up is a single read at a fixed offset, and every
+    process that opens the file shares the same pages. build() writes the file, and AIInput plays from it
+    whenever one is found at TABLEBASE_PATH.
+    """
+
+    _MAGIC = b"TTTBASE1"
+    _HEADER = struct.Struct("<8sII")
+    # Score for the player to move, flags, then a bit mask of the optimal moves, bit i standing for cell i.
+    _RECORD = struct.Struct("<bBH")
+    REACHABLE = 1
+    # The tablebase opened from TABLEBASE_PATH, False until the first look for it.
+    _shared: Union["Tablebase", None, bool] = False
+
+    def __init__(self, path: Optional[str] = TABLEBASE_PATH) -> None:
+        """Maps the tablebase file at path, or with no path, solves the game into memory instead."""
+        self.path = path
+        if path is None:
+            self._mapped = self._pack(self.solve())
+            return
+        with open(path, "rb") as f:
+            self._mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # The size is checked first, so a short file can't be read past its end.
+        size = self._HEADER.size + self._RECORD.size * 3 ** 9
+        if len(self._mapped) != size or self._HEADER.unpack_from(self._mapped, 0) != (
+            self._MAGIC, self._RECORD.size, 3 ** 9
+        ):
+            self._mapped.close()
+            raise ValueError(f"{path} is not a tic tac toe tablebase.")
+
+    @classmethod
+    def shared(cls) -> Optional["Tablebase"]:
+        """Returns the tablebase at TABLEBASE_PATH, opening it on first use, or None if it hasn't been built.
+
+        A file that can't be opened or isn't a tablebase, e.g. one left by an older version, is warned about and
+        treated as no tablebase, so the AI searches instead.
+        """
+        if cls._shared is False:
+            cls._shared = None
+            if os.path.exists(TABLEBASE_PATH):
+                try:
+                    cls._shared = cls(TABLEBASE_PATH)
+                except (OSError, ValueError) as e:
+                    warnings.warn(f"Ignoring the tablebase at {TABLEBASE_PATH}: {e}")
+        return cls._shared
+
+    @classmethod
+    def ensure_shared(cls) -> "Tablebase":
+        """Returns the shared tablebase, solving the game into memory for it if none has been built."""
+        if cls.shared() is None:
+            cls._shared = cls(None)
+        return cls._shared
+
+    @staticmethod
+    def solve() -> dict:
+        """Returns the (score, optimal move mask) of every reachable board state.
+
+        Scores are from the point of view of the player to move, as AIInput scores them: positive if they can force
+        a win, sooner being higher, negative if they will lose, and 0 for a draw.
+        """
+        null = TicTacToeGame.NULL_CHAR
+        solved = {}
+        # Fullest boards first, so every position's children are solved before it is.
+        for game_state in sorted(Symmetry._reachable_states(), key=lambda s: s.count(null)):
+            empties = game_state.count(null)
+            if Rules.evaluate_board(game_state) is not None:
+                # The player to move has already lost, with this many moves to spare.
+                solved[game_state] = (-(empties + 1), 0)
+                continue
+            mark = GameEngine.marks_to_play(game_state)[0]
+            scores = {}
+            for i, c in enumerate(game_state):
+                if c == null:
+                    child = game_state[:i] + mark + game_state[i + 1:]
+                    scores[i] = -solved[child][0] if child in solved else 0
+            best = max(scores.values(), default=0)
+            solved[game_state] = (best, sum(1 << i for i, score in scores.items() if score == best))
+        return solved
+
+    @classmethod
+    def _pack(cls, solved: dict) -> bytearray:
+        """Returns the contents of a tablebase file holding the supplied solutions."""
+        data = bytearray(cls._HEADER.size + cls._RECORD.size * 3 ** 9)
+        cls._HEADER.pack_into(data, 0, cls._MAGIC, cls._RECORD.size, 3 ** 9)
+        for game_state, (score, moves) in solved.items():
+            offset = cls._HEADER.size + cls._RECORD.size * Rules.encode(game_state)
+            cls._RECORD.pack_into(data, offset, score, cls.REACHABLE, moves)
+        return data
+
+    @classmethod
+    def build(cls, path: str = TABLEBASE_PATH) -> int:
+        """Solves the game and writes the tablebase to path, returning the number of positions written."""
+        solved = cls.solve()
+        data = cls._pack(solved)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Written alongside and renamed into place, so a reader never maps a half written file.
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        return len(solved)
+
+    def _record(self, game_state: str) -> tuple:
+        score, flags, moves = self._RECORD.unpack_from(
+            self._mapped, self._HEADER.size + self._RECORD.size * Rules.encode(game_state)
+        )
+        if not flags & self.REACHABLE:
+            raise ValueError(f"{game_state} can't come up in a game.")
+        return score, moves
+
+    def value(self, game_state: str) -> int:
+        """Returns the score of a board state for the player to move."""
+        return self._record(game_state)[0]
+
+    def best_moves(self, game_state: str) -> list:
+        """Returns the index of every optimal move on a board state, which is none once the game is over."""
+        moves = self._record(game_state)[1]
+        return [i for i in range(9) if moves >> i & 1]
+
+    def close(self) -> None:
+        if self.path is not None:
+            self._mapped.close()
+
+
 class BoardStyleLarge:
 
     _EMPTY_BOARD = (
@@ -296,6 +1220,14 @@ class BoardStyleLarge:
         "O": ("╭─╮│ │╰─╯"),
     }
 
+    # Rendered boards, by (board state, win line name).
+    MAX_CACHED_FRAMES = 8192
+    _frames: dict = {}
+    # Built on first use: the (frame position, character) pairs each mark draws in each cell, and the frame
+    # positions and character of each win line.
+    _mark_layers: Optional[dict] = None
+    _win_layers: Optional[dict] = None
+
     def __init__(self) -> None:
         pass
 
@@ -304,30 +1236,49 @@ class BoardStyleLarge:
         """Reuturns the supplied string with newlines inserted at the end of each line."""
         # This board style draws a board that is 11 characters long.
         line_length = 11
-        str_list = list(output_string)
-        out_str = ""
-        for i, c in enumerate(str_list):
-            out_str += c
-            if (i + 1) % line_length == 0:
-                out_str += "\n"
-        return out_str
+        return "".join(
+            output_string[i:i + line_length] + "\n" for i in range(0, len(output_string), line_length)
+        )
 
     @classmethod
-    def _build_board_string(cls, board_state: str) -> str:
-        board_string = cls._EMPTY_BOARD
+    def _build_layers(cls) -> None:
+        cls._mark_layers = {
+            (int(cell) - 1, mark): tuple(zip(positions, glyph))
+            for cell, positions in cls.INDEX_MAP.items()
+            for mark, glyph in cls.BIG_MARK.items()
+        }
+        win_layers = {}
+        for line_name, evaluator in cls._WIN_LINE_LAMBDAS.items():
+            positions = [i for i in range(len(cls._EMPTY_BOARD)) if evaluator(*rm_coord_from_index(i, 11))]
+            win_layers[line_name] = (positions, cls._get_win_character(line_name))
+        cls._win_layers = win_layers
+
+    @classmethod
+    def _build_frame(cls, board_state: str, line_name: Optional[str]) -> str:
+        if cls._mark_layers is None:
+            cls._build_layers()
+        frame = list(cls._EMPTY_BOARD)
         for i, c in enumerate(board_state):
-            if c is not TicTacToeGame.NULL_CHAR:
-                c_sub = CharSub(cls.INDEX_MAP[str(i + 1)], cls.BIG_MARK[c])
-                board_string = substitute_chars(board_string, c_sub)
-        return board_string
+            if c != TicTacToeGame.NULL_CHAR:
+                for position, char in cls._mark_layers[(i, c)]:
+                    frame[position] = char
+        if line_name is not None:
+            positions, char = cls._win_layers[line_name]
+            for position in positions:
+                frame[position] = char
+        return cls.rm_format("".join(frame))
 
     @classmethod
     def get_board_string(cls, board_state: str, win: Optional["Win"]):
         """Returns a display ready string representeing the supplied board state."""
-        board_string = cls._build_board_string(board_state)
-        if win is not None:
-            board_string = cls._build_win_line_string(board_string, win)
-        return cls.rm_format(board_string)
+        key = (board_state, None if win is None else win.line_name)
+        frame = cls._frames.get(key)
+        if frame is None:
+            frame = cls._build_frame(*key)
+            if len(cls._frames) >= cls.MAX_CACHED_FRAMES:
+                cls._frames.clear()
+            cls._frames[key] = frame
+        return frame
 
     @classmethod
     def _get_win_character(cls, line_name: str) -> str:
@@ -336,20 +1287,310 @@ class BoardStyleLarge:
                 return char
         raise ValueError(f"Unhandled line name: {line_name}")
 
-    @classmethod
-    def _build_win_line_string(cls, board_string: str, win: "Win") -> str:
-        evaluator = cls._WIN_LINE_LAMBDAS[win.line_name]
-        win_char = cls._get_win_character(win.line_name)
-        indicies = []
-        sub_chars = ""
-        for i, _ in enumerate(board_string):
-            row, col = rm_coord_from_index(i, 11)
-            if evaluator(row, col):
-                indicies.append(i)
-                sub_chars += win_char
-        c_sub = CharSub(indicies, sub_chars)
-        return substitute_chars(board_string, c_sub)
-
-
-new_game = TicTacToeGame()
-new_game.play()
+
+class BoardStyleCompact:
+    """A board style for any shape of board, drawing each cell three characters wide under numbered columns.
+
+    Cells in the winning line are drawn in brackets.
+    """
+
+    EMPTY_CELL = "·"
+
+    def __init__(self, shape: BoardShape) -> None:
+        self.shape = shape
+        label_width = len(str(shape.rows))
+        self._margin = " " * (label_width + 1)
+        self._header = self._margin + "".join(f"{c + 1:^3}" for c in range(shape.columns))
+        self._row_labels = [f"{r + 1:>{label_width}} " for r in range(shape.rows)]
+        self._glyphs = {TicTacToeGame.NULL_CHAR: f" {self.EMPTY_CELL} "}
+        self._glyphs.update({mark: f" {mark} " for mark in TicTacToeGame.PLAYER_MARKS})
+        # Rendered boards, by (board state, winning cells).
+        self._frames: dict = {}
+
+    def get_board_string(self, board_state: str, win: Optional["Win"]) -> str:
+        """Returns a display ready string representing the supplied board state."""
+        key = (board_state, None if win is None else win.cells)
+        frame = self._frames.get(key)
+        if frame is None:
+            frame = self._build_frame(*key)
+            if len(self._frames) >= BoardStyleLarge.MAX_CACHED_FRAMES:
+                self._frames.clear()
+            self._frames[key] = frame
+        return frame
+
+    def _build_frame(self, board_state: str, win_cells: Optional[tuple]) -> str:
+        glyphs = self._glyphs
+        cells = [glyphs[c] for c in board_state]
+        for i in win_cells or ():
+            cells[i] = f"[{board_state[i]}]"
+        cols = self.shape.columns
+        lines = [self._header]
+        for r, label in enumerate(self._row_labels):
+            lines.append(label + "".join(cells[r * cols:(r + 1) * cols]))
+        return "\n".join(lines) + "\n"
+
+
+@dataclass
+class SimulationStats:
+    """Aggregate results of a batch of simulated games."""
+
+    games: int = 0
+    wins: dict = field(default_factory=dict)
+    draws: int = 0
+    lengths: dict = field(default_factory=dict)
+    elapsed: float = 0.0
+
+    def add_game(self, winner: Optional[str], turns: int) -> None:
+        self.games += 1
+        if winner is None:
+            self.draws += 1
+        else:
+            self.wins[winner] = self.wins.get(winner, 0) + 1
+        self.lengths[turns] = self.lengths.get(turns, 0) + 1
+
+    def merge(self, other: "SimulationStats") -> None:
+        self.games += other.games
+        self.draws += other.draws
+        for mark, count in other.wins.items():
+            self.wins[mark] = self.wins.get(mark, 0) + count
+        for turns, count in other.lengths.items():
+            self.lengths[turns] = self.lengths.get(turns, 0) + count
+
+    @property
+    def mean_length(self) -> float:
+        return sum(turns * count for turns, count in self.lengths.items()) / self.games if self.games else 0.0
+
+    @property
+    def games_per_second(self) -> float:
+        return self.games / self.elapsed if self.elapsed else 0.0
+
+    def summary(self) -> str:
+        """Returns the results as a few lines of text."""
+        lines = [f"{self.games} games in {self.elapsed:.2f}s ({self.games_per_second:,.0f} games/s)"]
+        for mark in TicTacToeGame.PLAYER_MARKS:
+            wins = self.wins.get(mark, 0)
+            lines.append(f"{mark} wins: {wins} ({wins / max(self.games, 1):.1%})")
+        lines.append(f"Draws: {self.draws} ({self.draws / max(self.games, 1):.1%})")
+        lines.append(f"Mean game length: {self.mean_length:.2f} turns")
+        return "\n".join(lines)
+
+
+STRATEGIES = {
+    "random": RandomInput,
+    "rules": RuleBasedInput,
+    "minimax": AIInput,
+    # Searched one process per game, as the games themselves are spread across processes.
+    "mcts": partial(MCTSInput, time_budget=None, playouts=200, processes=1),
+}
+
+
+def _simulate_batch(strategies: tuple, games: int, seed: Optional[int]) -> SimulationStats:
+    """Plays a batch of games between two named strategies, in a worker process or in this one."""
+    random.seed(seed)
+    Rules.build_outcome_table()
+    players = tuple(STRATEGIES[name]() for name in strategies)
+    stats = SimulationStats()
+    for _ in range(games):
+        game = GameEngine.play_game(players)
+        stats.add_game(game.win.player_name if game.win else None, game.turns)
+    return stats
+
+
+def simulate(
+    x_strategy: str,
+    o_strategy: str,
+    games: int,
+    processes: Optional[int] = None,
+    seed: Optional[int] = None,
+) -> SimulationStats:
+    """Plays games between two strategies named in STRATEGIES across a pool of processes, and returns the totals.
+
+    With processes=1 the games are played in this process. Batches are seeded from `seed`, so a seeded run
+    with the same number of processes is repeatable.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    strategies = (x_strategy, o_strategy)
+    for name in strategies:
+        if name not in STRATEGIES:
+            raise ValueError(f"Unknown strategy {name!r}, expected one of {', '.join(STRATEGIES)}.")
+    processes = processes or os.cpu_count() or 1
+    # A few batches per process, so one slow batch doesn't leave the others idle at the end.
+    batches = min(games, processes * 4) or 1
+    sizes = [games // batches + (1 if i < games % batches else 0) for i in range(batches)]
+    seeds = [None if seed is None else seed + i for i in range(batches)]
+    stats = SimulationStats()
+    start = time.perf_counter()
+    if processes == 1:
+        for size, batch_seed in zip(sizes, seeds):
+            stats.merge(_simulate_batch(strategies, size, batch_seed))
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            for result in executor.map(_simulate_batch, [strategies] * batches, sizes, seeds):
+                stats.merge(result)
+    stats.elapsed = time.perf_counter() - start
+    return stats
+
+
+class GameServer:
+    """Hosts games against the AI over local TCP, one coroutine session per connection.
+
+    The line protocol is the console game's: the server sends its messages a line at a time, and the client answers
+    each prompt with a line, first with the mark it will play, then with its turns. The game ends by closing the
+    connection.
+
+    On the 3x3 board the outcome table, the tablebase and the rendering of every board are built before the first
+    connection is accepted, so rules, rendering and AI moves are all lookups and the event loop only ever moves
+    lines. On larger boards the AI searches in one of a set of worker processes shared by every session. Each
+    session sticks to one worker, which keeps the session's search tree between moves until the game ends.
+    """
+
+    def __init__(
+        self,
+        shape: BoardShape = STANDARD_SHAPE,
+        host: str = "127.0.0.1",
+        port: int = SERVER_PORT,
+        processes: Optional[int] = None,
+    ) -> None:
+        self.shape = shape
+        self.host = host
+        self.port = port
+        self.processes = processes
+        self.active_sessions = 0
+        self.games_played = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._executors = []
+        self._next_executor = None
+
+    def _make_ai(self, output: Callable[[str], None]) -> ExecutorInput:
+        if self.shape == STANDARD_SHAPE:
+            # Tablebase reads, which take less time than handing them to another process would.
+            return ExecutorInput(AIInput(), None, output)
+        # One tree per move, as the worker processes are already shared between sessions.
+        strategy = MCTSInput(self.shape, time_budget=SERVER_MOVE_BUDGET, processes=1)
+        return ExecutorInput(strategy, next(self._next_executor), output)
+
+    @staticmethod
+    async def _release_ai(ai: ExecutorInput) -> None:
+        """Drops a finished session's search tree from the worker that holds it."""
+        if isinstance(ai.strategy, MCTSInput):
+            try:
+                await asyncio.get_running_loop().run_in_executor(ai.executor, ai.strategy.close)
+            except RuntimeError:
+                # The worker has been shut down along with the server, taking the tree with it.
+                pass
+
+    async def start(self) -> None:
+        """Builds the lookup tables, then starts accepting connections. A port of 0 picks a free one."""
+        if self.shape == STANDARD_SHAPE:
+            Rules.build_outcome_table()
+            Tablebase.ensure_shared()
+            # Each reachable board can only be rendered one way, as its marks decide its win.
+            for game_state in Symmetry._reachable_states():
+                BoardStyleLarge.get_board_string(game_state, Rules.evaluate_board(game_state))
+        else:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            # Spawned rather than forked, as a forked worker would hold open every connection accepted before it
+            # started, and the clients of those would never see their connection close.
+            context = multiprocessing.get_context("spawn")
+            workers = self.processes or os.cpu_count() or 1
+            self._executors = [ProcessPoolExecutor(max_workers=1, mp_context=context) for _ in range(workers)]
+            self._next_executor = cycle(self._executors)
+        self._server = await asyncio.start_server(self._run_session, self.host, self.port, backlog=SERVER_BACKLOG)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self) -> None:
+        await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.close()
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        for executor in self._executors:
+            executor.shutdown()
+        self._executors = []
+
+    @staticmethod
+    async def _ask_mark(source: StreamInput) -> str:
+        mark = (await source.get_turn_input_async("Play as X or O?: ")).upper()
+        while mark not in TicTacToeGame.PLAYER_MARKS:
+            mark = (await source.get_turn_input_async("Please enter 'X' or 'O': ")).upper()
+        return mark
+
+    async def _run_session(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        def output(text: str) -> None:
+            writer.write(text.encode() + b"\n")
+
+        self.active_sessions += 1
+        source = StreamInput(reader, writer)
+        ai = None
+        try:
+            mark = await self._ask_mark(source)
+            ai = self._make_ai(output)
+            players = tuple(Player(m, source if m == mark else ai) for m in TicTacToeGame.PLAYER_MARKS)
+            game = TicTacToeGame(players, self.shape, output)
+            await game.play_async()
+            await writer.drain()
+            self.games_played += 1
+        except (ConnectionError, asyncio.TimeoutError):
+            # The client went away, stopped answering, or sent a line past the reader's limit.
+            pass
+        except Exception:
+            import logging
+
+            logging.getLogger("tictactoe.server").exception("Session failed")
+        finally:
+            self.active_sessions -= 1
+            if ai is not None:
+                await self._release_ai(ai)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+
+def main(argv=None) -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Play tic tac toe, or simulate games between strategies.")
+    parser.add_argument("--simulate", nargs=2, metavar=("X", "O"), choices=tuple(STRATEGIES),
+                        help=f"strategies to pit against each other: {', '.join(STRATEGIES)}")
+    parser.add_argument("--games", type=int, default=100000)
+    parser.add_argument("--processes", type=int, help="for simulating or serving, defaults to one per CPU")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--size", default="3x3", help="ROWSxCOLUMNS of the board to play on")
+    parser.add_argument("--win-length", type=int, default=3, help="marks in a row needed to win")
+    parser.add_argument("--build-tablebase", nargs="?", const=TABLEBASE_PATH, metavar="PATH",
+                        help=f"solve the game and write the AI's tablebase, by default to {TABLEBASE_PATH}")
+    parser.add_argument("--serve", action="store_true", help="host games against the AI over TCP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    args = parser.parse_args(argv)
+    rows, columns = (int(n) for n in args.size.lower().split("x"))
+    shape = BoardShape(rows, columns, args.win_length)
+    if args.serve:
+        server = GameServer(shape, args.host, args.port, args.processes)
+        print(f"Serving tic tac toe on {args.host}:{args.port}")
+        try:
+            asyncio.run(server.serve_forever())
+        except KeyboardInterrupt:
+            pass
+    elif args.build_tablebase:
+        count = Tablebase.build(args.build_tablebase)
+        print(f"Wrote {count} positions to {args.build_tablebase}")
+    elif args.simulate:
+        print(simulate(*args.simulate, args.games, args.processes, args.seed).summary())
+    else:
+        TicTacToeGame(shape=shape).play()
+
+
+if __name__ == "__main__":
+    main()
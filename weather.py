@@ -2,15 +2,21 @@
 A weather report CLI. There are many like it, but this one is mine.
 Uses OpenWeatherMap for weather data, and OpenStreetMap for reverse geocoding.
 """
-import datetime
-import json
-import requests
+import os
+import threading
+from typing import Iterable, Iterator, List, Optional, TextIO
 
-from weather_secrets import OWM_API_KEY
+import weather_http
+import weather_metrics
+import weather_model
+import weather_render
+import weather_time
+from weather_cache import CoordCache, GEOCODE_TTL, SingleFlight, WEATHER_TTL, snap_coord
+
+# Heavy dependencies (requests, sqlite3, the offline geocoder) and the API key are only loaded once a
+# report actually needs them, so importing this module, or running it from cron, starts quickly.
 
-# TODO: cached weather requests (time (10 min) and LAT/LONG (+/- some threshold))
 # TODO: Today's weather
-# TODO: exclude minutely
 # TODO: evironment variable awareness for -location -units
 
 
@@ -21,6 +27,32 @@ from weather_secrets import OWM_API_KEY
 
 DEFAULT_ZIP = "10031"
 DEFAULT_COUNTRY_CODE = "US"
+# "osm" asks Nominatim for location names, "offline" looks them up in a local weather_geocode index.
+DEFAULT_GEOCODER = os.environ.get("WEATHER_GEOCODER", "osm")
+# Overridable so the reports can be pointed at weather_replay's local stand-in server.
+OWM_API_BASE = os.environ.get("OWM_API_BASE", "https://api.openweathermap.org")
+NOMINATIM_API_BASE = os.environ.get("NOMINATIM_API_BASE", "https://nominatim.openstreetmap.org")
+
+WEATHER_CACHE = CoordCache("weather", WEATHER_TTL)
+GEOCODE_CACHE = CoordCache("geocode", GEOCODE_TTL)
+
+# The sections of a One Call response, and the ones each report is built from. Sections no requested report
+# needs are left out of the request with the API's exclude parameter.
+ONE_CALL_SECTIONS = ("current", "minutely", "hourly", "daily", "alerts")
+REPORT_SECTIONS = {
+    "current": ("current",),
+    "hourly": ("hourly",),
+    "weekly": ("daily",),
+}
+ALL_REPORTS = tuple(REPORT_SECTIONS)
+# When set, every forecast fetched is also appended to a weather_archive.ForecastArchive in this directory.
+ARCHIVE_DIR = os.environ.get("WEATHER_ARCHIVE_DIR")
+_archive = None
+# Held while the archive is created, so concurrent fetches share one instance and its in-process lock.
+_archive_lock = threading.Lock()
+# Uncached lookups still share any identical request that is already in flight.
+WEATHER_FLIGHTS = SingleFlight("weather")
+GEOCODE_FLIGHTS = SingleFlight("geocode")
 
 
 def _k_to_f(k: float) -> float:
@@ -33,247 +65,237 @@ def _mps_to_mph(s: float) -> float:
 
 def _parse_compass_heading(heading: float) -> str:
     """Converts a supplied compas headinf float to a string describing direction."""
-    points = {
-        0: "N",
-        1: "NNE",
-        2: "NE",
-        3: "ENE",
-        4: "E",
-        5: "ESE",
-        6: "SE",
-        7: "SSE",
-        8: "S",
-        9: "SSW",
-        10: "SW",
-        11: "WSW",
-        12: "W",
-        13: "WNW",
-        14: "NW",
-        15: "NNW",
-    }
-    return points[int((heading + 11.25) % 360 // 22.5)]
+    return weather_model.compass_point(heading)
 
 def _parse_beaufort_wind_speed(wind_speed: float) -> str:
     """Returns the description associated with the supplied wind speed on the Beaufort scale."""
-    wind_descriptions = {
-        1: "Light air",
-        4: "Light breeze",
-        8: "Gentle breeze",
-        13: "Moderate breeze",
-        19: "Fresh breeze",
-        25: "Strong breeze",
-        32: "Near gale",
-        39: "Gale",
-        47: "Strong gale",
-        55: "Whole gale",
-        64: "Storm force",
-        75: "Hurricane force",
-    }
-    description = "Calm"
-    for min_speed, desc in wind_descriptions.items():
-        if wind_speed >= min_speed:
-            description = desc
-        else:
-            break
-    return description
+    return weather_model.beaufort_description(wind_speed)
 
 def _make_ordinal(n: int) -> str:
     """Returns the supplied int as an ordinal number string."""
-    oridnal_suffix = {
-        "1": "st",
-        "2": "nd",
-        "3": "rd",
-    }
-    if str(n)[-1] in oridnal_suffix and not 10 < n % 100 < 14:
-        return str(n) + oridnal_suffix[str(n)[-1]]
-    return str(n) + "th"
-
-
-def _get_time_from_timestamp(timestamp:int) -> str:
-    """Converts an epoch based timestamp to a 12 hr HH:MM formatted time."""
-    dt = datetime.datetime.fromtimestamp(timestamp)
-    return f"{dt.hour % 12 or 12}:{dt.minute}"
-
-def _get_long_date_from_timestamp(timestamp: int) -> str:
-    """Returns a long date string from a timestamp."""
-    dt = datetime.date.fromtimestamp(timestamp)
-    return dt.strftime(f"%A, %B {_make_ordinal(dt.day)}")
-
-def _get_short_date_from_timestamp(timestamp: int) -> str:
-    """Returns a short date string from a timestamp."""
-    dt = datetime.date.fromtimestamp(timestamp)
-    return dt.strftime(f"{dt.month}/{dt.day}/%y")
-
-def _get_weather_info_by_coord(lat: float, long: float, api_key=OWM_API_KEY) -> dict:
-    """Requests weather info for the supplied lat long coordinates from the OpenWeatherMap API and returns the response as a JSON object."""
-    weather_api_uri = f"https://api.openweathermap.org/data/2.5/onecall?lat={lat}&lon={long}&appid={api_key}"
-    raw_response = requests.get(weather_api_uri)
-    return json.loads(raw_response.text)
+    return weather_time.make_ordinal(n)
+
+def _get_owm_api_key() -> str:
+    """Returns the OpenWeatherMap API key from the OWM_API_KEY environment variable, falling back on weather_secrets.py."""
+    api_key = os.environ.get("OWM_API_KEY")
+    if api_key:
+        return api_key
+    try:
+        from weather_secrets import OWM_API_KEY
+    except ImportError:
+        raise RuntimeError(
+            "No OpenWeatherMap API key found. Set OWM_API_KEY or define it in weather_secrets.py."
+        ) from None
+    return OWM_API_KEY
+
+def _sections_for(reports: Iterable[str]) -> tuple:
+    """Returns the One Call sections needed to build the supplied reports. Alerts are always kept."""
+    needed = {"alerts"}
+    for report in reports:
+        needed.update(REPORT_SECTIONS[report])
+    return tuple(s for s in ONE_CALL_SECTIONS if s in needed)
+
+def _get_weather_info_by_coord(lat: float, long: float, api_key: str = None, sections: tuple = None) -> dict:
+    """Requests weather info for the supplied lat long coordinates from the OpenWeatherMap API and returns the response as a JSON object.
+
+    Only the supplied sections are requested, and only the fields the reports read are kept from them.
+    """
+    api_key = api_key or _get_owm_api_key()
+    sections = sections or _sections_for(ALL_REPORTS)
+    exclude = ",".join(s for s in ONE_CALL_SECTIONS if s not in sections)
+    weather_api_uri = f"{OWM_API_BASE}/data/2.5/onecall?lat={lat}&lon={long}&exclude={exclude}&appid={api_key}"
+    return weather_model.project_payload(weather_http.get_json(weather_api_uri, provider="owm"), sections)
 
 def _osm_reverse_lookup(lat: float, long: float):
     """Uses the OpenStreetMap API to reverse-geocode the supplied lat long coordinates."""
-    osm_reverse_api_uri = f"https://nominatim.openstreetmap.org/reverse?lat={lat}&lon={long}&zoom=10&format=jsonv2"
-    osm_response = requests.get(osm_reverse_api_uri)
-    return json.loads(osm_response.text)
+    osm_reverse_api_uri = f"{NOMINATIM_API_BASE}/reverse?lat={lat}&lon={long}&zoom=10&format=jsonv2"
+    return weather_http.get_json(osm_reverse_api_uri, provider="nominatim")
+
+def _get_archive():
+    global _archive
+    with _archive_lock:
+        if _archive is None or _archive.root != ARCHIVE_DIR:
+            import weather_archive
+
+            _archive = weather_archive.ForecastArchive(ARCHIVE_DIR)
+        return _archive
+
+def get_weather_info(lat: float, long: float, use_cache: bool = True, reports: Iterable[str] = ALL_REPORTS) -> dict:
+    """Returns the weather info needed for the supplied reports, from the cache if a fresh entry exists nearby."""
+    sections = _sections_for(reports)
+
+    def fetch(lat: float, long: float) -> dict:
+        weather_dict = _get_weather_info_by_coord(lat, long, sections=sections)
+        if ARCHIVE_DIR and "timezone_offset" in weather_dict:
+            try:
+                _get_archive().append(lat, long, weather_dict)
+            except Exception:
+                # Archiving is a side effect of the fetch, and mustn't fail one that succeeded.
+                import logging
+
+                logging.getLogger("weather.archive").exception("Couldn't archive the forecast for %s,%s", lat, long)
+                weather_metrics.count("archive_failure")
+        return weather_dict
+
+    if not use_cache:
+        return WEATHER_FLIGHTS.do((snap_coord(lat, long), sections), fetch, lat, long)
+    # Error responses carry a "cod" code instead of the location's timezone.
+    return WEATHER_CACHE.get_or_fetch(lat, long, fetch, lambda d: "timezone_offset" in d, variant=",".join(sections))
+
+def get_location_info(lat: float, long: float, use_cache: bool = True, geocoder: str = None) -> dict:
+    """Returns reverse-geocoded location info for the supplied coordinates, from the cache if a fresh entry exists nearby."""
+    geocoder = geocoder or DEFAULT_GEOCODER
+    if geocoder == "offline":
+        # The local index is faster than the cache would be, so it is never cached.
+        import weather_geocode
+
+        return weather_geocode.offline_reverse_lookup(lat, long)
+    if geocoder != "osm":
+        raise ValueError(f"Unknown geocoder: {geocoder}")
+    if not use_cache:
+        return GEOCODE_FLIGHTS.do(snap_coord(lat, long), _osm_reverse_lookup, lat, long)
+    return GEOCODE_CACHE.get_or_fetch(lat, long, _osm_reverse_lookup, lambda d: "name" in d)
+
+def get_cache_stats() -> dict:
+    """Returns the hit and miss counters for the weather and geocode caches."""
+    return {"weather": WEATHER_CACHE.stats, "geocode": GEOCODE_CACHE.stats}
+
+def get_coalescing_stats() -> dict:
+    """Returns how many upstream calls were made, and how many callers shared one instead, for each provider."""
+    return {
+        name: {"calls": sum(f.calls for f in flights), "coalesced": sum(f.coalesced for f in flights)}
+        for name, flights in (
+            ("weather", (WEATHER_CACHE.flights, WEATHER_FLIGHTS)),
+            ("geocode", (GEOCODE_CACHE.flights, GEOCODE_FLIGHTS)),
+        )
+    }
 
 class WeatherReport():
     """A class to parse, contain, and display weather information."""
     
-    def __init__(self, lat:float, long:float) -> None:
-        weather_dict = _get_weather_info_by_coord(lat, long)
-        loc_dict = _osm_reverse_lookup(lat, long)
-        self.loc_name = loc_dict["name"]
-        self.input_data = weather_dict
-        self.raw_current = self.input_data["current"]
-        #self.raw_minutely = self.input_data["minutely"]
-        self.raw_hourly = self.input_data["hourly"]
-        self.raw_daily = self.input_data["daily"]
-        if "alerts" in self.input_data:
-            self.alerts = self.input_data["alerts"]
-        else:
-            self.alerts = ""
-    
-    def get_current_weather(self) -> str:
-        """Returns a string describing current weather conditions."""
-        desc = self.raw_current["weather"][0]["description"].capitalize()
-        temp = self._generate_temp_report(int(_k_to_f(self.raw_current["temp"])),int(_k_to_f(self.raw_current["feels_like"])))
-        humidity = self.raw_current["humidity"]
-        wind = self._generate_wind_report(self.raw_current["wind_speed"], self.raw_current["wind_deg"])
-        report = (
-            f"Currently in {self.loc_name}: "
-            f"{desc} | "
-            f"{temp} | "
-            f"{humidity}% humid | "
-            f"{wind}"
-        )
-        return report
+    def __init__(
+        self,
+        lat: float,
+        long: float,
+        use_cache: bool = True,
+        geocoder: str = None,
+        reports: Iterable[str] = ALL_REPORTS,
+    ) -> None:
+        """Fetches only the data the reports named in `reports` need; reports that weren't named have no data to show."""
+        with weather_metrics.timer("report_init"):
+            # The two lookups are independent, so run them side by side rather than one after the other.
+            executor = weather_http.get_executor()
+            loc_future = executor.submit(get_location_info, lat, long, use_cache, geocoder)
+            weather_dict = get_weather_info(lat, long, use_cache, reports)
+            loc_dict = loc_future.result()
+            self._load(lat, long, weather_dict, loc_dict)
 
-    def _generate_hourly_report(self, hourly_dict:dict) -> dict:
-        """Returns a dict containing strings describing hourly weather conditions."""
-        hourly_report_dict = {
-            "desc": f'{hourly_dict["weather"][0]["description"].capitalize()}',
-            "dt": f'{_get_time_from_timestamp(hourly_dict["dt"])}',
-            "temp": f'{self._generate_temp_report(int(_k_to_f(hourly_dict["temp"])), int(_k_to_f(hourly_dict["feels_like"])))}',
-            "humidity": f'{hourly_dict["humidity"]}% humidity',
-            "wind": f'{self._generate_wind_report(_mps_to_mph(hourly_dict["wind_speed"]), hourly_dict["wind_deg"])}',
-            "pop": f'{hourly_dict["pop"] * 100}% chance of precipitation',
-        }
-        return hourly_report_dict
-
-    def get_hourly_weather(self) -> str:
-        """Returns a string describing the hourly weather conditions for the next 24 hours."""
-        raw_dicts = self.raw_hourly[:24]
-        hourly_dicts = [self._generate_hourly_report(d) for d in raw_dicts]
-        reports = self._format_hourly_reports(hourly_dicts)
-        report_string = (
-            f"Next 24 hours in {self.loc_name}:\n"
-        )
-        for report in [self._generate_hourly_report_string(report) for report in reports]:
-            report_string += report + "\n"
-        return report_string
-    
     @classmethod
-    def _format_hourly_reports(cls, reports: list) -> list:
-        """A convenience method consolidating report formatting steps into a single call."""
-        reports = cls._insert_repeat_characters(reports)
-        reports = cls._enhance_repeat_characters(reports)
-        return cls._pad_report_strings(reports)
-
-    @staticmethod
-    def _insert_repeat_characters(reports: list) -> list:
-        """Replaces weather description strings with a repeat character if the condition has not changed from the previous instance."""
-        skip_keys = {"temp", "humidity"}
-        most_recent = {}
-        for report in reports:
-            if not most_recent:
-                most_recent = {k:v for k, v in report.items()}
-                continue
-            for k, v in report.items():
-                if k in skip_keys:
-                    continue
-                if v == most_recent[k]:
-                    report[k] = "↓"
-                else:
-                    most_recent[k] = v
-        return reports
-    
-    @staticmethod
-    def _enhance_repeat_characters(reports: list) -> list:
-        """Replaces all but the last repeat character in a series with a different one, indicating continuity."""
-        for i, report in enumerate(reports):
-            if i == len(reports) - 1:
-                break
-            for k, v in report.items():
-                if v == "↓" and reports[i + 1][k] == "↓":
-                    report[k] = "╎"
-        return reports
-
-    @staticmethod
-    def _generate_hourly_report_string(weather_dict: dict) -> str:
-        """Converts an hourly weather dict into a long string."""
-        report = (
-            f"  {weather_dict['dt']} | "
-            f"{weather_dict['desc']} | "
-            f"{weather_dict['temp']}| "
-            f"{weather_dict['humidity']} | "
-            f"{weather_dict['wind']} | "
-            f"{weather_dict['pop']}"
-        )
+    def from_data(cls, lat: float, long: float, weather_dict: dict, loc_dict: dict) -> "WeatherReport":
+        """Builds a report from already fetched weather and location info, without making any requests."""
+        report = cls.__new__(cls)
+        report._load(lat, long, weather_dict, loc_dict)
         return report
 
-    @staticmethod
-    def _pad_report_strings(report_list: list) -> list:
-        """Adds empty characters to the values in a list of dicts until each value is as long as the longest value for that key."""
-        # find max length of each report element
-        max_dict = {k: 0 for k in report_list[0]}
-        for k in max_dict:
-            for report in report_list:
-                max_dict[k] = max(max_dict[k], len(report[k]))
-        # pad each element to match the longest instance
-        for report in report_list:
-            for k, v in report.items():
-                report[k] = str.center(v, max_dict[k])
-        return report_list
-
-    def get_weekly_weather(self):
-        dicts = [self._build_weekday_weather_dict(day) for day in self.raw_daily]
-        str_list = self._construct_weekly_report(dicts)
-        report = ""
-        for weather_str in str_list:
-            report += weather_str + "\n"
-        return report
+    def _load(self, lat: float, long: float, weather_dict: dict, loc_dict: dict) -> None:
+        # One Call answers failures like a bad key with {"cod": ..., "message": ...} in place of a forecast.
+        if "cod" in weather_dict:
+            message = weather_dict.get("message", f"error {weather_dict['cod']}")
+            raise weather_http.UpstreamError(f"OpenWeatherMap: {message}")
+        with weather_metrics.timer("parse"):
+            self.lat = lat
+            self.long = long
+            self.loc_name = loc_dict["name"]
+            self.raw_current = weather_dict.get("current")
+            # The forecast sections the payload had, as one that wasn't fetched parses the same as an empty one.
+            self.sections = frozenset(section for section in ("hourly", "daily") if section in weather_dict)
+            # Times and dates are shown in the location's own time zone; payloads without an offset are read as UTC.
+            self.timezone_offset = weather_dict.get("timezone_offset", 0)
+            self.times = weather_time.TimestampFormatter(self.timezone_offset)
+            # The hourly and daily forecasts are parsed once into columns; the raw dicts aren't kept around.
+            self.hourly = weather_model.ForecastColumns.from_entries(weather_dict.get("hourly", ()))
+            self.daily = weather_model.ForecastColumns.from_entries(weather_dict.get("daily", ()), part="day")
+            self.alerts = weather_dict.get("alerts", "")
     
-    @classmethod
-    def _construct_weekly_report(cls, dicts_list: list) -> list:
-        """A convenience method tying together the methods involved in constructing and formatting a weekly report."""
-        padded = cls._pad_report_strings(dicts_list)
-        return [cls._format_weekday_weather_dict(d) for d in padded]
-
-    @classmethod
-    def _build_weekday_weather_dict(cls, weekday_weather_dict) -> dict:
-        report_dict = {
-            "short_date": _get_short_date_from_timestamp(weekday_weather_dict['dt']),
-            "long_date": _get_long_date_from_timestamp(weekday_weather_dict['dt']),
-            "desc": weekday_weather_dict["weather"][0]["description"].capitalize(),
-            "temp": cls._generate_temp_report(int(_k_to_f(weekday_weather_dict["temp"]["day"])), int(_k_to_f(weekday_weather_dict["feels_like"]["day"]))),
-            "humidity": f"{weekday_weather_dict['humidity']}% humidity",
-            "wind": _parse_beaufort_wind_speed(_mps_to_mph(weekday_weather_dict["wind_speed"])),
-            "pop": f"{int(weekday_weather_dict['pop'] * 100)}% chance of precipitation"
-        }
-        return report_dict
+    def get_current_weather(self) -> str:
+        """Returns a string describing current weather conditions."""
+        if self.raw_current is None:
+            raise ValueError("This report was built without current conditions.")
+        with weather_metrics.timer("render", report="current"):
+            desc = self.raw_current["weather"][0]["description"].capitalize()
+            temp = self._generate_temp_report(int(_k_to_f(self.raw_current["temp"])),int(_k_to_f(self.raw_current["feels_like"])))
+            humidity = self.raw_current["humidity"]
+            wind = self._generate_wind_report(self.raw_current["wind_speed"], self.raw_current["wind_deg"])
+            report = (
+                f"Currently in {self.loc_name}: "
+                f"{desc} | "
+                f"{temp} | "
+                f"{humidity}% humid | "
+                f"{wind}"
+            )
+        return report
 
-    @classmethod
-    def _format_weekday_weather_dict(cls, info_dict: dict) -> str:
-        """Constructs a string describing the weather conditions for on day in a week."""
-        report_str = (
-            f"{info_dict['long_date']}: "
-            f"{info_dict['desc']} | "
-            f"{info_dict['temp']} | "
-            f"{info_dict['humidity']} | "
-            f"{info_dict['wind']} | "
-            f"{info_dict['pop']}"
-        )
-        return report_str
+    def _require_section(self, section: str) -> None:
+        if section not in self.sections:
+            raise ValueError(f"This report was built without the {section} forecast.")
+
+    def _generate_hourly_rows(self, columns: weather_model.ForecastColumns) -> Iterator[tuple]:
+        """Yields a row of strings describing each hour's weather conditions, ordered as in HOURLY_LAYOUT."""
+        temps = self._generate_temp_reports(columns)
+        winds = self._generate_wind_reports(columns)
+        for time, desc, temp, humidity, wind, pop in zip(
+            self.times.times(columns.dt), columns.description_list(), temps, columns.humidity, winds, columns.pop
+        ):
+            yield (
+                time,
+                desc,
+                temp,
+                f"{humidity}% humidity",
+                wind,
+                f"{round(pop * 100)}% chance of precipitation",
+            )
+
+    def get_hourly_weather(self, hours: int = 24) -> str:
+        """Returns a string describing the hourly weather conditions for the next 24 hours."""
+        self._require_section("hourly")
+        with weather_metrics.timer("render", report="hourly"):
+            rows = self._generate_hourly_rows(self.hourly.head(hours))
+            return weather_render.render_table(
+                weather_render.HOURLY_LAYOUT, rows, f"Next {hours} hours in {self.loc_name}:\n"
+            )
+
+    def write_hourly_weather(self, sink: TextIO, hours: int = 48, widths: Optional[List[int]] = None) -> List[int]:
+        """Writes the hourly report table to a file-like sink, streaming rows if column widths are supplied."""
+        self._require_section("hourly")
+        rows = self._generate_hourly_rows(self.hourly.head(hours))
+        return weather_render.write_table(weather_render.HOURLY_LAYOUT, rows, sink, widths)
+
+    def _generate_weekly_rows(self, columns: weather_model.ForecastColumns) -> Iterator[tuple]:
+        """Yields a row of strings describing each day's weather conditions, ordered as in WEEKLY_LAYOUT."""
+        temps = self._generate_temp_reports(columns)
+        winds = weather_model.beaufort_descriptions(weather_model.mps_to_mph(columns.wind_speed))
+        for date, desc, temp, humidity, wind, pop in zip(
+            self.times.long_dates(columns.dt), columns.description_list(), temps, columns.humidity, winds, columns.pop
+        ):
+            yield (
+                date,
+                desc,
+                temp,
+                f"{humidity}% humidity",
+                wind,
+                f"{round(pop * 100)}% chance of precipitation",
+            )
+
+    def get_weekly_weather(self) -> str:
+        """Returns a string describing the daily weather conditions for the coming week."""
+        self._require_section("daily")
+        with weather_metrics.timer("render", report="weekly"):
+            return weather_render.render_table(weather_render.WEEKLY_LAYOUT, self._generate_weekly_rows(self.daily))
+
+    def write_weekly_weather(self, sink: TextIO, widths: Optional[List[int]] = None) -> List[int]:
+        """Writes the weekly report table to a file-like sink, streaming rows if column widths are supplied."""
+        self._require_section("daily")
+        return weather_render.write_table(weather_render.WEEKLY_LAYOUT, self._generate_weekly_rows(self.daily), sink, widths)
 
     @staticmethod
     def _generate_temp_report(temp:int, feel: int) -> str:
@@ -292,6 +314,81 @@ class WeatherReport():
         wind_description += f", {_parse_compass_heading(wind_dir)}"
         return wind_description
 
+    @classmethod
+    def _generate_temp_reports(cls, columns: weather_model.ForecastColumns) -> list:
+        """Returns a temperature report string for every entry in a set of forecast columns."""
+        temps = weather_model.k_to_f(columns.temp)
+        feels = weather_model.k_to_f(columns.feels_like)
+        return [cls._generate_temp_report(int(temp), int(feel)) for temp, feel in zip(temps, feels)]
+
+    @staticmethod
+    def _generate_wind_reports(columns: weather_model.ForecastColumns) -> list:
+        """Returns a wind report string for every entry in a set of forecast columns."""
+        descriptions = weather_model.beaufort_descriptions(weather_model.mps_to_mph(columns.wind_speed))
+        headings = weather_model.compass_points(columns.wind_deg)
+        return [
+            desc if speed < 1 else f"{desc}, {heading}"
+            for desc, speed, heading in zip(descriptions, columns.wind_speed, headings)
+        ]
+
+
+def generate_reports(
+    coords: Iterable[tuple],
+    use_cache: bool = True,
+    max_workers: int = weather_http.POOL_MAXSIZE,
+    geocoder: str = None,
+    reports: Iterable[str] = ALL_REPORTS,
+    errors: Optional[dict] = None,
+) -> Iterator[WeatherReport]:
+    """Fetches reports for many (lat, long) pairs at once, yielding each one as soon as it is ready.
+
+    Every weather and location lookup is its own task on a pool of max_workers threads. Requests to each
+    provider are still capped by weather_http.PROVIDER_LIMITS, so a large batch can't flood either API.
+    A location whose lookups fail is skipped rather than ending the batch, and if an errors dict is supplied, the
+    exception is recorded there under the location's index in coords. Closing the generator early cancels the
+    lookups that haven't started.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    coords = list(coords)
+    weather_dicts = {}
+    loc_dicts = {}
+    failed = set()
+    if (geocoder or DEFAULT_GEOCODER) == "offline":
+        import weather_geocode
+
+        loc_dicts = dict(enumerate(weather_geocode.get_default_geocoder().search(coords)))
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="weather-batch") as executor:
+        futures = {}
+        try:
+            for i, (lat, long) in enumerate(coords):
+                futures[executor.submit(get_weather_info, lat, long, use_cache, reports)] = (i, weather_dicts)
+                if i not in loc_dicts:
+                    futures[executor.submit(get_location_info, lat, long, use_cache, geocoder)] = (i, loc_dicts)
+            for future in as_completed(futures):
+                i, results = futures[future]
+                if i in failed:
+                    continue
+                try:
+                    results[i] = future.result()
+                    if i not in weather_dicts or i not in loc_dicts:
+                        continue
+                    lat, long = coords[i]
+                    # Nominatim answers a failed lookup with {"error": ...}, which has no name to build from.
+                    report = WeatherReport.from_data(lat, long, weather_dicts.pop(i), loc_dicts.pop(i))
+                except Exception as e:
+                    failed.add(i)
+                    weather_dicts.pop(i, None)
+                    loc_dicts.pop(i, None)
+                    if errors is not None:
+                        errors[i] = e
+                    continue
+                yield report
+        finally:
+            # Queued lookups are dropped rather than run, if the batch is abandoned or fails part way.
+            for future in futures:
+                future.cancel()
+
 
 if __name__ == "__main__":
     seattle_zip = 98101
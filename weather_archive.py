@@ -0,0 +1,259 @@
+"""
+An append-only archive of every forecast weather.py fetches, for measuring forecast accuracy after the fact.
+Each location gets its own file of fixed-width records, appended in fetch order, so a query finds its time range
+by binary search and unpacks only the records inside it straight from a memory map.
+"""
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from typing import Iterator, List, NamedTuple, Optional
+
+import weather_model
+from weather_cache import DEFAULT_GRID, snap_coord
+
+try:
+    import fcntl
+except ImportError:
+    # Without flock, appends are only serialized between the threads of one process.
+    fcntl = None
+
+DEFAULT_ARCHIVE_DIR = os.environ.get(
+    "WEATHER_ARCHIVE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "weather_cli", "archive"),
+)
+
+KINDS = ("current", "hourly", "daily")
+
+# File layout: header, then one record per forecast entry. Weather descriptions are stored once each, one per line,
+# in the archive's descriptions.txt, and records refer to them by line number.
+_MAGIC = b"WXARC001"
+_HEADER = struct.Struct("<8sI")
+# fetched_at, dt, temp, feels_like, wind_speed, wind_deg, pop, description code, humidity, kind.
+# Values are kept in the units OWM sends: Kelvin and meters per second.
+_RECORD = struct.Struct("<qqfffffHBB")
+_DESCRIPTIONS_FILE = "descriptions.txt"
+# Held while appending, so writers in other processes agree on description codes and on each file's fetch order.
+_LOCK_FILE = ".lock"
+
+
+class ArchiveRecord(NamedTuple):
+    fetched_at: int
+    dt: int
+    temp: float
+    feels_like: float
+    wind_speed: float
+    wind_deg: float
+    pop: float
+    description: int
+    humidity: int
+    kind: int
+
+
+FIELDS = ArchiveRecord._fields
+
+
+class ForecastArchive:
+    """Stores forecast snapshots under a directory, one file per location snapped to `grid` degrees."""
+
+    def __init__(self, root: str = DEFAULT_ARCHIVE_DIR, grid: float = DEFAULT_GRID) -> None:
+        self.root = root
+        self.grid = grid
+        self._lock = threading.Lock()
+        self._descriptions: List[str] = []
+        self._codes: dict = {}
+        # How far into descriptions.txt has been read, in bytes.
+        self._descriptions_read = 0
+
+    def _path(self, lat: float, long: float) -> str:
+        lat, long = snap_coord(lat, long, self.grid)
+        return os.path.join(self.root, f"{lat:+.4f}_{long:+.4f}.wxa")
+
+    def _load_descriptions(self) -> List[str]:
+        """Reads any descriptions added to descriptions.txt since it was last read, by this or any other writer."""
+        path = os.path.join(self.root, _DESCRIPTIONS_FILE)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                f.seek(self._descriptions_read)
+                data = f.read()
+            # Only whole lines, in case another process is part way through appending.
+            data = data[:data.rfind(b"\n") + 1]
+            self._descriptions_read += len(data)
+            for desc in data.decode("utf-8").splitlines():
+                self._codes[desc] = len(self._descriptions)
+                self._descriptions.append(desc)
+        return self._descriptions
+
+    def descriptions(self) -> List[str]:
+        """Returns the weather descriptions that records' description codes refer to."""
+        with self._lock:
+            return list(self._load_descriptions())
+
+    def _code_for(self, description: str, new: list) -> int:
+        code = self._codes.get(description)
+        if code is None:
+            code = len(self._descriptions)
+            self._descriptions.append(description)
+            self._codes[description] = code
+            new.append(description)
+        return code
+
+    def _pack(self, columns: weather_model.ForecastColumns, kind: int, fetched_at: int, new: list) -> List[bytes]:
+        pack = _RECORD.pack
+        codes = [self._code_for(desc, new) for desc in columns.descriptions]
+        return [
+            pack(fetched_at, dt, temp, feels_like, wind_speed, wind_deg, pop, codes[code], humidity, kind)
+            for dt, temp, feels_like, wind_speed, wind_deg, pop, code, humidity in zip(
+                columns.dt,
+                columns.temp,
+                columns.feels_like,
+                columns.wind_speed,
+                columns.wind_deg,
+                columns.pop,
+                columns.desc_codes,
+                columns.humidity,
+            )
+        ]
+
+    @staticmethod
+    def _last_fetched_at(path: str) -> Optional[int]:
+        """Returns when the last snapshot in a location's file was fetched, read from disk as another process may
+        have appended to it since."""
+        if not os.path.exists(path) or os.path.getsize(path) <= _HEADER.size:
+            return None
+        with open(path, "rb") as f:
+            f.seek(-_RECORD.size, os.SEEK_END)
+            return _RECORD.unpack(f.read(_RECORD.size))[0]
+
+    def append(self, lat: float, long: float, weather_dict: dict, fetched_at: Optional[int] = None) -> int:
+        """Archives the current, hourly and daily forecasts from a One Call payload, and returns the records written.
+
+        Snapshots must be appended in fetch time order, as queries rely on each file being sorted by it. Several
+        processes can append to one archive at once: each append holds a lock on the archive while it runs. With no
+        fetched_at, the snapshot is stamped with the time once the lock is held, and never earlier than the last one.
+        """
+        sections = (
+            ("current", [weather_dict["current"]] if "current" in weather_dict else (), None),
+            ("hourly", weather_dict.get("hourly", ()), None),
+            ("daily", weather_dict.get("daily", ()), "day"),
+        )
+        path = self._path(lat, long)
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock, open(os.path.join(self.root, _LOCK_FILE), "ab") as lock_file:
+            if fcntl is not None:
+                # Released when the lock file is closed.
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            last = self._last_fetched_at(path)
+            if fetched_at is None:
+                # Taken under the lock, so concurrent appends are stamped in the order they're written, and held at
+                # the last snapshot's time if the clock has stepped back since.
+                fetched_at = max(int(time.time()), last or 0)
+            fetched_at = int(fetched_at)
+            if last is not None and fetched_at < last:
+                raise ValueError(f"Snapshot fetched at {fetched_at} is older than the last one archived, {last}.")
+            self._load_descriptions()
+            new_descriptions = []
+            records = []
+            try:
+                for kind, (_, entries, part) in enumerate(sections):
+                    columns = weather_model.ForecastColumns.from_entries(entries, part=part)
+                    records.extend(self._pack(columns, kind, fetched_at, new_descriptions))
+                if new_descriptions:
+                    # Written before the records, so no record on disk refers to a description that isn't.
+                    data = "".join(desc + "\n" for desc in new_descriptions).encode("utf-8")
+                    with open(os.path.join(self.root, _DESCRIPTIONS_FILE), "ab") as f:
+                        f.write(data)
+                    self._descriptions_read += len(data)
+            except BaseException:
+                # Codes handed out for descriptions that never reached the file would clash with another writer's.
+                for desc in new_descriptions:
+                    self._descriptions.pop()
+                    del self._codes[desc]
+                raise
+            with open(path, "ab") as f:
+                if f.tell() == 0:
+                    f.write(_HEADER.pack(_MAGIC, _RECORD.size))
+                f.write(b"".join(records))
+        return len(records)
+
+    def locations(self) -> List[tuple]:
+        """Returns the snapped (lat, long) of every location with archived forecasts."""
+        if not os.path.isdir(self.root):
+            return []
+        found = []
+        for name in sorted(os.listdir(self.root)):
+            if name.endswith(".wxa"):
+                lat, long = name[:-4].split("_")
+                found.append((float(lat), float(long)))
+        return found
+
+    @staticmethod
+    def _bisect(view: memoryview, count: int, fetched_at: int) -> int:
+        """Returns the index of the first record fetched at or after the supplied time."""
+        lo, hi = 0, count
+        unpack_from = _RECORD.unpack_from
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if unpack_from(view, mid * _RECORD.size)[0] < fetched_at:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _scan(self, lat: float, long: float, start: Optional[int], end: Optional[int]) -> Iterator[tuple]:
+        """Yields the raw record tuples for a location fetched in [start, end), from a memory map of its file."""
+        path = self._path(lat, long)
+        if not os.path.exists(path) or os.path.getsize(path) <= _HEADER.size:
+            return
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, record_size = _HEADER.unpack_from(mapped, 0)
+            if magic != _MAGIC or record_size != _RECORD.size:
+                raise ValueError(f"{path} is not a forecast archive.")
+            # Only whole records are read, in case another thread is part way through appending.
+            count = (len(mapped) - _HEADER.size) // _RECORD.size
+            view = memoryview(mapped)[_HEADER.size:_HEADER.size + count * _RECORD.size]
+            try:
+                first = 0 if start is None else self._bisect(view, count, start)
+                last = count if end is None else self._bisect(view, count, end)
+                records = view[first * _RECORD.size:last * _RECORD.size]
+                try:
+                    yield from _RECORD.iter_unpack(records)
+                finally:
+                    records.release()
+            finally:
+                view.release()
+        finally:
+            mapped.close()
+
+    def query(
+        self,
+        lat: float,
+        long: float,
+        kind: str = "hourly",
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+    ) -> Iterator[ArchiveRecord]:
+        """Yields the archived records of one kind for a location, fetched between start and end in unix time."""
+        kind_code = KINDS.index(kind)
+        for record in self._scan(lat, long, start, end):
+            if record[-1] == kind_code:
+                yield ArchiveRecord._make(record)
+
+    def column(
+        self,
+        lat: float,
+        long: float,
+        field: str,
+        kind: str = "hourly",
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+    ) -> array:
+        """Returns one field of the matching records as a typed array, e.g. every hourly temp over a month."""
+        index = FIELDS.index(field)
+        kind_code = KINDS.index(kind)
+        typecode = "q" if field in ("fetched_at", "dt") else "d"
+        return array(typecode, [r[index] for r in self._scan(lat, long, start, end) if r[-1] == kind_code])
@@ -0,0 +1,198 @@
+"""
+Benchmarks for weather.py, run against weather_replay's local stand-in server so results are reproducible.
+Measures end to end report latency, batch throughput, and render cost across payload sizes, and writes the
+results as JSON so runs can be compared with --compare.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from typing import Callable, List, Optional
+
+import weather
+import weather_http
+import weather_replay
+
+DEFAULT_RENDER_SIZES = (24, 48, 96, 192, 384)
+
+
+def _measure(fn: Callable[[], object], iterations: int, warmup: int = 1) -> List[float]:
+    """Returns the wall time in seconds of each of `iterations` calls to fn."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def _summarize(name: str, params: dict, samples: List[float], **extra) -> dict:
+    ordered = sorted(samples)
+    result = {
+        "name": name,
+        "params": params,
+        "iterations": len(samples),
+        "mean_s": statistics.fmean(samples),
+        "p50_s": ordered[len(ordered) // 2],
+        "p95_s": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "min_s": ordered[0],
+    }
+    result.update(extra)
+    return result
+
+
+@contextlib.contextmanager
+def pointed_at(url: str):
+    """Temporarily points weather.py's API calls at the supplied base URL, with the providers' rate limits lifted."""
+    saved = (weather.OWM_API_BASE, weather.NOMINATIM_API_BASE, os.environ.get("OWM_API_KEY"))
+    weather.OWM_API_BASE = url
+    weather.NOMINATIM_API_BASE = url
+    os.environ["OWM_API_KEY"] = "replay"
+    for provider in weather_http.PROVIDER_RATES:
+        weather_http.set_rate_limit(provider, None)
+    try:
+        yield
+    finally:
+        for provider, (rate, burst) in weather_http.PROVIDER_RATES.items():
+            weather_http.set_rate_limit(provider, rate, burst)
+        weather.OWM_API_BASE, weather.NOMINATIM_API_BASE, api_key = saved
+        if api_key is None:
+            del os.environ["OWM_API_KEY"]
+        else:
+            os.environ["OWM_API_KEY"] = api_key
+
+
+def load_fixture(name: str = "onecall.json") -> dict:
+    with open(os.path.join(weather_replay.FIXTURES_DIR, name), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def scaled_payload(hours: int, base: Optional[dict] = None) -> dict:
+    """Returns a copy of the recorded One Call payload with the hourly forecast repeated out to `hours` entries."""
+    base = base or load_fixture()
+    recorded = base["hourly"]
+    hourly = []
+    for i in range(hours):
+        entry = dict(recorded[i % len(recorded)])
+        entry["dt"] = recorded[0]["dt"] + 3600 * i
+        hourly.append(entry)
+    return dict(base, hourly=hourly)
+
+
+def bench_end_to_end(url: str, iterations: int) -> dict:
+    """Times building a WeatherReport, fetch through render, one at a time."""
+    def build_and_render():
+        report = weather.WeatherReport(40.8272, -73.9466, use_cache=False)
+        report.get_current_weather()
+        report.get_hourly_weather()
+        report.get_weekly_weather()
+
+    with pointed_at(url):
+        samples = _measure(build_and_render, iterations)
+    return _summarize("end_to_end", {}, samples)
+
+
+def bench_throughput(url: str, locations: int, workers: int) -> dict:
+    """Times fetching reports for many distinct locations at once through generate_reports."""
+    coords = [(40.0 + i * 0.05, -74.0 - i * 0.05) for i in range(locations)]
+    with pointed_at(url):
+        start = time.perf_counter()
+        count = sum(1 for _ in weather.generate_reports(coords, use_cache=False, max_workers=workers))
+        elapsed = time.perf_counter() - start
+    return _summarize(
+        "throughput", {"locations": locations, "workers": workers}, [elapsed], reports_per_s=count / elapsed
+    )
+
+
+def bench_render(sizes, iterations: int) -> List[dict]:
+    """Times each report renderer on payloads with hourly forecasts of several lengths."""
+    results = []
+    base = load_fixture()
+    location = {"name": "New York"}
+    for hours in sizes:
+        report = weather.WeatherReport.from_data(40.8272, -73.9466, scaled_payload(hours, base), location)
+        renderers = {
+            "render_current": report.get_current_weather,
+            "render_hourly": lambda: report.get_hourly_weather(hours),
+            "render_weekly": report.get_weekly_weather,
+        }
+        for name, fn in renderers.items():
+            results.append(_summarize(name, {"hours": hours}, _measure(fn, iterations)))
+    return results
+
+
+def run(
+    iterations: int = 20,
+    latency: float = 0.02,
+    locations: int = 50,
+    workers: int = 16,
+    render_sizes=DEFAULT_RENDER_SIZES,
+) -> dict:
+    """Runs every benchmark and returns the results with details of the machine they ran on."""
+    results = []
+    with weather_replay.ReplayServer(latency=latency) as server:
+        results.append(bench_end_to_end(server.url, iterations))
+        results.append(bench_throughput(server.url, locations, workers))
+    results.extend(bench_render(render_sizes, iterations))
+    return {
+        "meta": {
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "latency_s": latency,
+        },
+        "results": results,
+    }
+
+
+def _result_key(result: dict) -> tuple:
+    return (result["name"], tuple(sorted(result["params"].items())))
+
+
+def compare(baseline: dict, current: dict) -> List[str]:
+    """Returns a line per benchmark present in both runs, giving the change in median time."""
+    previous = {_result_key(r): r for r in baseline["results"]}
+    lines = []
+    for result in current["results"]:
+        old = previous.get(_result_key(result))
+        if old is None:
+            continue
+        change = (result["p50_s"] - old["p50_s"]) / old["p50_s"] * 100
+        params = ", ".join(f"{k}={v}" for k, v in sorted(result["params"].items()))
+        lines.append(
+            f"{result['name']}({params}): {old['p50_s'] * 1000:.3f}ms -> {result['p50_s'] * 1000:.3f}ms ({change:+.1f}%)"
+        )
+    return lines
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark weather.py against recorded API responses.")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds the replay server waits per response")
+    parser.add_argument("--locations", type=int, default=50, help="locations in the throughput benchmark")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--output", help="write results JSON here instead of stdout")
+    parser.add_argument("--compare", help="a previous results JSON file to compare against")
+    args = parser.parse_args(argv)
+
+    results = run(args.iterations, args.latency, args.locations, args.workers)
+    encoded = json.dumps(results, indent=1)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(encoded + "\n")
+    else:
+        print(encoded)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print("\n".join(compare(baseline, results)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""
+A two tier cache for weather.py: an in-process LRU in front of a persistent sqlite file.
+Entries are keyed by lat/long snapped to a grid, so nearby coordinates share an entry, and concurrent misses
+for the same entry share a single upstream call.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import weather_metrics
+
+# A grid of 0.01 degrees is roughly 1 km of latitude, close enough to count as "the same place".
+DEFAULT_GRID = 0.01
+WEATHER_TTL = 10 * 60
+GEOCODE_TTL = 30 * 24 * 60 * 60
+DEFAULT_MEMORY_ENTRIES = 128
+DEFAULT_DISK_ENTRIES = 4096
+DEFAULT_CACHE_PATH = os.environ.get(
+    "WEATHER_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "weather_cli", "cache.sqlite3"),
+)
+
+
+def snap_coord(lat: float, long: float, grid: float = DEFAULT_GRID) -> tuple:
+    """Returns the supplied lat long coordinates snapped to the nearest point on a grid of the supplied size."""
+    return (round(round(lat / grid) * grid, 6), round(round(long / grid) * grid, 6))
+
+
+class CacheStats:
+    """A class for counting cache outcomes."""
+
+    # A plain class rather than a dataclass, which would pull the slow to import dataclasses module into startup.
+    def __init__(self) -> None:
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __repr__(self) -> str:
+        return (
+            f"CacheStats(memory_hits={self.memory_hits}, disk_hits={self.disk_hits}, "
+            f"misses={self.misses}, evictions={self.evictions})"
+        )
+
+    @property
+    def hits(self) -> int:
+        return self.memory_hits + self.disk_hits
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Makes concurrent calls with the same key share one execution.
+
+    The first caller for a key runs the function; anyone asking for the same key while it is running waits and
+    gets the same result, or the same exception. `calls` counts real executions, `coalesced` the callers that
+    piggybacked on one.
+    """
+
+    def __init__(self, name: str = "flight") -> None:
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+        self._flights: dict = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn: Callable, *args):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+                self.calls += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            weather_metrics.count("coalesced", flight=self.name)
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = fn(*args)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result
+
+
+class CoordCache:
+    """A TTL cache for JSON responses keyed by snapped lat long coordinates.
+
+    Lookups check an in-process LRU first, then a sqlite file shared between runs. Both tiers are
+    bounded, and evict their oldest entries once full. Passing path=None keeps the cache in memory only.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        ttl: float,
+        grid: float = DEFAULT_GRID,
+        max_memory_entries: int = DEFAULT_MEMORY_ENTRIES,
+        max_disk_entries: int = DEFAULT_DISK_ENTRIES,
+        path: Optional[str] = DEFAULT_CACHE_PATH,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.namespace = namespace
+        self.ttl = ttl
+        self.grid = grid
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.path = path
+        self.clock = clock
+        self.stats = CacheStats()
+        self._memory: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional["sqlite3.Connection"] = None
+        self.flights = SingleFlight(namespace)
+
+    def _key(self, lat: float, long: float, variant: str = "") -> str:
+        snapped_lat, snapped_long = snap_coord(lat, long, self.grid)
+        if variant:
+            return f"{snapped_lat},{snapped_long}|{variant}"
+        return f"{snapped_lat},{snapped_long}"
+
+    def _connect(self) -> Optional["sqlite3.Connection"]:
+        """Opens the sqlite file on first use. Returns None if the cache is memory only."""
+        if self.path is None:
+            return None
+        if self._db is None:
+            import sqlite3
+
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "namespace TEXT, key TEXT, stored_at REAL, payload TEXT, "
+                "PRIMARY KEY (namespace, key))"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS entries_age ON entries (namespace, stored_at)"
+            )
+        return self._db
+
+    def _remember(self, key: str, stored_at: float, value) -> None:
+        """Adds an entry to the in-process LRU, evicting the least recently used entry if full."""
+        self._memory[key] = (stored_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self.stats.evictions += 1
+
+    def get(self, lat: float, long: float, variant: str = ""):
+        """Returns the cached value for the supplied coordinates, or None if there isn't a fresh one.
+
+        A variant string keeps different kinds of response for the same place, like partial payloads, apart.
+        """
+        key = self._key(lat, long, variant)
+        now = self.clock()
+        with self._lock:
+            if key in self._memory:
+                stored_at, value = self._memory[key]
+                if now - stored_at < self.ttl:
+                    self._memory.move_to_end(key)
+                    self.stats.memory_hits += 1
+                    weather_metrics.count("cache", outcome="memory_hit", namespace=self.namespace)
+                    return value
+                del self._memory[key]
+            db = self._connect()
+            if db is not None:
+                row = db.execute(
+                    "SELECT stored_at, payload FROM entries WHERE namespace = ? AND key = ?",
+                    (self.namespace, key),
+                ).fetchone()
+                if row is not None and now - row[0] < self.ttl:
+                    value = json.loads(row[1])
+                    self._remember(key, row[0], value)
+                    self.stats.disk_hits += 1
+                    weather_metrics.count("cache", outcome="disk_hit", namespace=self.namespace)
+                    return value
+            self.stats.misses += 1
+            weather_metrics.count("cache", outcome="miss", namespace=self.namespace)
+            return None
+
+    def put(self, lat: float, long: float, value, variant: str = "") -> None:
+        """Stores a value for the supplied coordinates in both tiers."""
+        key = self._key(lat, long, variant)
+        stored_at = self.clock()
+        with self._lock:
+            self._remember(key, stored_at, value)
+            db = self._connect()
+            if db is None:
+                return
+            with db:
+                db.execute(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                    (self.namespace, key, stored_at, json.dumps(value)),
+                )
+                # Drop expired entries, then the oldest ones past the size limit.
+                db.execute(
+                    "DELETE FROM entries WHERE namespace = ? AND stored_at <= ?",
+                    (self.namespace, stored_at - self.ttl),
+                )
+                evicted = db.execute(
+                    "DELETE FROM entries WHERE namespace = ? AND key NOT IN ("
+                    "SELECT key FROM entries WHERE namespace = ? ORDER BY stored_at DESC LIMIT ?)",
+                    (self.namespace, self.namespace, self.max_disk_entries),
+                ).rowcount
+                self.stats.evictions += max(evicted, 0)
+
+    def get_or_fetch(
+        self,
+        lat: float,
+        long: float,
+        fetch: Callable[[float, float], dict],
+        is_valid: Callable[[dict], bool] = bool,
+        variant: str = "",
+    ):
+        """Returns the cached value for the supplied coordinates, calling fetch and caching its result on a miss.
+
+        Concurrent misses for the same snapped coordinates wait on one fetch rather than each making their own.
+        Results that fail is_valid, like API error responses, are returned but not cached.
+        """
+        value = self.get(lat, long, variant)
+        if value is not None:
+            return value
+        key = self._key(lat, long, variant)
+        return self.flights.do(key, self._fetch_and_store, lat, long, fetch, is_valid, variant)
+
+    def _fetch_and_store(self, lat: float, long: float, fetch: Callable, is_valid: Callable, variant: str):
+        value = fetch(lat, long)
+        if is_valid(value):
+            self.put(lat, long, value, variant)
+        return value
+
+    def clear(self) -> None:
+        """Removes every entry in this cache's namespace from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            db = self._connect()
+            if db is not None:
+                with db:
+                    db.execute("DELETE FROM entries WHERE namespace = ?", (self.namespace,))
@@ -0,0 +1,267 @@
+"""
+A resident weather report service.
+Keeps rendered reports for a set of locations in memory, refreshes them in the background before they go stale,
+and serves them over local HTTP or a Unix socket. While a refresh is in flight, the previous reports are served.
+
+    python weather_daemon.py --location nyc=40.8272,-73.9466 --location hudson=42.2520,-73.7916
+    curl localhost:8642/nyc/hourly
+"""
+import argparse
+import json
+import os
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional
+
+import weather
+import weather_http
+
+REPORT_KINDS = ("current", "hourly", "weekly")
+# Seconds between refreshes of a location's reports.
+DEFAULT_REFRESH_AFTER = 8 * 60
+# Past this age, reports are still served, but flagged as stale.
+DEFAULT_MAX_STALE = 30 * 60
+# How soon a location with no usable reports is tried again.
+RETRY_DELAY = 30
+DEFAULT_PORT = 8642
+
+
+class ReportEntry:
+    """The latest rendered reports for one location, and the state of its refresh."""
+
+    def __init__(self, slug: str, lat: float, long: float) -> None:
+        self.slug = slug
+        self.lat = lat
+        self.long = long
+        self.loc_dict: Optional[dict] = None
+        self.reports: Dict[str, str] = {}
+        self.fetched_at: Optional[float] = None
+        self.attempted_at: Optional[float] = None
+        self.refreshing = False
+        self.last_error: Optional[str] = None
+
+
+class ReportStore:
+    """Holds a ReportEntry per location and keeps them fresh from a background thread."""
+
+    def __init__(
+        self,
+        locations: Dict[str, tuple],
+        refresh_after: float = DEFAULT_REFRESH_AFTER,
+        max_stale: float = DEFAULT_MAX_STALE,
+        fetch_weather: Callable[[float, float], dict] = None,
+        fetch_location: Callable[[float, float], dict] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.entries = {slug: ReportEntry(slug, lat, long) for slug, (lat, long) in locations.items()}
+        self.refresh_after = refresh_after
+        self.max_stale = max_stale
+        self.fetch_weather = fetch_weather or (lambda lat, long: weather.get_weather_info(lat, long, use_cache=False))
+        self.fetch_location = fetch_location or weather.get_location_info
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def refresh(self, slug: str) -> None:
+        """Fetches and renders fresh reports for one location, replacing the old ones only on success."""
+        entry = self.entries[slug]
+        try:
+            # Refreshes yield the providers' rate limits to anyone waiting on an interactive lookup.
+            with weather_http.priority(weather_http.PRIORITY_BACKGROUND):
+                loc_dict = entry.loc_dict
+                if loc_dict is None:
+                    loc_dict = self.fetch_location(entry.lat, entry.long)
+                    # Nominatim reports failures as {"error": ...}, which must not be kept in place of a name.
+                    if "name" not in loc_dict:
+                        raise ValueError(f"Location lookup failed: {loc_dict.get('error', loc_dict)}")
+                    # Place names don't change, so the location is only looked up once it has succeeded.
+                    entry.loc_dict = loc_dict
+                weather_dict = self.fetch_weather(entry.lat, entry.long)
+            report = weather.WeatherReport.from_data(entry.lat, entry.long, weather_dict, loc_dict)
+            reports = {
+                "current": report.get_current_weather() + "\n",
+                "hourly": report.get_hourly_weather(),
+                "weekly": report.get_weekly_weather(),
+            }
+        except Exception as e:
+            with self._lock:
+                entry.refreshing = False
+                entry.last_error = f"{type(e).__name__}: {e}"
+            return
+        with self._lock:
+            # A new dict is swapped in whole, so readers never see a mix of old and new reports.
+            entry.reports = reports
+            entry.fetched_at = self.clock()
+            entry.refreshing = False
+            entry.last_error = None
+
+    def _start_refresh(self, entry: ReportEntry) -> bool:
+        """Marks an entry as refreshing and queues its refresh, unless one is already in flight."""
+        with self._lock:
+            if entry.refreshing:
+                return False
+            entry.refreshing = True
+            entry.attempted_at = self.clock()
+        weather_http.get_executor().submit(self.refresh, entry.slug)
+        return True
+
+    def _due_at(self, entry: ReportEntry) -> float:
+        """Returns when an entry should next be refreshed, backing off for RETRY_DELAY after a failed attempt."""
+        due = float("-inf") if entry.fetched_at is None else entry.fetched_at + self.refresh_after
+        if entry.last_error is not None and entry.attempted_at is not None:
+            due = max(due, entry.attempted_at + RETRY_DELAY)
+        return due
+
+    def _is_due(self, entry: ReportEntry, now: float) -> bool:
+        return now >= self._due_at(entry)
+
+    def get(self, slug: str, kind: str) -> tuple:
+        """Returns (report text, age in seconds, stale) for a location, or raises KeyError if there's nothing to serve.
+
+        Reading a report that is due for a refresh starts one, but the current text is returned straight away.
+        After a failed refresh, reads wait out RETRY_DELAY like the background thread does.
+        """
+        entry = self.entries[slug]
+        now = self.clock()
+        if self._is_due(entry, now):
+            self._start_refresh(entry)
+        reports, fetched_at = entry.reports, entry.fetched_at
+        if fetched_at is None:
+            raise KeyError(slug)
+        age = now - fetched_at
+        return reports[kind], age, age > self.max_stale
+
+    def status(self) -> dict:
+        now = self.clock()
+        return {
+            slug: {
+                "age": None if entry.fetched_at is None else round(now - entry.fetched_at, 3),
+                "refreshing": entry.refreshing,
+                "error": entry.last_error,
+            }
+            for slug, entry in self.entries.items()
+        }
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            now = self.clock()
+            next_due = self.refresh_after
+            for entry in self.entries.values():
+                if self._is_due(entry, now):
+                    self._start_refresh(entry)
+                    # Checked again soon, so a failed refresh is retried without hammering the API.
+                    next_due = min(next_due, RETRY_DELAY)
+                else:
+                    next_due = min(next_due, self._due_at(entry) - now)
+            self._wake.wait(max(next_due, 0.01))
+            self._wake.clear()
+
+    def start(self) -> None:
+        """Starts refreshing every location in the background, beginning immediately."""
+        self._thread = threading.Thread(target=self._run, name="weather-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def _make_handler(store: ReportStore):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status: int, body: str, content_type: str = "text/plain; charset=utf-8", headers=()) -> None:
+            encoded = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(encoded)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(encoded)
+
+        def do_GET(self):
+            parts = [p for p in self.path.split("?")[0].split("/") if p]
+            if not parts:
+                self._send(200, "\n".join(store.entries) + "\n")
+                return
+            if parts == ["status"]:
+                self._send(200, json.dumps(store.status()), "application/json")
+                return
+            if len(parts) != 2 or parts[0] not in store.entries or parts[1] not in REPORT_KINDS:
+                self._send(404, f"Try /<location>/<{'|'.join(REPORT_KINDS)}> for one of: {', '.join(store.entries)}\n")
+                return
+            try:
+                text, age, stale = store.get(parts[0], parts[1])
+            except KeyError:
+                self._send(503, "No report yet, try again shortly.\n", headers=[("Retry-After", "5")])
+                return
+            headers = [("Age", str(int(age)))]
+            if stale:
+                headers.append(("Warning", '110 - "Response is Stale"'))
+            self._send(200, text, headers=headers)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) style client address.
+        return request, ("unix", 0)
+
+
+def make_server(store: ReportStore, port: int = DEFAULT_PORT, socket_path: Optional[str] = None):
+    """Returns an HTTP server for the store's reports, on a local port or a Unix socket."""
+    handler = _make_handler(store)
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        return ThreadingUnixHTTPServer(socket_path, handler)
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def _parse_location(value: str) -> tuple:
+    """Parses a "name=lat,long" command line argument."""
+    try:
+        slug, coords = value.split("=")
+        lat, long = (float(c) for c in coords.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected name=lat,long, got {value!r}") from None
+    return slug, (lat, long)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Serve continuously refreshed weather reports.")
+    parser.add_argument("--location", type=_parse_location, action="append", required=True, help="name=lat,long")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--socket", help="serve on this Unix socket instead of a port")
+    parser.add_argument("--refresh-after", type=float, default=DEFAULT_REFRESH_AFTER, help="seconds")
+    parser.add_argument("--max-stale", type=float, default=DEFAULT_MAX_STALE, help="seconds")
+    args = parser.parse_args(argv)
+
+    store = ReportStore(dict(args.location), args.refresh_after, args.max_stale)
+    server = make_server(store, args.port, args.socket)
+    store.start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        store.stop()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
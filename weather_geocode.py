@@ -0,0 +1,176 @@
+"""
+Offline reverse geocoding for weather.py.
+Builds a k-d tree over the cities list that ships with reverse_geocoder, saves it to a flat binary file,
+and memory-maps that file for lookups, so naming a location never needs a network request.
+"""
+import csv
+import importlib.util
+import math
+import mmap
+import os
+import struct
+import threading
+from typing import Iterable, List, Optional
+
+DEFAULT_INDEX_PATH = os.environ.get(
+    "WEATHER_GEOCODE_INDEX",
+    os.path.join(os.path.expanduser("~"), ".cache", "weather_cli", "geocode.idx"),
+)
+
+# File layout: header, then 3 doubles (x, y, z) per point in tree order, then count + 1 uint32 offsets
+# into the label blob, then the labels themselves as tab separated utf-8 "name, admin1, admin2, cc".
+_MAGIC = b"WXGEO001"
+_HEADER = struct.Struct("<8sI")
+_FIELDS = ("name", "admin1", "admin2", "cc")
+
+
+def find_dataset() -> str:
+    """Returns the path of the cities CSV bundled with reverse_geocoder, without importing it."""
+    spec = importlib.util.find_spec("reverse_geocoder")
+    if spec is None or spec.origin is None:
+        raise FileNotFoundError("reverse_geocoder is not installed, so there is no dataset to build an index from.")
+    return os.path.join(os.path.dirname(spec.origin), "rg_cities1000.csv")
+
+
+def _to_xyz(lat: float, long: float) -> tuple:
+    """Converts lat long degrees to a point on the unit sphere, so nearby places are nearby in 3D."""
+    lat_r = math.radians(lat)
+    long_r = math.radians(long)
+    cos_lat = math.cos(lat_r)
+    return (cos_lat * math.cos(long_r), cos_lat * math.sin(long_r), math.sin(lat_r))
+
+
+def _arrange_tree(points: list, lo: int, hi: int, depth: int) -> None:
+    """Sorts points[lo:hi] in place into an implicit k-d tree, where each range's median is its node."""
+    # An explicit stack rather than recursion; the tree is only ~20 levels deep, but this avoids the call overhead.
+    stack = [(lo, hi, depth)]
+    while stack:
+        lo, hi, depth = stack.pop()
+        if hi - lo < 2:
+            continue
+        axis = depth % 3
+        points[lo:hi] = sorted(points[lo:hi], key=lambda p: p[0][axis])
+        mid = (lo + hi) // 2
+        stack.append((lo, mid, depth + 1))
+        stack.append((mid + 1, hi, depth + 1))
+
+
+def build_index(csv_path: Optional[str] = None, index_path: str = DEFAULT_INDEX_PATH) -> str:
+    """Builds a k-d tree index from a reverse_geocoder style CSV and writes it to index_path."""
+    csv_path = csv_path or find_dataset()
+    points = []
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            xyz = _to_xyz(float(row["lat"]), float(row["lon"]))
+            label = "\t".join(row.get(field, "") for field in _FIELDS)
+            points.append((xyz, label))
+    _arrange_tree(points, 0, len(points), 0)
+
+    coords = struct.pack(f"<{3 * len(points)}d", *(c for xyz, _ in points for c in xyz))
+    labels = [label.encode("utf-8") for _, label in points]
+    offsets = [0]
+    for label in labels:
+        offsets.append(offsets[-1] + len(label))
+    os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+    # Unique to this builder, so concurrent builds can't rename each other's half written files into place.
+    tmp_path = f"{index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, len(points)))
+        f.write(coords)
+        f.write(struct.pack(f"<{len(offsets)}I", *offsets))
+        f.write(b"".join(labels))
+    os.replace(tmp_path, index_path)
+    return index_path
+
+
+class OfflineGeocoder:
+    """Answers nearest-place queries from a memory-mapped index file written by build_index."""
+
+    def __init__(self, index_path: str = DEFAULT_INDEX_PATH) -> None:
+        with open(index_path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = _HEADER.unpack_from(self._map, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"{index_path} is not a geocode index.")
+        coords_start = _HEADER.size
+        offsets_start = coords_start + 24 * self.count
+        self._labels_start = offsets_start + 4 * (self.count + 1)
+        view = memoryview(self._map)
+        self._coords = view[coords_start:offsets_start].cast("d")
+        self._offsets = view[offsets_start:self._labels_start].cast("I")
+
+    def _nearest_node(self, lat: float, long: float) -> int:
+        """Returns the tree position of the indexed point closest to the supplied coordinates."""
+        target = _to_xyz(lat, long)
+        coords = self._coords
+        best_node = -1
+        best_dist = math.inf
+        stack = [(0, self.count, 0)]
+        while stack:
+            lo, hi, depth = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            base = 3 * mid
+            dx = coords[base] - target[0]
+            dy = coords[base + 1] - target[1]
+            dz = coords[base + 2] - target[2]
+            dist = dx * dx + dy * dy + dz * dz
+            if dist < best_dist:
+                best_dist = dist
+                best_node = mid
+            axis = depth % 3
+            split = coords[base + axis] - target[axis]
+            near, far = ((lo, mid), (mid + 1, hi)) if split > 0 else ((mid + 1, hi), (lo, mid))
+            # The far side can only hold something closer if the splitting plane is within best_dist.
+            if split * split < best_dist:
+                stack.append((far[0], far[1], depth + 1))
+            stack.append((near[0], near[1], depth + 1))
+        return best_node
+
+    def _label(self, node: int) -> dict:
+        start = self._labels_start + self._offsets[node]
+        end = self._labels_start + self._offsets[node + 1]
+        values = self._map[start:end].decode("utf-8").split("\t")
+        return dict(zip(_FIELDS, values))
+
+    def nearest(self, lat: float, long: float) -> dict:
+        """Returns a dict describing the indexed place closest to the supplied coordinates."""
+        if self.count == 0:
+            raise LookupError("The geocode index is empty.")
+        return self._label(self._nearest_node(lat, long))
+
+    def search(self, coords: Iterable[tuple]) -> List[dict]:
+        """Returns the closest place for each of the supplied (lat, long) pairs, in order."""
+        coords = list(coords)
+        if self.count == 0 and coords:
+            raise LookupError("The geocode index is empty.")
+        # Batches tend to repeat coordinates, so each distinct point is only searched once.
+        nodes = {}
+        for coord in coords:
+            if coord not in nodes:
+                nodes[coord] = self._nearest_node(*coord)
+        labels = {node: self._label(node) for node in set(nodes.values())}
+        return [labels[nodes[coord]] for coord in coords]
+
+
+_default_geocoder: Optional[OfflineGeocoder] = None
+# Held while the default geocoder is set up, so concurrent first lookups build the index once between them.
+_default_lock = threading.Lock()
+
+
+def get_default_geocoder() -> OfflineGeocoder:
+    """Returns a geocoder over DEFAULT_INDEX_PATH, building the index first if it doesn't exist yet."""
+    global _default_geocoder
+    if _default_geocoder is None:
+        with _default_lock:
+            if _default_geocoder is None:
+                if not os.path.exists(DEFAULT_INDEX_PATH):
+                    build_index(index_path=DEFAULT_INDEX_PATH)
+                _default_geocoder = OfflineGeocoder(DEFAULT_INDEX_PATH)
+    return _default_geocoder
+
+
+def offline_reverse_lookup(lat: float, long: float) -> dict:
+    """Reverse-geocodes the supplied coordinates from the local index."""
+    return get_default_geocoder().nearest(lat, long)
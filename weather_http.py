@@ -0,0 +1,276 @@
+"""
+The HTTP layer for weather.py. Requests share one pooled session, so repeat calls to the same host reuse
+a kept-alive connection instead of paying for a new TLS handshake.
+
+Each provider's requests are paced by a token bucket, which also caps how many are in flight at once, and serves
+waiting interactive lookups before background refreshes. Rate limited and failed responses are retried with
+jittered exponential backoff, within a deadline.
+
+requests is only imported when the first session is created, so importing this module stays cheap.
+"""
+import contextlib
+import heapq
+import itertools
+import json
+import random
+import threading
+import time
+from typing import Callable, Optional
+
+import weather_metrics
+
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 16
+USER_AGENT = "weather-report-cli"
+
+# The most requests allowed in flight at once to each upstream provider. Nominatim's usage policy
+# forbids parallel requests from one client, so it gets a single slot.
+PROVIDER_LIMITS = {
+    "owm": 8,
+    "nominatim": 1,
+}
+
+# Sustained requests per second and burst size allowed to each provider. Nominatim's usage policy asks for
+# no more than one request a second; OWM's free tier allows 60 a minute.
+PROVIDER_RATES = {
+    "owm": (1.0, 60),
+    "nominatim": (1.0, 1),
+}
+
+# Lower numbers are served first when requests are queued for a provider's tokens and slots.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+# Seconds allowed for one request and for a whole call to get_json, retries included.
+REQUEST_TIMEOUT = 10.0
+DEFAULT_DEADLINE = 30.0
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8.0
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+
+class UpstreamError(Exception):
+    """Raised when a provider keeps failing after every retry."""
+
+
+class DeadlineExceeded(UpstreamError):
+    """Raised when a request can't be answered before its deadline."""
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions a second on average, bursts of up to `capacity`, and at most `concurrency` of them
+    to be held at once. A rate of None lifts the rate limit and leaves only the cap on holders.
+
+    Callers that have to wait are queued by priority, then by arrival, and only the head of the queue may take a token
+    and a slot. Slots are handed back with release().
+    """
+
+    def __init__(
+        self,
+        rate: Optional[float],
+        capacity: float = 1,
+        clock: Callable[[], float] = time.monotonic,
+        concurrency: Optional[int] = None,
+    ) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.concurrency = concurrency
+        self._tokens = float(capacity)
+        self._updated = clock()
+        self._held = 0
+        self._cond = threading.Condition()
+        self._waiters: list = []
+        self._order = itertools.count()
+
+    def _refill(self, now: float) -> None:
+        if self.rate is not None:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, priority: int = PRIORITY_INTERACTIVE, deadline: Optional[float] = None) -> bool:
+        """Takes a token and a slot, waiting for them if need be. Returns False if they couldn't be had before the
+        deadline."""
+        with self._cond:
+            ticket = (priority, next(self._order))
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    now = self.clock()
+                    self._refill(now)
+                    at_head = self._waiters[0] == ticket
+                    has_token = self.rate is None or self._tokens >= 1
+                    has_slot = self.concurrency is None or self._held < self.concurrency
+                    if at_head and has_token and has_slot:
+                        if self.rate is not None:
+                            self._tokens -= 1
+                        self._held += 1
+                        return True
+                    # The head waits for its next token to arrive, or for release() to free a slot.
+                    wait = (1 - self._tokens) / self.rate if at_head and has_slot else None
+                    if deadline is not None:
+                        if now >= deadline:
+                            return False
+                        wait = deadline - now if wait is None else min(wait, deadline - now)
+                    self._cond.wait(wait)
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                # The next waiter may now be at the head of the queue.
+                self._cond.notify_all()
+
+    def release(self) -> None:
+        """Hands back the slot taken by acquire()."""
+        with self._cond:
+            self._held -= 1
+            self._cond.notify_all()
+
+
+_session: Optional["requests.Session"] = None
+_executor: Optional["ThreadPoolExecutor"] = None
+_lock = threading.Lock()
+_loads = None
+_buckets = {
+    name: TokenBucket(*PROVIDER_RATES.get(name, (None, 1)), concurrency=limit)
+    for name, limit in PROVIDER_LIMITS.items()
+}
+_local = threading.local()
+
+
+def set_rate_limit(provider: str, rate: Optional[float], burst: float = 1) -> None:
+    """Replaces a provider's rate limit, or lifts it if rate is None, e.g. for a local test server. Its cap on
+    requests in flight stays either way."""
+    _buckets[provider] = TokenBucket(rate, burst, concurrency=PROVIDER_LIMITS.get(provider))
+
+
+def current_priority() -> int:
+    return getattr(_local, "priority", PRIORITY_INTERACTIVE)
+
+
+@contextlib.contextmanager
+def priority(level: int):
+    """Makes requests from this thread wait for tokens and slots at the supplied priority until the block exits."""
+    previous = current_priority()
+    _local.priority = level
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+def get_session() -> "requests.Session":
+    """Returns the shared session, creating it on first use."""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                # Nominatim's usage policy asks for an identifying user agent.
+                session.headers["User-Agent"] = USER_AGENT
+                _session = session
+    return _session
+
+
+def get_executor() -> "ThreadPoolExecutor":
+    """Returns the shared thread pool used to run lookups concurrently, creating it on first use."""
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+
+                _executor = ThreadPoolExecutor(max_workers=POOL_MAXSIZE, thread_name_prefix="weather")
+    return _executor
+
+
+def _get_loads():
+    """Returns the JSON decoder to use: orjson's if it is installed, as it is several times faster, else json's."""
+    global _loads
+    if _loads is None:
+        try:
+            import orjson
+
+            _loads = orjson.loads
+        except ImportError:
+            # json.loads detects the encoding of raw bytes itself, which skips building an intermediate str.
+            _loads = json.loads
+    return _loads
+
+
+def _backoff(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Returns how long to sleep before retry number `attempt`, honouring a Retry-After header given in seconds."""
+    if retry_after is not None:
+        try:
+            return min(float(retry_after), BACKOFF_CAP)
+        except ValueError:
+            pass
+    # Full jitter, so clients that failed together don't retry together.
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def _send(url: str, params: Optional[dict], label: str, expires: float) -> tuple:
+    """Makes one attempt at a request, and returns (response, failure, retry_after). failure describes a failure worth
+    retrying, or is None."""
+    import requests
+
+    # Worked out only now, as waiting for a slot may have used up most of the deadline.
+    remaining = expires - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded(f"{label}: deadline passed before the request was sent")
+    try:
+        with weather_metrics.timer("request", provider=label):
+            response = get_session().get(url, params=params, timeout=min(REQUEST_TIMEOUT, remaining))
+    except (requests.ConnectionError, requests.Timeout) as e:
+        return None, f"{type(e).__name__}: {e}", None
+    if response.status_code in RETRY_STATUSES:
+        return response, f"HTTP {response.status_code}", response.headers.get("Retry-After")
+    return response, None, None
+
+
+def get_json(
+    url: str,
+    params: Optional[dict] = None,
+    provider: Optional[str] = None,
+    deadline: float = DEFAULT_DEADLINE,
+):
+    """Requests the supplied URL on the shared session and returns the decoded JSON body.
+
+    If a provider is named, waits for a token from its rate limit and for one of its slots, so no more than
+    PROVIDER_LIMITS[provider] requests to it are in flight at once. Both are waited for in priority order.
+    Connection errors and RETRY_STATUSES responses are retried up to MAX_RETRIES times. If they
+    keep failing, raises UpstreamError; if `deadline` seconds pass first, DeadlineExceeded.
+    """
+    label = provider or "other"
+    expires = time.monotonic() + deadline
+    attempt = 0
+    while True:
+        bucket = _buckets.get(provider)
+        if bucket is not None:
+            with weather_metrics.timer("rate_limit_wait", provider=label):
+                if not bucket.acquire(current_priority(), expires):
+                    raise DeadlineExceeded(f"{label}: no request slot before the deadline")
+        try:
+            response, failure, retry_after = _send(url, params, label, expires)
+        finally:
+            if bucket is not None:
+                bucket.release()
+        if failure is None:
+            break
+        if attempt >= MAX_RETRIES:
+            raise UpstreamError(f"{label}: {failure}, after {attempt + 1} attempts")
+        delay = _backoff(attempt, retry_after)
+        if time.monotonic() + delay >= expires:
+            raise DeadlineExceeded(f"{label}: {failure}, and no time left to retry")
+        weather_metrics.count("retry", provider=label)
+        time.sleep(delay)
+        attempt += 1
+    weather_metrics.count("response", len(response.content), kind="bytes", provider=label)
+    with weather_metrics.timer("decode", provider=label):
+        return _get_loads()(response.content)
@@ -0,0 +1,187 @@
+"""
+Opt-in timing and metrics for weather.py.
+Code marks its phases with timer() and count(); nothing is recorded until a sink is added with add_sink().
+With no sinks, timer() hands back a shared do-nothing context manager, so the instrumentation costs next to nothing.
+"""
+import json
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+# Upper bounds in seconds of the histogram buckets timers are sorted into.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_sinks: list = []
+_sinks_lock = threading.Lock()
+
+
+def add_sink(sink) -> None:
+    """Starts sending metrics to the supplied sink. Sinks need a record(kind, name, value, labels) method."""
+    global _sinks
+    with _sinks_lock:
+        # Replaced rather than appended to, so emit() can iterate without holding the lock.
+        _sinks = _sinks + [sink]
+
+
+def remove_sink(sink) -> None:
+    global _sinks
+    with _sinks_lock:
+        _sinks = [s for s in _sinks if s is not sink]
+
+
+def clear_sinks() -> None:
+    global _sinks
+    with _sinks_lock:
+        _sinks = []
+
+
+def enabled() -> bool:
+    return bool(_sinks)
+
+
+def emit(kind: str, name: str, value: float, labels: dict) -> None:
+    """Sends one measurement to every sink. kind is "timer" (seconds), "bytes", or "count"."""
+    for sink in _sinks:
+        sink.record(kind, name, value, labels)
+
+
+class _Timer:
+    __slots__ = ("name", "labels", "start")
+
+    def __init__(self, name: str, labels: dict) -> None:
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        emit("timer", self.name, time.perf_counter() - self.start, self.labels)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NullTimer":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(name: str, **labels):
+    """Returns a context manager that records how long its block takes as the named phase."""
+    if not _sinks:
+        return _NULL_TIMER
+    return _Timer(name, labels)
+
+
+def count(name: str, value: float = 1, kind: str = "count", **labels) -> None:
+    """Records an occurrence of the named event, or a number of bytes if kind is "bytes"."""
+    if _sinks:
+        emit(kind, name, value, labels)
+
+
+class LogSink:
+    """Writes each measurement as a single line of JSON to a logger, at INFO level unless told otherwise."""
+
+    def __init__(self, logger: Optional["logging.Logger"] = None, level: Optional[int] = None) -> None:
+        # logging is imported here rather than at the top, as it is slow to import and most runs have no sinks.
+        import logging
+
+        self.logger = logger or logging.getLogger("weather.metrics")
+        self.level = logging.INFO if level is None else level
+
+    def record(self, kind: str, name: str, value: float, labels: dict) -> None:
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, json.dumps({"kind": kind, "name": name, "value": value, **labels}))
+
+
+class HistogramSink:
+    """Keeps measurements in memory: timers in bucketed histograms, bytes and counts as running totals."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        self.histograms: Dict[tuple, dict] = {}
+        self.totals: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(kind: str, name: str, labels: dict) -> tuple:
+        return (kind, name, tuple(sorted(labels.items())))
+
+    def record(self, kind: str, name: str, value: float, labels: dict) -> None:
+        key = self._key(kind, name, labels)
+        with self._lock:
+            if kind != "timer":
+                self.totals[key] = self.totals.get(key, 0) + value
+                return
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+                self.histograms[key] = histogram
+            histogram["counts"][bisect_left(self.buckets, value)] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def summary(self, name: str, **labels) -> Optional[dict]:
+        """Returns the count, sum and mean of the named timer, or None if it hasn't been recorded."""
+        histogram = self.histograms.get(self._key("timer", name, labels))
+        if histogram is None:
+            return None
+        return {"count": histogram["count"], "sum": histogram["sum"], "mean": histogram["sum"] / histogram["count"]}
+
+    def total(self, name: str, kind: str = "count", **labels) -> float:
+        """Returns the running total of the named count or byte measurement."""
+        return self.totals.get(self._key(kind, name, labels), 0)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.histograms.clear()
+            self.totals.clear()
+
+
+def _format_labels(labels: tuple, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class PrometheusSink(HistogramSink):
+    """A HistogramSink that can dump what it holds in the Prometheus text exposition format."""
+
+    PREFIX = "weather_"
+
+    def render(self) -> str:
+        """Returns every recorded measurement as Prometheus formatted text."""
+        lines: List[str] = []
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            totals = sorted(self.totals.items())
+        declared = set()
+        for (_, name, labels), histogram in histograms:
+            metric = f"{self.PREFIX}{name}_seconds"
+            if metric not in declared:
+                lines.append(f"# TYPE {metric} histogram")
+                declared.add(metric)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), histogram["counts"]):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{metric}_bucket{_format_labels(labels, (('le', le),))} {cumulative}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {histogram['sum']!r}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {histogram['count']}")
+        for (kind, name, labels), total in totals:
+            metric = f"{self.PREFIX}{name}_{'bytes_total' if kind == 'bytes' else 'total'}"
+            if metric not in declared:
+                lines.append(f"# TYPE {metric} counter")
+                declared.add(metric)
+            lines.append(f"{metric}{_format_labels(labels)} {total}")
+        return "\n".join(lines) + "\n"
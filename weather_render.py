@@ -0,0 +1,271 @@
+"""
+Table rendering for weather.py's hourly and weekly reports.
+Repeat markers, continuity markers and column widths are all worked out in a single pass over the rows,
+and the finished table is written to any file-like sink. LiveTable keeps a table on a terminal instead,
+and redraws only the cells that change from one update to the next.
+"""
+import io
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple, Optional, TextIO
+
+REPEAT_CHAR = "↓"
+CONTINUITY_CHAR = "╎"
+CLEAR_LINE = "\x1b[2K"
+
+
+class TableLayout(NamedTuple):
+    """A class describing the columns of a report table.
+
+    Each column is a (name, separator) pair, where the separator is written after the column's cell. Columns
+    named in `repeat_columns` show a repeat marker instead of a value that hasn't changed since it was last shown.
+    """
+
+    columns: tuple
+    prefix: str = ""
+    repeat_columns: frozenset = frozenset()
+
+    @property
+    def names(self) -> tuple:
+        return tuple(name for name, _ in self.columns)
+
+
+HOURLY_LAYOUT = TableLayout(
+    columns=(
+        ("dt", " | "),
+        ("desc", " | "),
+        ("temp", "| "),
+        ("humidity", " | "),
+        ("wind", " | "),
+        ("pop", ""),
+    ),
+    prefix="  ",
+    repeat_columns=frozenset({"dt", "desc", "wind", "pop"}),
+)
+
+WEEKLY_LAYOUT = TableLayout(
+    columns=(
+        ("long_date", ": "),
+        ("desc", " | "),
+        ("temp", " | "),
+        ("humidity", " | "),
+        ("wind", " | "),
+        ("pop", ""),
+    ),
+)
+
+
+class _MarkedRows:
+    """Replaces repeated values with markers and tracks column widths as rows go by.
+
+    A repeat marker only becomes a continuity marker once the row after it turns out to repeat too, so each row
+    is final as soon as the next one has been added.
+    """
+
+    def __init__(self, layout: TableLayout) -> None:
+        self.repeat_indices = [i for i, name in enumerate(layout.names) if name in layout.repeat_columns]
+        self.widths = [0] * len(layout.columns)
+        self.last_shown: Optional[list] = None
+        self.previous: Optional[list] = None
+
+    def add(self, row: Iterable[str]) -> list:
+        """Marks a row, updating the previous row's markers, and returns the marked row."""
+        cells = list(row)
+        if self.last_shown is None:
+            self.last_shown = list(cells)
+        else:
+            for i in self.repeat_indices:
+                if cells[i] == self.last_shown[i]:
+                    cells[i] = REPEAT_CHAR
+                    if self.previous[i] == REPEAT_CHAR:
+                        self.previous[i] = CONTINUITY_CHAR
+                else:
+                    self.last_shown[i] = cells[i]
+        widths = self.widths
+        for i, cell in enumerate(cells):
+            if len(cell) > widths[i]:
+                widths[i] = len(cell)
+        self.previous = cells
+        return cells
+
+
+def _format_row(layout: TableLayout, cells: list, widths: list) -> str:
+    parts = [layout.prefix]
+    for (_, separator), cell, width in zip(layout.columns, cells, widths):
+        parts.append(cell.center(width))
+        parts.append(separator)
+    return "".join(parts)
+
+
+def _write_row(sink: TextIO, layout: TableLayout, cells: list, widths: list) -> None:
+    sink.write(_format_row(layout, cells, widths) + "\n")
+
+
+def write_table(
+    layout: TableLayout, rows: Iterable[tuple], sink: TextIO, widths: Optional[List[int]] = None
+) -> List[int]:
+    """Writes rows of cell strings, ordered as in the layout, to the supplied sink as an aligned table.
+
+    Without `widths`, rows are buffered until the widest cell of each column is known. With fixed widths, each
+    row is written as soon as the row after it arrives, so arbitrarily long tables stream in constant memory.
+    Returns the column widths used.
+    """
+    marked = _MarkedRows(layout)
+    if widths is not None:
+        pending = None
+        for row in rows:
+            cells = marked.add(row)
+            if pending is not None:
+                _write_row(sink, layout, pending, widths)
+            pending = cells
+        if pending is not None:
+            _write_row(sink, layout, pending, widths)
+        return widths
+    buffered = [marked.add(row) for row in rows]
+    for cells in buffered:
+        _write_row(sink, layout, cells, marked.widths)
+    return marked.widths
+
+
+def render_table(layout: TableLayout, rows: Iterable[tuple], header: str = "") -> str:
+    """Returns rows of cell strings rendered as an aligned table, following an optional header."""
+    buffer = io.StringIO()
+    buffer.write(header)
+    write_table(layout, rows, buffer)
+    return buffer.getvalue()
+
+
+def cursor_to(line: int, column: int = 1) -> str:
+    return f"\x1b[{line};{column}H"
+
+
+class LiveTable:
+    """A table drawn on an ANSI terminal, with its first row on screen line `top`, that is updated in place.
+
+    A cell's marker depends only on the rows either side of it, so when some rows change only their neighbours'
+    markers are worked out again, and only the cells whose text changed are rewritten. Column widths are tracked
+    by counting cell lengths, and a change of width is the one thing that redraws every row.
+    """
+
+    def __init__(self, layout: TableLayout, top: int = 1) -> None:
+        self.layout = layout
+        self.top = top
+        self.repeat = [name in layout.repeat_columns for name in layout.names]
+        self.rows: List[tuple] = []
+        self.cells: List[list] = []
+        self.widths = [0] * len(layout.columns)
+        self._offsets: List[int] = []
+        self._lengths = [Counter() for _ in layout.columns]
+
+    def _mark(self, r: int, c: int) -> str:
+        """Returns the text of one cell, as _MarkedRows would have marked it."""
+        rows = self.rows
+        value = rows[r][c]
+        if not self.repeat[c] or r == 0 or rows[r - 1][c] != value:
+            return value
+        if r + 1 < len(rows) and rows[r + 1][c] == value:
+            return CONTINUITY_CHAR
+        return REPEAT_CHAR
+
+    def _count(self, cells: list, step: int) -> None:
+        for lengths, cell in zip(self._lengths, cells):
+            n = len(cell)
+            lengths[n] += step
+            if not lengths[n]:
+                del lengths[n]
+
+    def _set_widths(self) -> bool:
+        """Updates the column widths from the cell length counts, and returns whether any changed."""
+        widths = [max(lengths, default=0) for lengths in self._lengths]
+        if widths == self.widths and self._offsets:
+            return False
+        self.widths = widths
+        offset = len(self.layout.prefix) + 1
+        self._offsets = []
+        for (_, separator), width in zip(self.layout.columns, widths):
+            self._offsets.append(offset)
+            offset += width + len(separator)
+        return True
+
+    def _redraw(self, sink: TextIO, clear_to: int = 0) -> int:
+        """Rewrites every row, then blanks any lines below the table up to row index clear_to."""
+        parts = []
+        for r, cells in enumerate(self.cells):
+            parts.append(cursor_to(self.top + r) + CLEAR_LINE + _format_row(self.layout, cells, self.widths))
+        for r in range(len(self.cells), clear_to):
+            parts.append(cursor_to(self.top + r) + CLEAR_LINE)
+        sink.write("".join(parts))
+        return len(self.cells) * len(self.widths)
+
+    def draw(self, rows: Iterable[tuple], sink: TextIO) -> int:
+        """Draws the table from scratch, and returns the number of cells written."""
+        previous = len(self.rows)
+        self.rows = [tuple(row) for row in rows]
+        self.cells = []
+        self._lengths = [Counter() for _ in self.layout.columns]
+        for r in range(len(self.rows)):
+            cells = [self._mark(r, c) for c in range(len(self.widths))]
+            self._count(cells, 1)
+            self.cells.append(cells)
+        self._set_widths()
+        return self._redraw(sink, previous)
+
+    def update(self, changes: Dict[int, tuple], length: int, sink: TextIO, shift: int = 0) -> int:
+        """Applies changed rows to the table on screen, and returns the number of cells written.
+
+        `changes` maps row indices to their new cells, after the first `shift` rows have been scrolled off the
+        top and the table cut or grown to `length` rows. Rows that are new to the screen must be in `changes`.
+        """
+        parts = []
+        previous = len(self.rows)
+        if shift:
+            if previous:
+                bottom = self.top + previous - 1
+                # Scrolls just the table's lines, so the rows that stay are moved by the terminal, not rewritten.
+                parts.append(f"\x1b[{self.top};{bottom}r\x1b[{shift}S\x1b[r")
+            for cells in self.cells[:shift]:
+                self._count(cells, -1)
+            del self.rows[:shift]
+            del self.cells[:shift]
+        for cells in self.cells[length:]:
+            self._count(cells, -1)
+        del self.rows[length:]
+        del self.cells[length:]
+        kept = len(self.rows)
+        self.rows.extend(None for _ in range(length - kept))
+        self.cells.extend(None for _ in range(length - kept))
+        for r, row in changes.items():
+            self.rows[r] = tuple(row)
+
+        affected = {n for r in changes for n in (r - 1, r, r + 1) if 0 <= n < length}
+        if shift and length:
+            affected.add(0)
+        if kept < previous and kept:
+            affected.add(kept - 1)
+        dirty = []
+        new_rows = []
+        for r in sorted(affected):
+            cells = [self._mark(r, c) for c in range(len(self.widths))]
+            old = self.cells[r]
+            if old == cells:
+                continue
+            self.cells[r] = cells
+            self._count(cells, 1)
+            if old is None:
+                new_rows.append(r)
+            else:
+                self._count(old, -1)
+                dirty.extend((r, c) for c, cell in enumerate(cells) if old[c] != cell)
+
+        if self._set_widths():
+            sink.write("".join(parts))
+            return self._redraw(sink, previous)
+        for r, c in dirty:
+            parts.append(cursor_to(self.top + r, self._offsets[c]))
+            parts.append(self.cells[r][c].center(self.widths[c]))
+        for r in new_rows:
+            # Rows new to the screen land on blank lines, so they are written whole, separators and all.
+            parts.append(cursor_to(self.top + r) + CLEAR_LINE + _format_row(self.layout, self.cells[r], self.widths))
+        for r in range(length, previous):
+            parts.append(cursor_to(self.top + r) + CLEAR_LINE)
+        sink.write("".join(parts))
+        return len(dirty) + len(new_rows) * len(self.widths)
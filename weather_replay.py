@@ -0,0 +1,158 @@
+"""
+A local stand-in for the OpenWeatherMap One Call and Nominatim reverse APIs.
+Replays the recorded responses in fixtures/, with optional latency and injected errors, so weather.py can be
+tested and benchmarked without the network or an API key.
+"""
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+ROUTES = {
+    "/data/2.5/onecall": "onecall.json",
+    "/reverse": "reverse.json",
+}
+
+
+class ReplayServer:
+    """Serves recorded API responses on a local port from a background thread.
+
+    Every response is delayed by `latency` seconds, plus up to `jitter` more. A fraction `error_rate` of requests
+    get an `error_status` response instead. Use it as a context manager, or call start() and stop().
+    """
+
+    def __init__(
+        self,
+        fixtures_dir: str = FIXTURES_DIR,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        seed: Optional[int] = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.request_counts = {path: 0 for path in ROUTES}
+        self.error_count = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._responses = {}
+        for path, file_name in ROUTES.items():
+            with open(os.path.join(fixtures_dir, file_name), "rb") as f:
+                self._responses[path] = f.read()
+        # One Call bodies with sections left out, by the exclude parameter that asked for them.
+        self._excluded_bodies = {}
+        self.excludes_seen = []
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                status, body = server._respond(parsed.path, parse_qs(parsed.query))
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _respond(self, path: str, query: dict) -> tuple:
+        """Returns the (status, body) to send for a request, after sleeping for the configured latency."""
+        with self._lock:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            fail = self._random.random() < self.error_rate
+            if path in self.request_counts:
+                self.request_counts[path] += 1
+            if fail:
+                self.error_count += 1
+        if delay:
+            time.sleep(delay)
+        if path not in self._responses:
+            return 404, json.dumps({"cod": "404", "message": "Not found"}).encode()
+        if fail:
+            return self.error_status, json.dumps({"cod": self.error_status, "message": "Injected error"}).encode()
+        exclude = query.get("exclude", [""])[0]
+        if path == "/data/2.5/onecall" and exclude:
+            return 200, self._excluded_body(exclude)
+        return 200, self._responses[path]
+
+    def _excluded_body(self, exclude: str) -> bytes:
+        """Returns the One Call response without the comma separated sections in exclude, like the real API."""
+        with self._lock:
+            self.excludes_seen.append(exclude)
+            body = self._excluded_bodies.get(exclude)
+            if body is None:
+                payload = json.loads(self._responses["/data/2.5/onecall"])
+                for section in exclude.split(","):
+                    payload.pop(section, None)
+                body = json.dumps(payload).encode()
+                self._excluded_bodies[exclude] = body
+        return body
+
+    def start(self) -> str:
+        """Starts serving in a background thread and returns the server's base URL."""
+        self._thread = threading.Thread(target=self._server.serve_forever, name="weather-replay", daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "ReplayServer":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Replay recorded OWM and Nominatim responses on a local port.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many more seconds, at random")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=503)
+    args = parser.parse_args()
+    replay = ReplayServer(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        port=args.port,
+    )
+    print(f"Replaying fixtures on {replay.url}")
+    print(f"Point weather.py at it with OWM_API_BASE={replay.url} NOMINATIM_API_BASE={replay.url}")
+    try:
+        replay._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,78 @@
+"""
+Timestamp formatting for weather.py's reports, in the forecast location's own time zone.
+Labels are worked out arithmetically from the epoch, and each minute of the day and each calendar day is only
+formatted once, so formatting thousands of rows costs a dict lookup apiece.
+"""
+import datetime
+from typing import Iterable, List
+
+SECONDS_PER_DAY = 86400
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+# Day labels are shared by every formatter; past this many distinct days the memo starts over.
+MAX_MEMOIZED_DAYS = 4096
+
+_time_labels: List[str] = []
+_day_labels: dict = {}
+
+
+def make_ordinal(n: int) -> str:
+    """Returns the supplied int as an ordinal number string."""
+    if not 10 < n % 100 < 14 and abs(n) % 10 in (1, 2, 3):
+        return f"{n}{('st', 'nd', 'rd')[abs(n) % 10 - 1]}"
+    return f"{n}th"
+
+
+def _get_time_labels() -> List[str]:
+    """Returns a 12 hr H:MM label for every minute of the day, building them on first use."""
+    global _time_labels
+    if not _time_labels:
+        _time_labels = [f"{minute // 60 % 12 or 12}:{minute % 60:02d}" for minute in range(24 * 60)]
+    return _time_labels
+
+
+def _day_label(day: int) -> tuple:
+    """Returns the (long, short) date labels for a day number counted from the epoch."""
+    labels = _day_labels.get(day)
+    if labels is None:
+        date = datetime.date.fromordinal(_EPOCH_ORDINAL + day)
+        labels = (
+            date.strftime(f"%A, %B {make_ordinal(date.day)}"),
+            date.strftime(f"{date.month}/{date.day}/%y"),
+        )
+        if len(_day_labels) >= MAX_MEMOIZED_DAYS:
+            _day_labels.clear()
+        _day_labels[day] = labels
+    return labels
+
+
+class TimestampFormatter:
+    """Formats epoch timestamps as times and dates at a fixed offset in seconds from UTC, as One Call's
+    `timezone_offset` gives it."""
+
+    __slots__ = ("offset",)
+
+    def __init__(self, offset: int = 0) -> None:
+        self.offset = offset
+
+    def time(self, timestamp: int) -> str:
+        """Returns a 12 hr H:MM formatted time."""
+        return _get_time_labels()[(timestamp + self.offset) % SECONDS_PER_DAY // 60]
+
+    def long_date(self, timestamp: int) -> str:
+        """Returns a long date string, e.g. "Monday, October 18th"."""
+        return _day_label((timestamp + self.offset) // SECONDS_PER_DAY)[0]
+
+    def short_date(self, timestamp: int) -> str:
+        """Returns a short date string, e.g. "10/18/21"."""
+        return _day_label((timestamp + self.offset) // SECONDS_PER_DAY)[1]
+
+    def times(self, timestamps: Iterable[int]) -> List[str]:
+        """Returns the time of each timestamp in a column."""
+        labels = _get_time_labels()
+        offset = self.offset
+        return [labels[(t + offset) % SECONDS_PER_DAY // 60] for t in timestamps]
+
+    def long_dates(self, timestamps: Iterable[int]) -> List[str]:
+        """Returns the long date of each timestamp in a column."""
+        offset = self.offset
+        return [_day_label((t + offset) // SECONDS_PER_DAY)[0] for t in timestamps]
@@ -0,0 +1,136 @@
+"""
+Watch mode for weather.py.
+Polls the forecast on an interval and keeps the current conditions and hourly report up to date in the terminal,
+rewriting only the lines and cells that changed since the last poll.
+
+    python weather_watch.py 40.8272 -73.9466 --interval 600
+"""
+import argparse
+import sys
+import time
+from bisect import bisect_left
+from typing import Optional, TextIO
+
+import weather
+import weather_http
+import weather_metrics
+import weather_render
+
+CLEAR_SCREEN = "\x1b[H\x1b[2J"
+HIDE_CURSOR = "\x1b[?25l"
+SHOW_CURSOR = "\x1b[?25h"
+# Polling faster than the weather cache's TTL would only ever redraw the same forecast.
+DEFAULT_INTERVAL = weather.WEATHER_TTL
+WATCH_REPORTS = ("current", "hourly")
+# The current conditions go on line 1, the hourly header on line 2, and the table starts on line 3.
+CURRENT_LINE = 1
+HEADER_LINE = 2
+TABLE_TOP = 3
+
+
+class HourlyWatch:
+    """Keeps a report's current conditions and hourly table on a terminal, updating them from successive reports."""
+
+    def __init__(self, sink: TextIO, hours: int = 24) -> None:
+        self.sink = sink
+        self.hours = hours
+        self.table = weather_render.LiveTable(weather_render.HOURLY_LAYOUT, top=TABLE_TOP)
+        self.entries: Optional[list] = None
+        self.raw_current: Optional[dict] = None
+        self.lines = {}
+
+    def _set_line(self, line: int, text: str) -> int:
+        """Rewrites one line of the screen if its text has changed, and returns the number of lines written."""
+        if self.lines.get(line) == text:
+            return 0
+        self.lines[line] = text
+        self.sink.write(weather_render.cursor_to(line) + weather_render.CLEAR_LINE + text)
+        return 1
+
+    def _find_shift(self, entries: list) -> Optional[int]:
+        """Returns how many hours the forecast has moved on since the last one, or None if it can't be lined up."""
+        if not self.entries or not entries:
+            return None
+        dts = [entry[0] for entry in self.entries]
+        shift = bisect_left(dts, entries[0][0])
+        if shift == len(dts) or dts[shift] != entries[0][0]:
+            return None
+        return shift
+
+    def show(self, report: weather.WeatherReport) -> int:
+        """Brings the screen up to date with a report, and returns the number of table cells written.
+
+        Raises ValueError, before anything is written, if the report is missing its current conditions or hourly
+        forecast, as it is when the provider answers with an error payload.
+        """
+        if report.raw_current is None or "hourly" not in report.sections:
+            raise ValueError("This report was built without current conditions or the hourly forecast.")
+        columns = report.hourly.head(self.hours)
+        entries = [columns.entry(i) for i in range(len(columns))]
+        shift = self._find_shift(entries)
+        if shift is None:
+            self.sink.write(CLEAR_SCREEN)
+            self.lines = {}
+            self.raw_current = None
+            self.table = weather_render.LiveTable(weather_render.HOURLY_LAYOUT, top=TABLE_TOP)
+            written = self.table.draw(report._generate_hourly_rows(columns), self.sink)
+        else:
+            previous = self.entries[shift:]
+            changed = [i for i, entry in enumerate(entries) if i >= len(previous) or entry != previous[i]]
+            rows = report._generate_hourly_rows(columns.take(changed))
+            written = self.table.update(dict(zip(changed, rows)), len(entries), self.sink, shift)
+        self.entries = entries
+        if report.raw_current != self.raw_current:
+            self.raw_current = report.raw_current
+            self._set_line(CURRENT_LINE, report.get_current_weather())
+        self._set_line(HEADER_LINE, f"Next {len(entries)} hours in {report.loc_name}:")
+        # Parks the cursor below the table, so anything else printed doesn't land on it.
+        self.sink.write(weather_render.cursor_to(TABLE_TOP + len(entries)))
+        self.sink.flush()
+        weather_metrics.count("watch_cells", written)
+        return written
+
+
+def watch(
+    lat: float,
+    long: float,
+    interval: float = DEFAULT_INTERVAL,
+    hours: int = 24,
+    sink: TextIO = sys.stdout,
+    polls: Optional[int] = None,
+) -> None:
+    """Shows the weather at (lat, long) and updates it every `interval` seconds, forever or for `polls` polls."""
+    view = HourlyWatch(sink, hours)
+    sink.write(HIDE_CURSOR)
+    try:
+        poll = 0
+        while polls is None or poll < polls:
+            started = time.monotonic()
+            try:
+                view.show(weather.WeatherReport(lat, long, reports=WATCH_REPORTS))
+            except (weather_http.UpstreamError, ValueError):
+                # The last forecast stays on screen until the next poll gets through with a full report.
+                pass
+            poll += 1
+            if polls is None or poll < polls:
+                time.sleep(max(0.0, interval - (time.monotonic() - started)))
+    finally:
+        sink.write(SHOW_CURSOR)
+        sink.flush()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Keep the hourly weather report up to date in the terminal.")
+    parser.add_argument("lat", type=float)
+    parser.add_argument("long", type=float)
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL, help="seconds between polls")
+    parser.add_argument("--hours", type=int, default=24)
+    args = parser.parse_args(argv)
+    try:
+        watch(args.lat, args.long, args.interval, args.hours)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()